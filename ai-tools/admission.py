@@ -0,0 +1,141 @@
+"""Admission control and load shedding for /api/chat.
+
+A global gate caps the number of in-flight ``process_chat`` loops. Excess
+requests wait in a bounded priority queue (command confirmations ahead of
+new queries) with a per-request deadline; when the queue is full or the
+deadline passes the request is rejected fast with 503 + ``Retry-After``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from guardrails import MessageTier, classify_message, has_pending_confirmation
+from metrics import (
+    ADMISSION_IN_FLIGHT,
+    ADMISSION_QUEUE_DEPTH,
+    ADMISSION_REJECTED,
+    ADMISSION_WAIT_SECONDS,
+)
+from models import ChatRequest
+
+# Lower value = served first
+PRIORITY_CONFIRMATION = 0
+PRIORITY_DEFAULT = 1
+
+_PRIORITY_LABELS = {PRIORITY_CONFIRMATION: "confirmation", PRIORITY_DEFAULT: "default"}
+
+# Smoothing factor for the service-time average used in Retry-After
+_SERVICE_EWMA_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed; carries the Retry-After hint (seconds)."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Admission rejected: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def request_priority(request: ChatRequest) -> int:
+    """Confirmations of a pending command jump ahead of new queries."""
+    if has_pending_confirmation(request.chat_history):
+        tier = classify_message(request.message, has_pending_confirmation=True)
+        if tier == MessageTier.COMMAND:
+            return PRIORITY_CONFIRMATION
+    return PRIORITY_DEFAULT
+
+
+class AdmissionController:
+    """Concurrency gate with a bounded, prioritised wait queue."""
+
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._in_flight = 0
+        self._queued = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._avg_service_seconds = 5.0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def retry_after(self) -> int:
+        """Estimated seconds until a queued request would be admitted."""
+        backlog = self._queued + 1
+        estimate = self._avg_service_seconds * backlog / max(1, self.max_in_flight)
+        return max(1, math.ceil(estimate))
+
+    async def acquire(self, priority: int = PRIORITY_DEFAULT) -> None:
+        """Take a slot, waiting in the queue if needed; raise AdmissionRejected."""
+        label = _PRIORITY_LABELS.get(priority, str(priority))
+        if self._in_flight < self.max_in_flight and self._queued == 0:
+            self._in_flight += 1
+            ADMISSION_IN_FLIGHT.set(self._in_flight)
+            ADMISSION_WAIT_SECONDS.observe(0.0, priority=label)
+            return
+
+        if self._queued >= self.max_queue:
+            ADMISSION_REJECTED.inc(reason="queue_full", priority=label)
+            raise AdmissionRejected("queue_full", self.retry_after())
+
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self._queued += 1
+        ADMISSION_QUEUE_DEPTH.set(self._queued)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(fut, timeout=self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if fut.done() and not fut.cancelled():
+                # Slot was handed over as we gave up — pass it on
+                self.release()
+            else:
+                self._queued -= 1
+                ADMISSION_QUEUE_DEPTH.set(self._queued)
+            if isinstance(exc, asyncio.TimeoutError):
+                ADMISSION_REJECTED.inc(reason="queue_timeout", priority=label)
+                raise AdmissionRejected("queue_timeout", self.retry_after()) from None
+            raise
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start, priority=label)
+
+    def release(self, service_seconds: float | None = None) -> None:
+        """Free a slot, handing it directly to the best queued waiter."""
+        if service_seconds is not None:
+            self._avg_service_seconds += _SERVICE_EWMA_ALPHA * (
+                service_seconds - self._avg_service_seconds
+            )
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue  # timed out or cancelled while queued
+            self._queued -= 1
+            ADMISSION_QUEUE_DEPTH.set(self._queued)
+            fut.set_result(None)
+            return
+        self._in_flight -= 1
+        ADMISSION_IN_FLIGHT.set(self._in_flight)
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_DEFAULT) -> AsyncIterator[None]:
+        """``async with`` wrapper around acquire/release."""
+        await self.acquire(priority)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
@@ -0,0 +1,107 @@
+"""Scripted stand-in for ``anthropic.AsyncAnthropic``.
+
+Replays a fixed tool-use sequence: step *n* of the script answers the
+*n*-th Claude call of a request. The step index is derived from the
+conversation itself (tool-loop turns since the last plain user message), so
+one client can serve many concurrent requests and retries of the same turn
+replay the same step.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+from dataclasses import dataclass, field
+
+from anthropic.types import Message
+
+
+@dataclass(frozen=True)
+class ToolUse:
+    """A scripted ``tool_use`` turn."""
+
+    name: str
+    input: dict
+
+
+@dataclass(frozen=True)
+class Text:
+    """A scripted final text turn."""
+
+    text: str
+
+
+Step = ToolUse | Text
+
+_ids = itertools.count(1)
+
+
+def _estimate_tokens(payload) -> int:
+    """Rough token count (~4 chars/token) of a request payload."""
+    return max(1, len(json.dumps(payload, default=str, ensure_ascii=False)) // 4)
+
+
+def _step_index(messages: list[dict]) -> int:
+    """Number of tool-loop turns since the last plain-text user message."""
+    n = 0
+    for msg in reversed(messages):
+        if msg["role"] == "user" and isinstance(msg["content"], str):
+            break
+        if msg["role"] == "assistant":
+            n += 1
+    return n
+
+
+@dataclass
+class FakeMessages:
+    script: list[Step]
+    delay: float = 0.0
+    calls: list[dict] = field(default_factory=list)
+
+    async def create(self, **kwargs) -> Message:
+        self.calls.append(kwargs)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+        idx = _step_index(kwargs["messages"])
+        step = self.script[idx] if idx < len(self.script) else Text("Done.")
+        # Tools are not offered (greeting tier) → the model can only answer
+        if isinstance(step, ToolUse) and not kwargs.get("tools"):
+            step = Text("Hello! How can I help with your lighting today?")
+
+        input_tokens = _estimate_tokens(
+            [kwargs.get("system"), kwargs["messages"], kwargs.get("tools")]
+        )
+        if isinstance(step, ToolUse):
+            content = [{
+                "type": "tool_use",
+                "id": f"toolu_bench_{next(_ids)}",
+                "name": step.name,
+                "input": step.input,
+            }]
+            stop_reason = "tool_use"
+        else:
+            content = [{"type": "text", "text": step.text}]
+            stop_reason = "end_turn"
+
+        return Message.model_validate({
+            "id": f"msg_bench_{next(_ids)}",
+            "type": "message",
+            "role": "assistant",
+            "model": kwargs["model"],
+            "content": content,
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": input_tokens,
+                "output_tokens": _estimate_tokens(content),
+            },
+        })
+
+
+class FakeAsyncAnthropic:
+    """Drop-in for ``anthropic.AsyncAnthropic`` used by ``process_chat``."""
+
+    def __init__(self, script: list[Step], delay: float = 0.0):
+        self.messages = FakeMessages(script=list(script), delay=delay)
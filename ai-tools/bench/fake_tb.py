@@ -0,0 +1,322 @@
+"""Fake ThingsBoard REST server backed by a synthetic fleet.
+
+Implements the subset of the TB REST API used by ``tb_client.TBClient``.
+Run standalone (the benchmark runner starts it as a subprocess)::
+
+    python -m bench.fake_tb --devices 1000 --port 18080 --latency-ms 5
+
+Pass ``--legacy-relations`` to answer ``POST /api/relations/info`` and
+``GET /api/devices`` with 404, like TB versions without them.
+
+Attribute writes (device or asset, any scope) are stored with their write
+time as ``lastUpdateTs``; seeded attributes report a fixed older timestamp.
+
+``GET /bench/stats`` returns the number of TB API calls served (per endpoint
+class); ``POST /bench/reset`` zeroes the counters.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import time
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+
+from bench.fleet import Fleet, build_fleet
+from tb_client import endpoint_class
+
+# Spacing of raw (agg=NONE) telemetry points
+_RAW_POINT_INTERVAL_MS = 15 * 60 * 1000
+# lastUpdateTs of seeded values
+_SEED_TS = 1_700_000_000_000
+
+
+def _page(items: list, page: int, page_size: int) -> dict:
+    start = page * page_size
+    chunk = items[start:start + page_size]
+    total_pages = max(1, math.ceil(len(items) / page_size)) if page_size else 1
+    return {
+        "data": chunk,
+        "totalPages": total_pages,
+        "totalElements": len(items),
+        "hasNext": start + page_size < len(items),
+    }
+
+
+def create_app(fleet: Fleet, latency_ms: float = 0.0, legacy_relations: bool = False) -> FastAPI:
+    """Build the fake TB app serving *fleet*, adding *latency_ms* per call."""
+    app = FastAPI(title="Fake ThingsBoard")
+    stats: Counter[str] = Counter()
+    written: dict[tuple[str, str, str], int] = {}  # (entity, scope, key) → ts
+
+    def attr_ts(entity_id: str, scope: str, key: str) -> int:
+        return written.get((entity_id, scope, key), _SEED_TS)
+
+    @app.middleware("http")
+    async def latency_and_stats(request: Request, call_next):
+        path = request.url.path
+        if not path.startswith("/bench/"):
+            stats[endpoint_class(path)] += 1
+            if latency_ms:
+                await asyncio.sleep(latency_ms / 1000)
+        return await call_next(request)
+
+    def entity_or_404(entity_id: str, entity_type: str):
+        ent = fleet.entities.get(entity_id)
+        if ent is None or ent.entity_type != entity_type:
+            raise HTTPException(status_code=404, detail=f"{entity_type} {entity_id} not found")
+        return ent
+
+    # -- bench control -----------------------------------------------------
+
+    @app.get("/bench/stats")
+    async def bench_stats():
+        return {"total": sum(stats.values()), "by_endpoint": dict(stats)}
+
+    @app.post("/bench/reset")
+    async def bench_reset():
+        stats.clear()
+        return {"status": "ok"}
+
+    # -- auth --------------------------------------------------------------
+
+    @app.post("/api/auth/login")
+    async def login():
+        return {"token": "bench-token", "refreshToken": "bench-refresh"}
+
+    @app.get("/api/auth/user")
+    async def auth_user():
+        return {"email": "bench@example.com", "authority": "TENANT_ADMIN"}
+
+    # -- entities ----------------------------------------------------------
+
+    @app.get("/api/customer/{customer_id}")
+    async def get_customer(customer_id: str):
+        if customer_id != fleet.customer_id:
+            raise HTTPException(status_code=404)
+        return {
+            "id": {"id": fleet.customer_id, "entityType": "CUSTOMER"},
+            "title": fleet.customer_name,
+        }
+
+    @app.get("/api/customer/{customer_id}/assets")
+    async def get_customer_assets(customer_id: str, pageSize: int = 100, page: int = 0, type: str | None = None):
+        if customer_id != fleet.customer_id:
+            raise HTTPException(status_code=404)
+        assets = [
+            e.to_tb(fleet.customer_id) for e in fleet.entities.values()
+            if e.entity_type == "ASSET" and (type is None or e.type == type)
+        ]
+        return _page(assets, page, pageSize)
+
+    @app.get("/api/asset/{asset_id}")
+    async def get_asset(asset_id: str):
+        return entity_or_404(asset_id, "ASSET").to_tb(fleet.customer_id)
+
+    @app.get("/api/device/{device_id}")
+    async def get_device(device_id: str):
+        return entity_or_404(device_id, "DEVICE").to_tb(fleet.customer_id)
+
+    @app.get("/api/devices")
+    async def get_devices_by_ids(deviceIds: str):
+        if legacy_relations:
+            raise HTTPException(status_code=404)
+        return [
+            fleet.entities[d].to_tb(fleet.customer_id)
+            for d in deviceIds.split(",")
+            if d in fleet.entities and fleet.entities[d].entity_type == "DEVICE"
+        ]
+
+    # -- relations ---------------------------------------------------------
+
+    def relation(parent, child, names: bool = True) -> dict:
+        rel = {
+            "from": {"id": parent.id, "entityType": parent.entity_type},
+            "to": {"id": child.id, "entityType": child.entity_type},
+            "type": "Contains",
+            "typeGroup": "COMMON",
+        }
+        if names:  # only the relations query returns names
+            rel.update(fromName=parent.name, toName=child.name)
+        return rel
+
+    @app.get("/api/relations")
+    async def get_relations(
+        fromId: str | None = None,
+        fromType: str | None = None,
+        toId: str | None = None,
+        toType: str | None = None,
+        relationType: str = "Contains",
+        relationTypeGroup: str = "COMMON",
+    ):
+        if toId is not None:
+            ent = entity_or_404(toId, toType)
+            if ent.parent is None:
+                return []
+            return [relation(fleet.entities[ent.parent], ent, names=False)]
+        ent = entity_or_404(fromId, fromType)
+        return [relation(ent, fleet.entities[cid], names=False) for cid in ent.children]
+
+    @app.post("/api/relations/info")
+    async def find_relations_info(request: Request):
+        if legacy_relations:
+            raise HTTPException(status_code=404)
+        params = (await request.json())["parameters"]
+        root = entity_or_404(params["rootId"], params["rootType"])
+        result: list[dict] = []
+        level, max_level = [root], params.get("maxLevel", 1)
+        for depth in range(1, max_level + 1):
+            below = []
+            for ent in level:
+                if params.get("direction") == "TO":
+                    pairs = [(fleet.entities[ent.parent], ent)] if ent.parent else []
+                    nxt = [p for p, _ in pairs]
+                else:
+                    pairs = [(ent, fleet.entities[cid]) for cid in ent.children]
+                    nxt = [c for _, c in pairs]
+                if depth == max_level or not params.get("fetchLastLevelOnly"):
+                    result.extend(relation(p, c) for p, c in pairs)
+                below.extend(nxt)
+            level = below
+        return result
+
+    # -- telemetry ---------------------------------------------------------
+
+    @app.get("/api/plugins/telemetry/{entity_type}/{entity_id}/values/timeseries")
+    async def get_timeseries(
+        entity_type: str,
+        entity_id: str,
+        keys: str,
+        startTs: int | None = None,
+        endTs: int | None = None,
+        agg: str = "NONE",
+        interval: int | None = None,
+        limit: int = 100,
+    ):
+        ent = entity_or_404(entity_id, entity_type)
+        key_list = [k for k in keys.split(",") if k]
+        result: dict[str, list[dict]] = {}
+
+        if startTs is None or endTs is None:
+            for key in key_list:
+                val = fleet.latest(ent.id, key) if ent.entity_type == "DEVICE" else None
+                if val is not None:
+                    result[key] = [{"ts": 1_700_000_000_000, "value": str(val)}]
+            return result
+
+        if agg == "NONE":
+            step = _RAW_POINT_INTERVAL_MS
+        else:
+            step = max(1, interval or (endTs - startTs))
+        n_buckets = min(limit, max(1, math.ceil((endTs - startTs) / step)))
+        for key in key_list:
+            base = fleet.latest(ent.id, key) if ent.entity_type == "DEVICE" else None
+            if base is None:
+                base = 100.0 if "wh" in key or "grams" in key or "cost" in key else None
+            if base is None:
+                continue
+            result[key] = [
+                {"ts": startTs + i * step, "value": str(round(base * (1 + 0.1 * ((i % 7) - 3)), 3))}
+                for i in range(n_buckets)
+            ]
+        return result
+
+    # -- attributes --------------------------------------------------------
+
+    @app.get("/api/plugins/telemetry/{entity_type}/{entity_id}/values/attributes/{scope}")
+    async def get_attributes(entity_type: str, entity_id: str, scope: str, keys: str | None = None):
+        entity_or_404(entity_id, entity_type)
+        attrs = fleet.attributes.get((entity_id, scope), {})
+        wanted = set(keys.split(",")) if keys else None
+        return [
+            {"key": k, "value": v, "lastUpdateTs": attr_ts(entity_id, scope, k)}
+            for k, v in attrs.items() if wanted is None or k in wanted
+        ]
+
+    @app.post("/api/entitiesQuery/find")
+    async def find_entity_data(request: Request):
+        query = await request.json()
+        ids = [i for i in query["entityFilter"].get("entityList", []) if i in fleet.entities]
+        page_link = query.get("pageLink", {})
+        body = _page(ids, page_link.get("page", 0), page_link.get("pageSize", 100))
+        rows = []
+        for entity_id in body["data"]:
+            latest: dict[str, dict] = {}
+            for value_key in query.get("latestValues", []):
+                key = value_key["key"]
+                if value_key["type"] == "TIME_SERIES":
+                    val = fleet.latest(entity_id, key)
+                    cell = (
+                        {"ts": 1_700_000_000_000, "value": str(val)}
+                        if val is not None else {"ts": 0, "value": ""}
+                    )
+                    latest.setdefault("TIME_SERIES", {})[key] = cell
+                    continue
+                scope = value_key["type"].replace("_ATTRIBUTE", "_SCOPE")
+                attrs = fleet.attributes.get((entity_id, scope), {})
+                cell = (
+                    {"ts": attr_ts(entity_id, scope, key), "value": str(attrs[key])}
+                    if key in attrs else {"ts": 0, "value": ""}
+                )
+                latest.setdefault(value_key["type"], {})[key] = cell
+            rows.append({
+                "entityId": {"id": entity_id, "entityType": fleet.entities[entity_id].entity_type},
+                "latest": latest,
+            })
+        body["data"] = rows
+        return body
+
+    @app.post("/api/plugins/telemetry/{entity_type}/{entity_id}/attributes/{scope}")
+    async def post_attributes(entity_type: str, entity_id: str, scope: str, request: Request):
+        entity_or_404(entity_id, entity_type)
+        body = json.loads(await request.body() or b"{}")
+        fleet.attributes.setdefault((entity_id, scope), {}).update(body)
+        now = int(time.time() * 1000)
+        for key in body:
+            written[(entity_id, scope, key)] = now
+        return {}
+
+    # -- alarms ------------------------------------------------------------
+
+    @app.get("/api/alarm/{entity_type}/{entity_id}")
+    async def get_entity_alarms(entity_type: str, entity_id: str, pageSize: int = 100, page: int = 0, searchStatus: str | None = None):
+        entity_or_404(entity_id, entity_type)
+        return _page(fleet.alarms.get(entity_id, []), page, pageSize)
+
+    @app.get("/api/alarms")
+    async def get_all_alarms(pageSize: int = 100, page: int = 0, searchStatus: str | None = None):
+        every = [a for alarms in fleet.alarms.values() for a in alarms]
+        return _page(every, page, pageSize)
+
+    @app.post("/api/rpc/oneway/{device_id}")
+    async def rpc_oneway(device_id: str):
+        entity_or_404(device_id, "DEVICE")
+        return {}
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--legacy-relations", action="store_true",
+                        help="404 the relations query and bulk device lookup")
+    args = parser.parse_args()
+
+    app = create_app(
+        build_fleet(args.devices),
+        latency_ms=args.latency_ms,
+        legacy_relations=args.legacy_relations,
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Fake The Things Stack (TTS) Network Server registry for multicast tests.
+
+Answers the one TTS call ai-tools makes: the multicast readiness check
+``GET /api/v3/ns/applications/{app}/devices/{device_id}``. Run standalone
+and point ``TTS_BASE_URL`` at it::
+
+    python -m bench.fake_tts --port 18081 --app signconnect --group mc-0123abcd
+
+Each ``--group`` is a multicast Class C end device. ``POST /bench/groups``
+(``{"device_id", "multicast", "supports_class_c"}``) adds or replaces one,
+``DELETE /bench/groups/{device_id}`` removes it, and ``GET /bench/stats``
+returns the number of registry reads per device.
+"""
+
+from __future__ import annotations
+
+import argparse
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI, Header, HTTPException, Request
+
+
+def create_app(app_id: str, groups: list[str] = (), api_key: str = "bench-key") -> FastAPI:
+    """Build the fake TTS app for application *app_id*."""
+    app = FastAPI(title="Fake The Things Stack")
+    devices: dict[str, dict] = {
+        g: {"multicast": True, "supports_class_c": True} for g in groups
+    }
+    reads: Counter[str] = Counter()
+
+    # -- bench control -----------------------------------------------------
+
+    @app.get("/bench/stats")
+    async def bench_stats():
+        return {"reads": dict(reads)}
+
+    @app.post("/bench/groups")
+    async def put_group(request: Request):
+        body = await request.json()
+        devices[body["device_id"]] = {
+            "multicast": body.get("multicast", True),
+            "supports_class_c": body.get("supports_class_c", True),
+        }
+        return {"status": "ok"}
+
+    @app.delete("/bench/groups/{device_id}")
+    async def delete_group(device_id: str):
+        devices.pop(device_id, None)
+        return {"status": "ok"}
+
+    # -- Network Server registry -------------------------------------------
+
+    @app.get("/api/v3/ns/applications/{application_id}/devices/{device_id}")
+    async def get_ns_device(
+        application_id: str,
+        device_id: str,
+        field_mask: str = "",
+        authorization: str | None = Header(default=None),
+    ):
+        if authorization != f"Bearer {api_key}":
+            raise HTTPException(status_code=401, detail="unauthenticated")
+        reads[device_id] += 1
+        dev = devices.get(device_id) if application_id == app_id else None
+        if dev is None:
+            raise HTTPException(status_code=404, detail=f"end device {device_id} not found")
+        fields = [f for f in field_mask.split(",") if f] or list(dev)
+        return {
+            "ids": {
+                "device_id": device_id,
+                "application_ids": {"application_id": application_id},
+            },
+            **{f: dev[f] for f in fields if f in dev},
+        }
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=18081)
+    parser.add_argument("--app", default="signconnect", help="TTS application ID")
+    parser.add_argument("--api-key", default="bench-key")
+    parser.add_argument("--group", action="append", default=[],
+                        help="multicast end-device ID (repeatable)")
+    args = parser.parse_args()
+
+    app = create_app(args.app, args.group, api_key=args.api_key)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
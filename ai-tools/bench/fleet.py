@@ -0,0 +1,138 @@
+"""Deterministic synthetic SignConnect fleets for the fake ThingsBoard server."""
+
+from __future__ import annotations
+
+import math
+import uuid
+from dataclasses import dataclass, field
+
+_NAMESPACE = uuid.UUID("6f1c2a3e-0d4b-4c6e-9a57-2b0c4f3d1e10")
+
+LATEST_KEYS = {
+    "power_watts": lambda i: round(20 + (i * 7) % 40 + 0.5, 1),
+    "dim_value": lambda i: float((i * 10) % 110),
+    "energy_wh": lambda i: float(150 + (i * 13) % 300),
+    "saving_pct": lambda i: float(40 + (i * 3) % 50),
+    "driver_temperature": lambda i: float(35 + (i * 11) % 30),
+}
+
+
+def _uid(kind: str, n: int) -> str:
+    return str(uuid.uuid5(_NAMESPACE, f"{kind}-{n}"))
+
+
+@dataclass
+class Entity:
+    id: str
+    entity_type: str  # "ASSET" / "DEVICE"
+    name: str
+    type: str         # asset type (estate/region/site) or device profile
+    index: int
+    children: list[str] = field(default_factory=list)
+    parent: str | None = None
+
+    def to_tb(self, customer_id: str) -> dict:
+        """Render as a TB REST entity (``/api/asset/{id}`` / ``/api/device/{id}``)."""
+        return {
+            "id": {"id": self.id, "entityType": self.entity_type},
+            "name": self.name,
+            "type": self.type,
+            "label": self.name,
+            "customerId": {"id": customer_id, "entityType": "CUSTOMER"},
+        }
+
+
+@dataclass
+class Fleet:
+    """One customer: estate → regions → sites → devices."""
+
+    customer_id: str
+    customer_name: str
+    entities: dict[str, Entity]
+    estate_ids: list[str]
+    region_ids: list[str]
+    site_ids: list[str]
+    device_ids: list[str]
+    # device_id → list of alarm dicts
+    alarms: dict[str, list[dict]]
+    # (entity_id, scope) → {key: value}
+    attributes: dict[tuple[str, str], dict]
+
+    def latest(self, device_id: str, key: str) -> float | None:
+        fn = LATEST_KEYS.get(key)
+        if fn is None:
+            return None
+        return fn(self.entities[device_id].index)
+
+
+def build_fleet(devices: int, devices_per_site: int = 20, sites_per_region: int = 10) -> Fleet:
+    """Build a deterministic fleet with *devices* lighting controllers."""
+    customer_id = _uid("customer", devices)
+    entities: dict[str, Entity] = {}
+
+    n_sites = max(1, math.ceil(devices / devices_per_site))
+    n_regions = max(1, math.ceil(n_sites / sites_per_region))
+
+    estate = Entity(_uid("estate", 0), "ASSET", "Main Estate", "estate", 0)
+    entities[estate.id] = estate
+
+    region_ids: list[str] = []
+    for r in range(n_regions):
+        region = Entity(_uid("region", r), "ASSET", f"Region {r + 1}", "region", r, parent=estate.id)
+        entities[region.id] = region
+        estate.children.append(region.id)
+        region_ids.append(region.id)
+
+    site_ids: list[str] = []
+    for s in range(n_sites):
+        region = entities[region_ids[s // sites_per_region]]
+        site = Entity(_uid("site", s), "ASSET", f"Site {s + 1:04d}", "site", s, parent=region.id)
+        entities[site.id] = site
+        region.children.append(site.id)
+        site_ids.append(site.id)
+
+    device_ids: list[str] = []
+    alarms: dict[str, list[dict]] = {}
+    attributes: dict[tuple[str, str], dict] = {}
+    for d in range(devices):
+        site = entities[site_ids[d // devices_per_site]]
+        profile = "signconnect-plus" if d % 3 == 0 else "signconnect-standard"
+        dev = Entity(_uid("device", d), "DEVICE", f"Light {d + 1:05d}", profile, d, parent=site.id)
+        entities[dev.id] = dev
+        site.children.append(dev.id)
+        device_ids.append(dev.id)
+
+        attributes[(dev.id, "SERVER_SCOPE")] = {
+            "active": d % 10 != 9,
+            "dashboard_tier": "plus" if d % 3 == 0 else "standard",
+            "reference_power_watts": 60,
+            "co2_per_kwh": 0.233,
+            # The second site's first controller is Class A: that site dims unicast
+            "supports_class_c": d != devices_per_site,
+        }
+        attributes[(dev.id, "SHARED_SCOPE")] = {"dimLevel": int(LATEST_KEYS["dim_value"](d))}
+        attributes[(dev.id, "CLIENT_SCOPE")] = {}
+
+        if d % 17 == 0:
+            alarms[dev.id] = [{
+                "id": {"id": _uid("alarm", d), "entityType": "ALARM"},
+                "type": "Lamp Failure" if d % 2 else "Driver Overheat",
+                "severity": "MAJOR" if d % 2 else "WARNING",
+                "status": "ACTIVE_UNACK",
+                "originator": {"id": dev.id, "entityType": "DEVICE"},
+                "originatorName": dev.name,
+                "createdTime": 1_700_000_000_000 + d,
+                "details": {},
+            }]
+
+    return Fleet(
+        customer_id=customer_id,
+        customer_name=f"Bench Customer ({devices} devices)",
+        entities=entities,
+        estate_ids=[estate.id],
+        region_ids=region_ids,
+        site_ids=site_ids,
+        device_ids=device_ids,
+        alarms=alarms,
+        attributes=attributes,
+    )
@@ -0,0 +1,240 @@
+"""Offline benchmark for ``process_chat`` — no live ThingsBoard or Anthropic.
+
+For each fleet size a fake TB server (``bench.fake_tb``) is started as a
+subprocess; each scenario then drives ``process_chat`` with a scripted
+``FakeAsyncAnthropic`` and reports p50/p95/p99 latency, TB calls per
+request and peak Python heap (tracemalloc) of the chat pipeline.
+
+Run from the ai-tools directory::
+
+    python -m bench.run_bench --fleet-sizes 10,100,1000 --requests 20
+    python -m bench.run_bench --scenarios site_summary --fleet-sizes 10000 \\
+        --tb-latency-ms 5 --claude-delay 0.8 --json results.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import httpx
+
+import cache
+import chat
+import config
+from bench.fake_anthropic import FakeAsyncAnthropic
+from bench.fleet import build_fleet
+from bench.scenarios import SCENARIOS, Scenario
+from models import ChatRequest, EntityContext
+from tb_client import TBClient
+
+AI_TOOLS_DIR = Path(__file__).resolve().parent.parent
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of *values* (0 < pct <= 100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _reset_state() -> None:
+    """Clear process-wide caches so each scenario starts cold."""
+    cache._hierarchy_cache.clear()
+    cache._entity_cache.clear()
+    cache._verified_customers.clear()
+    cache._scope_cache.clear()
+    chat._customer_request_log.clear()
+
+
+class FakeTBServer:
+    """Fake TB server subprocess for one fleet size."""
+
+    def __init__(self, devices: int, latency_ms: float, legacy_relations: bool = False):
+        self.devices = devices
+        self.latency_ms = latency_ms
+        self.legacy_relations = legacy_relations
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._proc: subprocess.Popen | None = None
+
+    async def __aenter__(self) -> "FakeTBServer":
+        self._proc = subprocess.Popen(
+            [
+                sys.executable, "-m", "bench.fake_tb",
+                "--devices", str(self.devices),
+                "--port", str(self.port),
+                "--latency-ms", str(self.latency_ms),
+                *(["--legacy-relations"] if self.legacy_relations else []),
+            ],
+            cwd=AI_TOOLS_DIR,
+        )
+        async with httpx.AsyncClient() as client:
+            for _ in range(200):
+                try:
+                    await client.get(f"{self.url}/bench/stats")
+                    return self
+                except httpx.TransportError:
+                    await asyncio.sleep(0.05)
+        raise RuntimeError("fake TB server did not start")
+
+    async def __aexit__(self, *exc) -> None:
+        if self._proc is not None:
+            self._proc.terminate()
+            self._proc.wait(timeout=10)
+
+    async def calls(self) -> int:
+        async with httpx.AsyncClient() as client:
+            return (await client.get(f"{self.url}/bench/stats")).json()["total"]
+
+    async def reset(self) -> None:
+        async with httpx.AsyncClient() as client:
+            await client.post(f"{self.url}/bench/reset")
+
+
+async def run_scenario(
+    scenario: Scenario,
+    server: FakeTBServer,
+    requests: int,
+    concurrency: int,
+    claude_delay: float,
+    measure_memory: bool,
+) -> dict:
+    """Run *requests* chats of *scenario* and return its statistics."""
+    fleet = build_fleet(server.devices)
+    _reset_state()
+    tb = TBClient(base_url=server.url, username="bench", password="bench")
+    await tb.authenticate()
+    await server.reset()
+
+    latencies: list[float] = []
+    claude_calls = 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        nonlocal claude_calls
+        ac = FakeAsyncAnthropic(scenario.script(fleet, i), delay=claude_delay)
+        req = ChatRequest(
+            message=scenario.message,
+            context=EntityContext(**scenario.context(fleet, i)),
+        )
+        async with sem:
+            start = time.perf_counter()
+            await chat.process_chat(req, tb, ac)
+            latencies.append(time.perf_counter() - start)
+        claude_calls += len(ac.messages.calls)
+
+    if measure_memory:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    wall = time.perf_counter() - wall_start
+    peak = tracemalloc.get_traced_memory()[1] if measure_memory else 0
+    if measure_memory:
+        tracemalloc.stop()
+
+    tb_calls = await server.calls()
+    await tb.close()
+
+    return {
+        "scenario": scenario.name,
+        "devices": server.devices,
+        "requests": requests,
+        "concurrency": concurrency,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+        "throughput_rps": round(requests / wall, 2) if wall else 0.0,
+        "tb_calls_per_request": round(tb_calls / requests, 1),
+        "claude_calls_per_request": round(claude_calls / requests, 2),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+def _print_table(rows: list[dict]) -> None:
+    cols = [
+        ("scenario", 16), ("devices", 8), ("p50_ms", 9), ("p95_ms", 9),
+        ("p99_ms", 9), ("tb_calls_per_request", 10), ("claude_calls_per_request", 8),
+        ("peak_memory_kb", 10),
+    ]
+    headers = {
+        "tb_calls_per_request": "tb/req",
+        "claude_calls_per_request": "llm/req",
+        "peak_memory_kb": "peak_kb",
+    }
+    print("  ".join(headers.get(c, c).rjust(w) for c, w in cols))
+    for row in rows:
+        print("  ".join(str(row[c]).rjust(w) for c, w in cols))
+
+
+async def main_async(args: argparse.Namespace) -> list[dict]:
+    # The benchmark fires many requests per customer — lift per-customer limits
+    config.RATE_LIMIT_PER_CUSTOMER = 10 ** 9
+    config.FAST_PATH_ENABLED = not args.no_fast_path
+    config.PREFETCH_ENABLED = not args.no_prefetch
+
+    names = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenario(s): {', '.join(unknown)}")
+
+    rows: list[dict] = []
+    for devices in [int(n) for n in args.fleet_sizes.split(",")]:
+        async with FakeTBServer(devices, args.tb_latency_ms, args.legacy_relations) as server:
+            for name in names:
+                row = await run_scenario(
+                    SCENARIOS[name], server, args.requests, args.concurrency,
+                    args.claude_delay, not args.no_memory,
+                )
+                rows.append(row)
+                print(json.dumps(row), file=sys.stderr)
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline process_chat benchmark")
+    parser.add_argument("--fleet-sizes", default="10,100,1000",
+                        help="Comma-separated device counts (10..10000)")
+    parser.add_argument("--scenarios", default="",
+                        help=f"Comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--claude-delay", type=float, default=0.0,
+                        help="Seconds per fake Claude call")
+    parser.add_argument("--tb-latency-ms", type=float, default=1.0,
+                        help="Added latency per fake TB request")
+    parser.add_argument("--no-fast-path", action="store_true")
+    parser.add_argument("--no-prefetch", action="store_true")
+    parser.add_argument("--legacy-relations", action="store_true",
+                        help="Fake TB without the relations query (per-node hierarchy walk)")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Skip tracemalloc (lower overhead, no peak memory)")
+    parser.add_argument("--json", metavar="PATH", help="Also write results as JSON")
+    args = parser.parse_args()
+
+    rows = asyncio.run(main_async(args))
+    _print_table(rows)
+    if args.json:
+        Path(args.json).write_text(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Benchmark scenarios: a message, a widget context and a Claude script.
+
+Context and script builders receive the fleet and the request index so
+consecutive requests rotate over different sites / devices.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable
+
+from bench.fake_anthropic import Step, Text, ToolUse
+from bench.fleet import Fleet
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    message: str
+    context: Callable[[Fleet, int], dict]
+    script: Callable[[Fleet, int], list[Step]]
+    description: str = ""
+
+
+def _site(fleet: Fleet, i: int) -> str:
+    return fleet.site_ids[i % len(fleet.site_ids)]
+
+
+def _device(fleet: Fleet, i: int) -> str:
+    return fleet.device_ids[(i * 7) % len(fleet.device_ids)]
+
+
+def _customer_ctx(fleet: Fleet) -> dict:
+    return {"customer_id": fleet.customer_id, "customer_name": fleet.customer_name}
+
+
+def _site_ctx(fleet: Fleet, i: int) -> dict:
+    sid = _site(fleet, i)
+    return {
+        **_customer_ctx(fleet),
+        "entity_id": sid,
+        "entity_type": "ASSET",
+        "entity_subtype": "site",
+        "entity_name": fleet.entities[sid].name,
+    }
+
+
+def _device_ctx(fleet: Fleet, i: int) -> dict:
+    did = _device(fleet, i)
+    return {
+        **_customer_ctx(fleet),
+        "entity_id": did,
+        "entity_type": "DEVICE",
+        "entity_name": fleet.entities[did].name,
+    }
+
+
+SCENARIOS: dict[str, Scenario] = {s.name: s for s in [
+    Scenario(
+        name="greeting",
+        message="Hello! What can you help me with?",
+        context=lambda f, i: _customer_ctx(f),
+        script=lambda f, i: [Text("Hi! I can help with your lighting and energy data.")],
+        description="Greeting tier, no tools",
+    ),
+    Scenario(
+        name="device_alarms",
+        message="Any active alarms?",
+        context=_device_ctx,
+        script=lambda f, i: [
+            ToolUse("get_alarms", {
+                "entity_id": _device(f, i), "entity_type": "DEVICE", "status": "ACTIVE",
+            }),
+            Text("There are no active alarms on this light."),
+        ],
+        description="Single-entity alarm lookup (fast-path eligible)",
+    ),
+    Scenario(
+        name="site_summary",
+        message="How is this site doing?",
+        context=_site_ctx,
+        script=lambda f, i: [
+            ToolUse("get_site_summary", {"site_id": _site(f, i), "time_range": "today"}),
+            Text("This site is running normally."),
+        ],
+        description="One site summary (per-device fan-out)",
+    ),
+    Scenario(
+        name="device_history",
+        message="Show me the power trend for this light over the last 30 days",
+        context=_device_ctx,
+        script=lambda f, i: [
+            ToolUse("get_device_telemetry", {
+                "device_id": _device(f, i),
+                "keys": ["power_watts"],
+                "time_range": "last_30_days",
+                "aggregation": "NONE",
+            }),
+            Text("Power has been stable over the last 30 days."),
+        ],
+        description="Large raw telemetry series returned to the model",
+    ),
+    Scenario(
+        name="site_savings",
+        message="What are the energy savings at this site this week?",
+        context=_site_ctx,
+        script=lambda f, i: [
+            ToolUse("get_energy_savings", {
+                "entity_id": _site(f, i), "entity_type": "ASSET", "time_range": "this_week",
+            }),
+            Text("This site saved energy this week."),
+        ],
+        description="Site savings (per-device fan-out)",
+    ),
+    Scenario(
+        name="compare_sites",
+        message="Compare all sites in the first region this month",
+        context=lambda f, i: _customer_ctx(f),
+        script=lambda f, i: [
+            ToolUse("compare_sites", {
+                "site_ids": f.entities[f.region_ids[0]].children[:10],
+                "time_range": "this_month",
+            }),
+            Text("Here is the comparison."),
+        ],
+        description="Up to 10 site summaries in one tool call",
+    ),
+    Scenario(
+        name="dim_preview",
+        message="Dim this site to 50%",
+        context=_site_ctx,
+        script=lambda f, i: [
+            ToolUse("send_dim_command", {"device_id": _site(f, i), "dim_value": 50}),
+            Text("Please confirm: set all devices at this site to 50%."),
+        ],
+        description="Command tier, confirmation preview",
+    ),
+]}
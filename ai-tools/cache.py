@@ -25,6 +25,26 @@ def set_cached_hierarchy(customer_id: str, data: dict) -> None:
     _hierarchy_cache[customer_id] = (data, time.time())
 
 
+# ---------------------------------------------------------------------------
+# Scoped hierarchy cache ((customer_id, entity_id) → one site's branch)
+# ---------------------------------------------------------------------------
+
+_scope_cache: dict[tuple[str, str], tuple[dict, float]] = {}
+
+
+def get_cached_scope(customer_id: str, entity_id: str) -> dict | None:
+    """Return the cached branch for a site/device context, or None."""
+    entry = _scope_cache.get((customer_id, entity_id))
+    if entry and (time.time() - entry[1]) < HIERARCHY_TTL:
+        return entry[0]
+    return None
+
+
+def set_cached_scope(customer_id: str, entity_id: str, data: dict) -> None:
+    """Store a context's hierarchy branch with current timestamp."""
+    _scope_cache[(customer_id, entity_id)] = (data, time.time())
+
+
 # ---------------------------------------------------------------------------
 # Entity cache (device / asset lookups)
 # ---------------------------------------------------------------------------
@@ -46,6 +66,25 @@ def set_cached_entity(entity_id: str, data: dict) -> None:
     _entity_cache[entity_id] = (data, time.time())
 
 
+# ---------------------------------------------------------------------------
+# Verified customers (customer isolation check)
+# ---------------------------------------------------------------------------
+
+_verified_customers: dict[str, float] = {}
+CUSTOMER_TTL = 60  # 1 minute
+
+
+def is_customer_verified(customer_id: str) -> bool:
+    """True if *customer_id* was found in TB within the last CUSTOMER_TTL."""
+    verified = _verified_customers.get(customer_id)
+    return verified is not None and (time.time() - verified) < CUSTOMER_TTL
+
+
+def mark_customer_verified(customer_id: str) -> None:
+    """Record that *customer_id* exists in TB."""
+    _verified_customers[customer_id] = time.time()
+
+
 # ---------------------------------------------------------------------------
 # Hierarchy membership helpers (for customer isolation)
 # ---------------------------------------------------------------------------
@@ -61,6 +100,17 @@ def get_hierarchy_entity_ids(customer_id: str) -> set[str] | None:
     return ids
 
 
+def get_scope_entity_ids(customer_id: str, entity_id: str) -> set[str] | None:
+    """Return the IDs in a context's cached branch, or None."""
+    scope = get_cached_scope(customer_id, entity_id)
+    if scope is None:
+        return None
+
+    ids: set[str] = set()
+    _collect_ids(scope, ids)
+    return ids
+
+
 def _collect_ids(node: dict, ids: set[str]) -> None:
     """Recursively collect all 'id' fields and device IDs from hierarchy."""
     if "customer_id" in node:
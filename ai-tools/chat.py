@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
 import time
@@ -12,26 +13,49 @@ import httpx
 import config
 from cache import (
     get_cached_hierarchy,
+    get_cached_scope,
     get_hierarchy_entity_ids,
+    get_scope_entity_ids,
+    is_customer_verified,
+    mark_customer_verified,
     set_cached_hierarchy,
+    set_cached_scope,
 )
+from fast_path import Intent, match_intent, try_fast_path
 from guardrails import (
-    REJECTION_RESPONSE,
     REJECTION_SUGGESTIONS,
     MessageTier,
-    classify_message,
-    is_on_topic,
-    sanitize_input,
+    check_message,
+    has_pending_confirmation,
+)
+from metrics import (
+    CHAT_REQUEST_SECONDS,
+    CHAT_REQUESTS_TOTAL,
+    CLAUDE_CALL_SECONDS,
+    FAST_PATH_TOTAL,
+    GUARDRAIL_SECONDS,
+    HIERARCHY_LOAD_SECONDS,
+    ITERATIONS_PER_REQUEST,
+    ROUTE_COST_USD,
+    ROUTE_ESCALATIONS,
+    ROUTE_SECONDS,
+    TOKENS_TOTAL,
+    TOOL_SCHEMA_TOKENS,
 )
 from models import (
     ChatMetadata,
     ChatRequest,
     ChatResponse,
+    EntityContext,
     EntityReference,
 )
+from prefetch import PrefetchMemo, warm
+from progress import emit
 from prompts import build_system_prompt
+from routing import escalate, estimate_cost, select_route
 from tb_client import TBClient
-from tools import ALL_TOOLS, READ_ONLY_TOOLS, TOOL_DEFINITIONS, execute_tool
+from tool_selection import EXPAND_TOOL_NAME, select_tools
+from tools import execute_tool, scoped_hierarchy
 
 logger = logging.getLogger(__name__)
 
@@ -72,6 +96,14 @@ RATE_LIMIT_RESPONSE = (
 )
 
 
+def _record_request(tier: str, started: float, iterations: int | None = None) -> None:
+    """Record per-request tier, latency and loop-iteration metrics."""
+    CHAT_REQUESTS_TOTAL.inc(tier=tier)
+    CHAT_REQUEST_SECONDS.observe(time.perf_counter() - started, tier=tier)
+    if iterations is not None:
+        ITERATIONS_PER_REQUEST.observe(iterations, tier=tier)
+
+
 async def process_chat(
     request: ChatRequest,
     tb_client: TBClient,
@@ -82,6 +114,7 @@ async def process_chat(
     Pipeline:
     1. Topic guard — reject off-topic messages (no Claude call).
     2. Input sanitization — block prompt injection attempts.
+       Steps 1-2 and tier classification share one guardrail scan.
     3. Per-customer rate limit check.
     4. Customer isolation — validate customer_id exists.
     5. Hierarchy cache — fetch or use cached hierarchy.
@@ -91,32 +124,31 @@ async def process_chat(
     """
     ctx = request.context
     request_start = time.time()
+    perf_start = time.perf_counter()
 
-    # -- 1. Topic guard ---------------------------------------------------
-    if not is_on_topic(request.message):
-        return ChatResponse(
-            response=REJECTION_RESPONSE,
-            metadata=ChatMetadata(suggestions=REJECTION_SUGGESTIONS),
-        )
+    # -- 1-2. Guardrails — topic, length, injection + tier in one scan ----
+    chat_history = request.chat_history
+    if len(chat_history) > config.MAX_CHAT_HISTORY_MESSAGES:
+        chat_history = chat_history[-config.MAX_CHAT_HISTORY_MESSAGES:]
+    pending_confirmation = has_pending_confirmation(chat_history)
 
-    # -- 2. Prompt injection protection -----------------------------------
-    is_safe, result = sanitize_input(request.message)
-    if not is_safe:
+    with GUARDRAIL_SECONDS.time(stage="scan"):
+        guard = check_message(request.message, pending_confirmation)
+    if guard.rejection is not None:
+        outcome = MessageTier.OFF_TOPIC.value if guard.reason == "off_topic" else "rejected"
+        _record_request(outcome, perf_start)
         return ChatResponse(
-            response=result,
+            response=guard.rejection,
             metadata=ChatMetadata(suggestions=REJECTION_SUGGESTIONS),
         )
     # Use the cleaned message from here on
-    user_message = result
-
-    # -- 2b. Trim chat history to last N messages -------------------------
-    chat_history = request.chat_history
-    if len(chat_history) > config.MAX_CHAT_HISTORY_MESSAGES:
-        chat_history = chat_history[-config.MAX_CHAT_HISTORY_MESSAGES:]
+    user_message = guard.cleaned
+    tier = guard.tier
 
     # -- 3. Per-customer rate limit ---------------------------------------
     customer_id = ctx.customer_id if ctx else None
     if customer_id and not _check_customer_rate(customer_id):
+        _record_request("rate_limited", perf_start)
         return ChatResponse(
             response=RATE_LIMIT_RESPONSE,
             metadata=ChatMetadata(suggestions=[]),
@@ -125,61 +157,44 @@ async def process_chat(
     # -- 4. Customer isolation — validate customer exists -----------------
     if customer_id:
         try:
-            await tb_client.get_customer(customer_id)
+            await _verify_customer(customer_id, tb_client)
         except httpx.HTTPStatusError:
+            _record_request("rejected", perf_start)
             return ChatResponse(
                 response="Unable to verify your account. Please refresh and try again.",
                 metadata=ChatMetadata(suggestions=[]),
             )
 
+    # -- 4b. LLM-free fast path for unambiguous single-entity intents -----
+    # Never while a command awaits confirmation — the reply confirms it
+    if config.FAST_PATH_ENABLED and not pending_confirmation:
+        fast = await _try_fast_path(user_message, ctx, tb_client, customer_id, tier)
+        if fast is not None:
+            _record_request("fast_path", perf_start, 0)
+            return fast
+
     # -- 5. Hierarchy cache -----------------------------------------------
     hierarchy_data = None
     if customer_id:
-        hierarchy_data = get_cached_hierarchy(customer_id)
-        if hierarchy_data is None:
-            try:
-                hierarchy_data = await execute_tool(
-                    "get_hierarchy",
-                    {"customer_id": customer_id},
-                    tb_client,
-                    ctx,
-                )
-                if "error" not in hierarchy_data:
-                    set_cached_hierarchy(customer_id, hierarchy_data)
-                    logger.info("Fetched + cached hierarchy for customer %s", customer_id)
-                else:
-                    logger.warning("Hierarchy fetch returned error: %s", hierarchy_data.get("error"))
-                    hierarchy_data = None
-            except Exception:
-                logger.warning("Failed to fetch hierarchy", exc_info=True)
-                hierarchy_data = None
-        else:
-            logger.debug("Using cached hierarchy for customer %s", customer_id)
-
-    # -- 5b. Classify message tier for smart tool routing -----------------
-    has_pending_confirmation = False
-    if chat_history:
-        for msg in reversed(chat_history):
-            if msg.role == "assistant":
-                text_lower = msg.content.lower()
-                has_pending_confirmation = any(
-                    phrase in text_lower for phrase in (
-                        "confirm", "shall i", "proceed", "go ahead",
-                        "would you like", "want me to", "should i",
-                        "onaylıyor", "onaylayın", "devam edeyim",
-                        "yapmamı ister", "göndere", "onay",
-                    )
-                )
-                break
-
-    tier = classify_message(user_message, has_pending_confirmation)
+        hierarchy_data = await load_hierarchy(customer_id, tb_client, ctx, scoped=True)
+
+    # -- 5b. Tool selection ----------------------------------------------
+    # Tier picks the base tool set; context + recent turns prune it further
+    hint_text = " ".join([m.content for m in chat_history[-3:]] + [user_message])
+    tool_selection = select_tools(
+        tier, ctx,
+        # A branch-only hierarchy keeps get_hierarchy for the rest of the tree
+        hierarchy_loaded=hierarchy_data is not None and not hierarchy_data.get("partial"),
+        hint_text=hint_text,
+    )
+    tools_for_call = tool_selection.tools
+    schema_tokens_sent, schema_tokens_full = tool_selection.schema_tokens()
+    TOOL_SCHEMA_TOKENS.inc(schema_tokens_sent, kind="sent")
+    TOOL_SCHEMA_TOKENS.inc(schema_tokens_full - schema_tokens_sent, kind="saved")
 
-    if tier == MessageTier.GREETING:
-        tools_for_call = None
-    elif tier == MessageTier.DATA_QUERY:
-        tools_for_call = READ_ONLY_TOOLS
-    else:
-        tools_for_call = ALL_TOOLS
+    # -- 5c. Pick model route (fast model for greetings / simple lookups) -
+    route = select_route(tier, user_message, ctx)
+    route_path = [route.name]
 
     # -- 6. Build system prompt + messages --------------------------------
     system_prompt = build_system_prompt(ctx, hierarchy_data=hierarchy_data)
@@ -194,87 +209,165 @@ async def process_chat(
     total_input_tokens = 0
     total_output_tokens = 0
     api_call_count = 0
+    total_cost = 0.0
 
     # -- 7. Iterative tool-use loop ---------------------------------------
-    iterations = 0
-    while iterations < config.MAX_TOOL_ITERATIONS:
-        iterations += 1
-        try:
-            api_kwargs = {
-                "model": config.AI_MODEL,
-                "max_tokens": config.AI_MAX_TOKENS,
-                "system": system_prompt,
-                "messages": messages,
-            }
-            if tools_for_call:
-                api_kwargs["tools"] = tools_for_call
-            response = await anthropic_client.messages.create(**api_kwargs)
-        except anthropic.APIError as exc:
-            logger.exception("Claude API error")
-            return ChatResponse(
-                response="I'm having trouble connecting right now. Please try again.",
-                metadata=ChatMetadata(suggestions=DEFAULT_SUGGESTIONS),
+    # Speculatively fetch the context entity's usual first-tool data
+    prefetch = PrefetchMemo(tb_client, ctx)
+    if config.PREFETCH_ENABLED and tools_for_call:
+        prefetch.start()
+
+    try:
+        iterations = 0
+        route_iterations = 0
+        while iterations < config.MAX_TOOL_ITERATIONS:
+            # Fast route exhausted its iteration budget → hand over to the big model
+            if route.max_iterations and route_iterations >= route.max_iterations:
+                next_route = escalate(route)
+                if next_route is not None:
+                    route = _escalate_route(route, next_route, "iteration_limit", route_path)
+                    route_iterations = 0
+
+            iterations += 1
+            route_iterations += 1
+            try:
+                api_kwargs = {
+                    "model": route.model,
+                    "max_tokens": route.max_tokens,
+                    "system": system_prompt,
+                    "messages": messages,
+                }
+                if tools_for_call:
+                    api_kwargs["tools"] = tools_for_call
+                call_start = time.perf_counter()
+                response = await anthropic_client.messages.create(**api_kwargs)
+                call_seconds = time.perf_counter() - call_start
+                CLAUDE_CALL_SECONDS.observe(call_seconds, model=route.model, status="ok")
+                ROUTE_SECONDS.observe(call_seconds, route=route.name)
+            except anthropic.APIError as exc:
+                call_seconds = time.perf_counter() - call_start
+                CLAUDE_CALL_SECONDS.observe(call_seconds, model=route.model, status="error")
+                ROUTE_SECONDS.observe(call_seconds, route=route.name)
+                next_route = escalate(route)
+                # Escalating on the last iteration would leave no call to retry on
+                if next_route is not None and iterations < config.MAX_TOOL_ITERATIONS:
+                    logger.warning("Claude API error on route %s: %s", route.name, exc)
+                    route = _escalate_route(route, next_route, "error", route_path)
+                    route_iterations = 0
+                    continue
+                logger.exception("Claude API error")
+                _record_request(tier.value, perf_start, iterations)
+                return ChatResponse(
+                    response="I'm having trouble connecting right now. Please try again.",
+                    metadata=ChatMetadata(suggestions=DEFAULT_SUGGESTIONS),
+                )
+
+            total_input_tokens += response.usage.input_tokens
+            total_output_tokens += response.usage.output_tokens
+            api_call_count += 1
+            TOKENS_TOTAL.inc(response.usage.input_tokens, direction="in", model=route.model)
+            TOKENS_TOTAL.inc(response.usage.output_tokens, direction="out", model=route.model)
+            call_cost = estimate_cost(
+                route.model, response.usage.input_tokens, response.usage.output_tokens,
             )
+            total_cost += call_cost
+            ROUTE_COST_USD.inc(call_cost, route=route.name)
+
+            # Truncated output from the fast model → retry this turn on the big model
+            if response.stop_reason == "max_tokens":
+                next_route = escalate(route)
+                if next_route is not None:
+                    route = _escalate_route(route, next_route, "max_tokens", route_path)
+                    route_iterations = 0
+                    continue
+
+            # Check if Claude wants to use tools
+            if response.stop_reason != "tool_use":
+                break
 
-        total_input_tokens += response.usage.input_tokens
-        total_output_tokens += response.usage.output_tokens
-        api_call_count += 1
-
-        # Check if Claude wants to use tools
-        if response.stop_reason != "tool_use":
-            break
-
-        # Process each content block
-        assistant_content = []
-        tool_results = []
-
-        for block in response.content:
-            assistant_content.append(block)
-            if block.type == "tool_use":
-                tool_name = block.name
-                tool_input = block.input
-                tools_used.append(tool_name)
-
-                # Entity-level ownership check for downlink/query tools
-                _OWNERSHIP_CHECKED_TOOLS = {
-                    "send_dim_command",
-                    "send_task_schedule",
-                    "delete_task_schedule",
-                    "send_location_setup",
-                    "query_task_schedule",
-                }
-                if tool_name in _OWNERSHIP_CHECKED_TOOLS and customer_id:
-                    allowed_ids = get_hierarchy_entity_ids(customer_id)
-                    target_id = tool_input.get("device_id", "")
-                    if allowed_ids and target_id not in allowed_ids:
+            # Process each content block
+            assistant_content = []
+            tool_results = []
+
+            for block in response.content:
+                assistant_content.append(block)
+                if block.type == "tool_use":
+                    tool_name = block.name
+                    tool_input = block.input
+
+                    # Model asked for pruned tools → re-expand the selection
+                    if tool_name == EXPAND_TOOL_NAME:
+                        added = tool_selection.expand(tool_input.get("tool_names", []))
+                        tools_for_call = tool_selection.tools
+                        logger.info("Re-expanded tool selection: %s", added)
                         tool_results.append({
                             "type": "tool_result",
                             "tool_use_id": block.id,
-                            "content": json.dumps({
-                                "error": "Device not found in your account.",
-                            }),
+                            "content": json.dumps({"tools_added": added}),
                         })
                         continue
 
-                logger.info("Executing tool: %s(%s)", tool_name, json.dumps(tool_input)[:200])
-                tool_result = await execute_tool(tool_name, tool_input, tb_client, ctx)
-
-                # Collect entity references from tool inputs
-                _collect_entity_refs(tool_name, tool_input, tool_result, entity_refs)
-
-                tool_results.append({
-                    "type": "tool_result",
-                    "tool_use_id": block.id,
-                    "content": json.dumps(tool_result),
-                })
-
-        # Append assistant message with tool_use blocks
-        messages.append({
-            "role": "assistant",
-            "content": [_block_to_dict(b) for b in assistant_content],
-        })
-        # Append tool results
-        messages.append({"role": "user", "content": tool_results})
+                    tools_used.append(tool_name)
+
+                    # Entity-level ownership check for downlink/query tools
+                    _OWNERSHIP_CHECKED_TOOLS = {
+                        "send_dim_command",
+                        "send_task_schedule",
+                        "delete_task_schedule",
+                        "send_location_setup",
+                        "query_task_schedule",
+                        "get_full_schedule",
+                    }
+                    if tool_name in _OWNERSHIP_CHECKED_TOOLS and customer_id:
+                        target_id = tool_input.get("device_id", "")
+                        if not await _entity_allowed(customer_id, target_id, tb_client, ctx):
+                            tool_results.append({
+                                "type": "tool_result",
+                                "tool_use_id": block.id,
+                                "content": json.dumps({
+                                    "error": "Device not found in your account.",
+                                }),
+                            })
+                            continue
+
+                    logger.info("Executing tool: %s(%s)", tool_name, json.dumps(tool_input)[:200])
+                    emit({"type": "tool_started", "tool": tool_name})
+                    tool_result = await prefetch.get(tool_name, tool_input)
+                    if tool_result is None:
+                        tool_result = await execute_tool(tool_name, tool_input, tb_client, ctx)
+                    # Data fetched before a command may no longer hold after it
+                    if tool_name in _OWNERSHIP_CHECKED_TOOLS:
+                        prefetch.invalidate()
+                    emit({
+                        "type": "tool_finished",
+                        "tool": tool_name,
+                        "status": "error" if "error" in tool_result else "ok",
+                    })
+                    # The full tree fetched past a branch-only preload serves the ownership check
+                    if (
+                        tool_name == "get_hierarchy" and "error" not in tool_result
+                        and tool_input.get("customer_id") == customer_id
+                    ):
+                        set_cached_hierarchy(customer_id, tool_result)
+
+                    # Collect entity references from tool inputs
+                    _collect_entity_refs(tool_name, tool_input, tool_result, entity_refs)
+
+                    tool_results.append({
+                        "type": "tool_result",
+                        "tool_use_id": block.id,
+                        "content": json.dumps(tool_result),
+                    })
+
+            # Append assistant message with tool_use blocks
+            messages.append({
+                "role": "assistant",
+                "content": [_block_to_dict(b) for b in assistant_content],
+            })
+            # Append tool results
+            messages.append({"role": "user", "content": tool_results})
+    finally:
+        await prefetch.close()
 
     # -- 8. Extract final text --------------------------------------------
     final_text = ""
@@ -291,12 +384,15 @@ async def process_chat(
     duration = time.time() - request_start
     tools_str = ",".join(set(tools_used)) or "none"
     logger.info(
-        "CHAT customer=%s tier=%s tools=%s duration=%.1fs "
-        "tokens_in=%d tokens_out=%d api_calls=%d msg_len=%d",
-        customer_id or "anon", tier.value, tools_str, duration,
-        total_input_tokens, total_output_tokens, api_call_count,
-        len(request.message),
+        "CHAT customer=%s tier=%s route=%s tools=%s duration=%.1fs "
+        "tokens_in=%d tokens_out=%d api_calls=%d cost=$%.4f "
+        "tool_schema_tokens=%d/%d expanded=%s msg_len=%d",
+        customer_id or "anon", tier.value, "->".join(route_path), tools_str,
+        duration, total_input_tokens, total_output_tokens, api_call_count,
+        total_cost, schema_tokens_sent, schema_tokens_full,
+        ",".join(tool_selection.expanded) or "none", len(request.message),
     )
+    _record_request(tier.value, perf_start, iterations)
 
     return ChatResponse(
         response=final_text,
@@ -308,6 +404,239 @@ async def process_chat(
     )
 
 
+# ---------------------------------------------------------------------------
+# Hierarchy loading and warmup
+# ---------------------------------------------------------------------------
+
+# In-flight hierarchy loads, so a chat request joins a warmup's load:
+# customer_id → full tree, (customer_id, entity_id) → context branch
+_hierarchy_loads: dict[object, asyncio.Task] = {}
+# Running warmups, keyed by (customer, entity)
+_warmups: dict[tuple[str, str | None], asyncio.Task] = {}
+
+
+async def _verify_customer(customer_id: str, tb_client: TBClient) -> None:
+    """Raise ``httpx.HTTPStatusError`` unless the customer exists.
+
+    A customer verified within ``CUSTOMER_TTL`` is not looked up again.
+    """
+    if not is_customer_verified(customer_id):
+        await tb_client.get_customer(customer_id)
+        mark_customer_verified(customer_id)
+
+
+async def _fetch_hierarchy(customer_id: str, tb_client: TBClient, ctx) -> dict | None:
+    try:
+        hierarchy_data = await execute_tool(
+            "get_hierarchy",
+            {"customer_id": customer_id},
+            tb_client,
+            ctx,
+        )
+    except Exception:
+        logger.warning("Failed to fetch hierarchy", exc_info=True)
+        return None
+    if "error" in hierarchy_data:
+        logger.warning("Hierarchy fetch returned error: %s", hierarchy_data.get("error"))
+        return None
+    set_cached_hierarchy(customer_id, hierarchy_data)
+    logger.info("Fetched + cached hierarchy for customer %s", customer_id)
+    return hierarchy_data
+
+
+async def _fetch_scope(customer_id: str, tb_client: TBClient, ctx) -> dict | None:
+    try:
+        scope = await scoped_hierarchy(customer_id, ctx, tb_client)
+    except Exception:
+        logger.warning("Failed to fetch scoped hierarchy", exc_info=True)
+        return None
+    if scope is not None:
+        set_cached_scope(customer_id, ctx.entity_id, scope)
+        logger.info(
+            "Fetched + cached hierarchy branch of %s for customer %s",
+            ctx.entity_id, customer_id,
+        )
+    return scope
+
+
+def _single_flight(key, start) -> asyncio.Future:
+    """Join the in-flight load for *key*, or begin one with ``start()``."""
+    task = _hierarchy_loads.get(key)
+    if task is None:
+        task = asyncio.create_task(start())
+        _hierarchy_loads[key] = task
+        task.add_done_callback(lambda _: _hierarchy_loads.pop(key, None))
+    # Shielded: a cancelled request must not cancel a load others wait on
+    return asyncio.shield(task)
+
+
+def _scopable(ctx) -> bool:
+    return bool(
+        config.HIERARCHY_SCOPED_ENABLED and ctx and ctx.entity_id
+        and (
+            ctx.entity_type == "DEVICE"
+            or (ctx.entity_type == "ASSET" and (ctx.entity_subtype or "site").lower() == "site")
+        )
+    )
+
+
+async def load_hierarchy(
+    customer_id: str, tb_client: TBClient, ctx, scoped: bool = False,
+) -> dict | None:
+    """The customer's hierarchy from cache, or fetched and cached (None on failure).
+
+    With *scoped* and a site or device context, only that site's branch is
+    loaded (``"partial": true``) unless the full tree is already cached.
+    If the branch cannot be built, the full tree is loaded instead.
+    Concurrent callers share one fetch.
+    """
+    hierarchy_start = time.perf_counter()
+    hierarchy_data = get_cached_hierarchy(customer_id)
+    if hierarchy_data is not None:
+        logger.debug("Using cached hierarchy for customer %s", customer_id)
+        HIERARCHY_LOAD_SECONDS.observe(
+            time.perf_counter() - hierarchy_start, cache="hit",
+        )
+        return hierarchy_data
+
+    if scoped and _scopable(ctx):
+        hierarchy_data = get_cached_scope(customer_id, ctx.entity_id)
+        cache = "scope_hit"
+        if hierarchy_data is None:
+            hierarchy_data = await _single_flight(
+                (customer_id, ctx.entity_id),
+                lambda: _fetch_scope(customer_id, tb_client, ctx),
+            )
+            cache = "scope_miss"
+        if hierarchy_data is not None:
+            HIERARCHY_LOAD_SECONDS.observe(
+                time.perf_counter() - hierarchy_start, cache=cache,
+            )
+            return hierarchy_data
+
+    hierarchy_data = await _single_flight(
+        customer_id, lambda: _fetch_hierarchy(customer_id, tb_client, ctx),
+    )
+    HIERARCHY_LOAD_SECONDS.observe(
+        time.perf_counter() - hierarchy_start, cache="miss",
+    )
+    return hierarchy_data
+
+
+async def _entity_allowed(
+    customer_id: str, entity_id: str, tb_client: TBClient, ctx,
+) -> bool:
+    """Ownership rule: *entity_id* must be in the customer's tree.
+
+    When only the context's branch is loaded, an entity outside it loads
+    the rest of the tree first. With no hierarchy at all the check passes.
+    """
+    allowed_ids = get_hierarchy_entity_ids(customer_id)
+    if allowed_ids is None and ctx and ctx.entity_id:
+        scope_ids = get_scope_entity_ids(customer_id, ctx.entity_id)
+        if scope_ids is not None:
+            if entity_id in scope_ids:
+                return True
+            await load_hierarchy(customer_id, tb_client, ctx)
+            allowed_ids = get_hierarchy_entity_ids(customer_id)
+    return not allowed_ids or entity_id in allowed_ids
+
+
+async def _warm_up(ctx: EntityContext, tb_client: TBClient) -> None:
+    customer_id = ctx.customer_id
+    started = time.perf_counter()
+    try:
+        await _verify_customer(customer_id, tb_client)
+    except httpx.HTTPStatusError:
+        logger.warning("Warmup for unknown customer %s skipped", customer_id)
+        return
+    prefetched = warm(tb_client, ctx) if config.PREFETCH_ENABLED else []
+    hierarchy = await load_hierarchy(customer_id, tb_client, ctx, scoped=True)
+    logger.info(
+        "WARMUP customer=%s entity=%s hierarchy=%s prefetch=%s duration=%.2fs",
+        customer_id, ctx.entity_id or "-", "ok" if hierarchy else "failed",
+        ",".join(prefetched) or "-", time.perf_counter() - started,
+    )
+
+
+def start_warmup(ctx: EntityContext, tb_client: TBClient) -> bool:
+    """Warm the caches for *ctx* in the background; False if nothing to do.
+
+    Verifies the customer, then loads its hierarchy and starts the context
+    entity's prefetch, so the first message finds them ready.
+    """
+    if not ctx.customer_id:
+        return False
+    key = (ctx.customer_id, ctx.entity_id)
+    running = _warmups.get(key)
+    if running is not None and not running.done():
+        return True
+    task = asyncio.create_task(_warm_up(ctx, tb_client))
+    _warmups[key] = task
+    task.add_done_callback(lambda t: _warmups.pop(key, None) if _warmups.get(key) is t else None)
+    return True
+
+
+async def _try_fast_path(
+    user_message: str,
+    ctx,
+    tb_client: TBClient,
+    customer_id: str | None,
+    tier: MessageTier,
+) -> ChatResponse | None:
+    """Answer from a template when the intent is unambiguous, else None.
+
+    COMMAND-tier messages are left to Claude, so a command is never answered
+    with a reading. The dim-level intent is the exception: its keywords
+    always rank COMMAND, and ``match_intent`` only scores it high for a
+    question with no command verb.
+    """
+    match = match_intent(user_message, ctx)
+    if match is None:
+        return None
+    if tier == MessageTier.COMMAND and match.intent != Intent.DIM_LEVEL:
+        return None
+    if match.confidence < config.FAST_PATH_MIN_CONFIDENCE:
+        FAST_PATH_TOTAL.inc(intent=match.intent.value, outcome="below_threshold")
+        return None
+
+    # Same ownership rule as the tool loop: entity must be in the customer tree
+    if customer_id:
+        if not await _entity_allowed(customer_id, ctx.entity_id, tb_client, ctx):
+            FAST_PATH_TOTAL.inc(intent=match.intent.value, outcome="fallback")
+            return None
+
+    answer = await try_fast_path(match, tb_client, ctx)
+    if answer is None:
+        FAST_PATH_TOTAL.inc(intent=match.intent.value, outcome="fallback")
+        return None
+
+    FAST_PATH_TOTAL.inc(intent=match.intent.value, outcome="taken")
+    logger.info(
+        "CHAT_FAST_PATH customer=%s intent=%s confidence=%.2f lang=%s tool=%s",
+        customer_id or "anon", match.intent.value, match.confidence,
+        match.language, answer.tool_name,
+    )
+    entity_refs: list[EntityReference] = []
+    _collect_entity_refs(answer.tool_name, answer.tool_input, answer.tool_result, entity_refs)
+    return ChatResponse(
+        response=answer.text,
+        metadata=ChatMetadata(
+            tools_used=[answer.tool_name],
+            entity_references=entity_refs,
+            suggestions=_extract_suggestions(answer.text, ctx),
+        ),
+    )
+
+
+def _escalate_route(current, target, reason: str, route_path: list[str]):
+    """Log + count an escalation from *current* to *target*; return *target*."""
+    logger.info("Escalating route %s -> %s (%s)", current.name, target.name, reason)
+    ROUTE_ESCALATIONS.inc(source=current.name, reason=reason)
+    route_path.append(target.name)
+    return target
+
+
 def _block_to_dict(block) -> dict:
     """Convert an Anthropic content block to a serialisable dict."""
     if block.type == "text":
@@ -20,6 +20,18 @@ ANTHROPIC_API_KEY: str = os.getenv("ANTHROPIC_API_KEY", "")
 AI_MODEL: str = os.getenv("AI_MODEL", "claude-sonnet-4-5-20250929")
 AI_MAX_TOKENS: int = int(os.getenv("AI_MAX_TOKENS", "2048"))
 
+# -- Tier-based model routing (see routing.py) ----------------------------
+AI_ROUTING_ENABLED: bool = os.getenv("AI_ROUTING_ENABLED", "true").lower() == "true"
+AI_MODEL_FAST: str = os.getenv("AI_MODEL_FAST", "claude-haiku-4-5-20251001")
+AI_MAX_TOKENS_FAST: int = int(os.getenv("AI_MAX_TOKENS_FAST", "1024"))
+AI_FAST_MAX_ITERATIONS: int = int(os.getenv("AI_FAST_MAX_ITERATIONS", "3"))
+
+# USD per million tokens (input, output) — used for per-route cost logging
+MODEL_PRICING: dict[str, tuple[float, float]] = {
+    "claude-sonnet-4-5-20250929": (3.0, 15.0),
+    "claude-haiku-4-5-20251001": (1.0, 5.0),
+}
+
 # -- Service --------------------------------------------------------------
 CORS_ORIGINS: list[str] = [
     o.strip()
@@ -28,6 +40,56 @@ CORS_ORIGINS: list[str] = [
 ]
 SERVICE_PORT: int = int(os.getenv("SERVICE_PORT", "5001"))
 
+# -- LLM-free fast path (see fast_path.py) -------------------------------
+FAST_PATH_ENABLED: bool = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+FAST_PATH_MIN_CONFIDENCE: float = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.8"))
+
+# -- Speculative prefetch of context-entity data (see prefetch.py) -------
+PREFETCH_ENABLED: bool = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+
+# -- Hierarchy embedded in the prompt (see chat.load_hierarchy) ----------
+# Site / device contexts load only their branch; the rest on demand
+HIERARCHY_SCOPED_ENABLED: bool = os.getenv("HIERARCHY_SCOPED_ENABLED", "true").lower() == "true"
+
+# -- Warmup when the chat widget opens (POST /api/chat/warmup) -----------
+WARMUP_ENABLED: bool = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_TTL: float = float(os.getenv("WARMUP_TTL", "60"))  # unused prefetches kept
+
+# -- Per-device fan-out in tools (see fanout.py) -------------------------
+# Devices in flight per tool call; each runs its 2-4 TB calls together
+FANOUT_CONCURRENCY: int = int(os.getenv("FANOUT_CONCURRENCY", "16"))
+# TB requests in flight per client, across all tool calls and jobs
+TB_MAX_CONCURRENCY: int = int(os.getenv("TB_MAX_CONCURRENCY", "64"))
+
+# -- Device command dispatch (see dispatch.py) --------------------------
+DISPATCH_CONCURRENCY: int = int(os.getenv("DISPATCH_CONCURRENCY", "16"))
+DISPATCH_TIMEOUT: float = float(os.getenv("DISPATCH_TIMEOUT", "10"))  # per device, seconds
+
+# -- Telemetry downsampling (see downsample.py) --------------------------
+TELEMETRY_POINT_BUDGET: int = int(os.getenv("TELEMETRY_POINT_BUDGET", "200"))  # per key
+
+# -- Duty-cycle pacing of downlinks (see pacing.py) ----------------------
+PACING_ENABLED: bool = os.getenv("PACING_ENABLED", "true").lower() == "true"
+PACING_DUTY_CYCLE: float = float(os.getenv("PACING_DUTY_CYCLE", "0.1"))  # EU868 RX2 sub-band
+PACING_BURST_S: float = float(os.getenv("PACING_BURST_S", "5"))  # airtime seconds per site
+PACING_INLINE_WAIT_S: float = float(os.getenv("PACING_INLINE_WAIT_S", "10"))
+
+# -- Class C multicast of site-wide dims (see multicast.py) --------------
+MULTICAST_ENABLED: bool = os.getenv("MULTICAST_ENABLED", "true").lower() == "true"
+MULTICAST_MIN_DEVICES: int = int(os.getenv("MULTICAST_MIN_DEVICES", "10"))  # downlinks saved
+MULTICAST_READY_TTL: float = float(os.getenv("MULTICAST_READY_TTL", "300"))
+TTS_BASE_URL: str = os.getenv("TTS_BASE_URL", "")
+TTS_APP_ID: str = os.getenv("TTS_APP_ID", "")
+TTS_API_KEY: str = os.getenv("TTS_API_KEY", "")
+
+# -- Task query responses (see task_query.py) ----------------------------
+TASK_QUERY_WAIT_S: float = float(os.getenv("TASK_QUERY_WAIT_S", "20"))  # inline, per call
+TASK_QUERY_DEADLINE_S: float = float(os.getenv("TASK_QUERY_DEADLINE_S", "600"))
+TASK_QUERY_POLL_MIN_S: float = float(os.getenv("TASK_QUERY_POLL_MIN_S", "1"))
+TASK_QUERY_POLL_MAX_S: float = float(os.getenv("TASK_QUERY_POLL_MAX_S", "15"))
+SCHEDULE_SNAPSHOT_DEADLINE_S: float = float(os.getenv("SCHEDULE_SNAPSHOT_DEADLINE_S", "3600"))
+SCHEDULE_SNAPSHOT_TTL: float = float(os.getenv("SCHEDULE_SNAPSHOT_TTL", "86400"))
+
 # -- Tool loop safety -----------------------------------------------------
 MAX_TOOL_ITERATIONS: int = 10
 MAX_CHAT_HISTORY_MESSAGES: int = 20  # 10 user-assistant turns
@@ -35,6 +97,23 @@ MAX_CHAT_HISTORY_MESSAGES: int = 20  # 10 user-assistant turns
 # -- Guardrails -----------------------------------------------------------
 MAX_MESSAGE_LENGTH: int = 2000
 
+# -- Admission control (global in-flight cap, see admission.py) ---------
+ADMISSION_MAX_IN_FLIGHT: int = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32"))
+ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+
+# -- Background job mode for high fan-out requests (see jobs.py) --------
+JOB_MODE_ENABLED: bool = os.getenv("JOB_MODE_ENABLED", "true").lower() == "true"
+JOB_FANOUT_THRESHOLD: int = int(os.getenv("JOB_FANOUT_THRESHOLD", "400"))  # est. TB calls
+JOB_MAX_CONCURRENT: int = int(os.getenv("JOB_MAX_CONCURRENT", "4"))
+JOB_MAX_PENDING: int = int(os.getenv("JOB_MAX_PENDING", "16"))  # queued + running; more → 503
+JOB_TTL: int = int(os.getenv("JOB_TTL", "900"))  # keep finished jobs 15 minutes
+
+# -- Background health prober (see health.py) ---------------------------
+HEALTH_PROBE_INTERVAL: float = float(os.getenv("HEALTH_PROBE_INTERVAL", "15"))
+HEALTH_PROBE_TIMEOUT: float = float(os.getenv("HEALTH_PROBE_TIMEOUT", "5"))
+HEALTH_FAILURE_THRESHOLD: int = int(os.getenv("HEALTH_FAILURE_THRESHOLD", "2"))
+
 # -- Rate limiting --------------------------------------------------------
 RATE_LIMIT_PER_IP: str = "10/minute"
 RATE_LIMIT_PER_CUSTOMER: int = 20          # max requests per customer …
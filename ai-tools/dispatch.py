@@ -0,0 +1,226 @@
+"""Concurrent, fault-tolerant dispatch of device commands.
+
+The command tools (dim, schedule, location, schedule delete) write a shared
+attribute to every resolved device; the MQTT bridge turns each write into
+a LoRaWAN downlink. ``dispatch`` runs those writes with bounded
+concurrency and a per-device timeout, and records every device's outcome
+(``sent`` / ``failed`` / ``timed_out``) instead of stopping at the first
+error. Devices already at the requested state can be passed as *skipped*:
+they get no write (and no downlink) but appear in the outcome.
+
+With a *site*, writes go through the duty-cycle pacer (see pacing.py).
+``dispatch`` waits up to ``PACING_INLINE_WAIT_S`` for them. Writes still
+waiting for airtime after that are reported as ``queued`` with the batch
+ID and ETA, and keep draining in the background.
+
+``dispatch_multicast`` covers a whole site with one write instead (a
+Class C multicast, see multicast.py). It returns None when that write
+fails, so the caller can fall back to ``dispatch``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+import config
+from fanout import fan_out
+from metrics import DISPATCH_TOTAL, MULTICAST_TOTAL
+from pacing import format_eta, pacer
+
+logger = logging.getLogger(__name__)
+
+OUTCOMES = ("sent", "failed", "timed_out", "skipped", "queued")
+
+
+@dataclass
+class DispatchResult:
+    """Per-device outcomes of one command: dispatched devices, then skipped."""
+
+    command: str
+    results: list[dict] = field(default_factory=list)
+    batch_id: str | None = None   # set while paced writes are still queued
+    eta_s: float | None = None
+    multicast_group: str | None = None  # set when one multicast write covered every device
+
+    def count(self, status: str) -> int:
+        return sum(1 for r in self.results if r["status"] == status)
+
+    def names(self, status: str) -> list[str]:
+        return [r["device_name"] for r in self.results if r["status"] == status]
+
+    @property
+    def sent(self) -> int:
+        return self.count("sent")
+
+    def summary(self) -> dict:
+        """Outcome counts, e.g. ``{"total": 150, "sent": 148, ...}``."""
+        summary = {"total": len(self.results), **{s: self.count(s) for s in OUTCOMES}}
+        if self.batch_id:
+            summary["batch_id"] = self.batch_id
+            summary["eta_s"] = round(self.eta_s or 0)
+        if self.multicast_group:
+            summary["multicast_group"] = self.multicast_group
+        return summary
+
+    def describe(self, action: str) -> str:
+        """One-line outcome message: *action* plus any failures by name."""
+        sent = self.names("sent")
+        skipped = self.names("skipped")
+        targeted = len(self.results) - len(skipped)
+        if not targeted:
+            return f"{action}: all {len(skipped)} device(s) already set — nothing sent"
+        if len(sent) == targeted:
+            text = f"{action} sent to {len(sent)} device(s): {', '.join(sent)}"
+            if self.multicast_group:
+                text += f" (one multicast downlink, group {self.multicast_group})"
+        else:
+            text = f"{action} sent to {len(sent)} of {targeted} device(s)"
+            if sent:
+                text += f": {', '.join(sent)}"
+        failed = self.names("failed")
+        if failed:
+            text += f". Failed: {', '.join(failed)}"
+        timed_out = self.names("timed_out")
+        if timed_out:
+            text += f". Timed out (may still apply): {', '.join(timed_out)}"
+        queued = self.count("queued")
+        if queued:
+            text += (
+                f". {queued} queued for duty-cycle pacing, done in "
+                f"{format_eta(self.eta_s or 0)} (batch {self.batch_id})"
+            )
+        if skipped:
+            text += f". Skipped {len(skipped)} already set: {', '.join(skipped)}"
+        return text
+
+
+async def dispatch(
+    command: str,
+    devices: list[dict],
+    send: Callable[[dict], Awaitable[object]],
+    customer_id: str,
+    skipped: list[dict] | None = None,
+    site: str | None = None,
+    limit: int | None = None,
+    timeout: float | None = None,
+) -> DispatchResult:
+    """Run ``send(device)`` for every device and capture each outcome.
+
+    *devices* are ``{"id", "name"}`` dicts from ``_resolve_device_ids``;
+    *skipped* devices are recorded as ``skipped`` without being sent to.
+    At most *limit* writes (default ``DISPATCH_CONCURRENCY``) are in flight,
+    each bounded by *timeout* seconds (default ``DISPATCH_TIMEOUT``). A
+    timed-out write may still reach the device, so it is reported apart
+    from failures.
+    """
+    timeout = timeout or config.DISPATCH_TIMEOUT
+    if site is not None and config.PACING_ENABLED:
+        result = await _dispatch_paced(command, devices, send, customer_id, site, timeout)
+    else:
+        result = await _dispatch_now(command, devices, send, limit, timeout)
+    for dev in skipped or ():
+        DISPATCH_TOTAL.inc(command=command, outcome="skipped")
+        result.results.append(
+            {"device_name": dev["name"], "device_id": dev["id"], "status": "skipped"}
+        )
+
+    summary = result.summary()
+    log = logger.warning if summary["failed"] or summary["timed_out"] else logger.info
+    log(
+        "%s_DISPATCH customer=%s total=%d sent=%d failed=%d timed_out=%d skipped=%d "
+        "queued=%d",
+        command, customer_id, summary["total"], summary["sent"], summary["failed"],
+        summary["timed_out"], summary["skipped"], summary["queued"],
+    )
+    return result
+
+
+async def dispatch_multicast(
+    command: str,
+    devices: list[dict],
+    send: Callable[[], Awaitable[object]],
+    customer_id: str,
+    group_id: str,
+    site: str | None = None,
+    timeout: float | None = None,
+) -> DispatchResult | None:
+    """Run the single write ``send()`` that reaches every device in *devices*.
+
+    Every device is recorded as ``sent``. The downlink's airtime is charged
+    to the *site*'s pacing budget. Returns None if the write failed or
+    timed out.
+    """
+    timeout = timeout or config.DISPATCH_TIMEOUT
+    try:
+        await asyncio.wait_for(send(), timeout)
+    except Exception as exc:
+        logger.warning(
+            "%s_MULTICAST_FAILED customer=%s group=%s: %s",
+            command, customer_id, group_id, str(exc) or type(exc).__name__,
+        )
+        MULTICAST_TOTAL.inc(outcome="failed")
+        return None
+    if site is not None and config.PACING_ENABLED:
+        pacer.charge(site, command)
+    MULTICAST_TOTAL.inc(outcome="multicast")
+    DISPATCH_TOTAL.inc(command=command, outcome="sent")
+    logger.info(
+        "%s_MULTICAST customer=%s group=%s devices=%d",
+        command, customer_id, group_id, len(devices),
+    )
+    return DispatchResult(
+        command,
+        [
+            {"device_name": d["name"], "device_id": d["id"], "status": "sent"}
+            for d in devices
+        ],
+        multicast_group=group_id,
+    )
+
+
+async def _dispatch_paced(
+    command: str,
+    devices: list[dict],
+    send: Callable[[dict], Awaitable[object]],
+    customer_id: str,
+    site: str,
+    timeout: float,
+) -> DispatchResult:
+    batch = pacer.submit(site, command, devices, send, customer_id, timeout)
+    await batch.wait(config.PACING_INLINE_WAIT_S)
+    result = DispatchResult(command, [dict(r) for r in batch.results])
+    if not batch.finished:
+        result.batch_id = batch.id
+        result.eta_s = max(0.0, batch.created + batch.eta_s - time.time())
+    return result
+
+
+async def _dispatch_now(
+    command: str,
+    devices: list[dict],
+    send: Callable[[dict], Awaitable[object]],
+    limit: int | None,
+    timeout: float,
+) -> DispatchResult:
+    async def send_one(dev: dict) -> None:
+        await asyncio.wait_for(send(dev), timeout)
+
+    fan = await fan_out(devices, send_one, limit or config.DISPATCH_CONCURRENCY)
+
+    result = DispatchResult(command)
+    for i, dev in enumerate(devices):
+        entry = {"device_name": dev["name"], "device_id": dev["id"], "status": "sent"}
+        exc = fan.errors.get(i)
+        if isinstance(exc, asyncio.TimeoutError):
+            entry["status"] = "timed_out"
+            entry["error"] = f"no response within {timeout:g}s"
+        elif exc is not None:
+            entry["status"] = "failed"
+            entry["error"] = str(exc) or type(exc).__name__
+        DISPATCH_TOTAL.inc(command=command, outcome=entry["status"])
+        result.results.append(entry)
+    return result
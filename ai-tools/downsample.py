@@ -0,0 +1,100 @@
+"""Server-side downsampling of telemetry series returned to Claude.
+
+Raw (``aggregation: NONE``) history over ``last_30_days`` can hold
+thousands of points per key, every one of which would land in the Claude
+context. ``reduce_series`` cuts a series to a point budget
+(``TELEMETRY_POINT_BUDGET``) with one of two methods:
+
+- ``lttb`` — Largest-Triangle-Three-Buckets keeps the points that preserve
+  the visual shape (peaks, dips, steps) as ``{"ts", "value"}`` points;
+- ``envelope`` — equal-count buckets reported as ``{"ts", "min", "max",
+  "avg"}``, so ranges and extremes survive.
+
+Both are vectorised with NumPy. ``summarize`` returns whole-series
+statistics computed before any reduction.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+METHODS = ("lttb", "envelope")
+
+
+def _arrays(points: list[dict]) -> tuple[np.ndarray, np.ndarray]:
+    ts = np.fromiter((p["ts"] for p in points), dtype=np.int64, count=len(points))
+    values = np.fromiter((p["value"] for p in points), dtype=np.float64, count=len(points))
+    return ts, values
+
+
+def summarize(points: list[dict]) -> dict:
+    """Count, min/max (with timestamps), mean, std, first and last value."""
+    ts, values = _arrays(points)
+    i_min, i_max = int(values.argmin()), int(values.argmax())
+    return {
+        "count": len(points),
+        "start_ts": int(ts[0]),
+        "end_ts": int(ts[-1]),
+        "min": round(float(values[i_min]), 3),
+        "min_ts": int(ts[i_min]),
+        "max": round(float(values[i_max]), 3),
+        "max_ts": int(ts[i_max]),
+        "mean": round(float(values.mean()), 3),
+        "std": round(float(values.std()), 3),
+        "first": round(float(values[0]), 3),
+        "last": round(float(values[-1]), 3),
+    }
+
+
+def lttb_indices(ts: np.ndarray, values: np.ndarray, threshold: int) -> np.ndarray:
+    """Indices of the *threshold* points LTTB keeps (first and last included)."""
+    n = len(values)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = ts.astype(np.float64)
+    # Bucket edges for the n - 2 inner points, split into threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Average of the next bucket (the last point for the final bucket)
+        nlo, nhi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x, avg_y = x[nlo:nhi].mean(), values[nlo:nhi].mean()
+        # Triangle area (times 2) between the kept point, each candidate and the average
+        area = np.abs(
+            (x[a] - avg_x) * (values[lo:hi] - values[a])
+            - (x[a] - x[lo:hi]) * (avg_y - values[a])
+        )
+        a = lo + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+
+def envelope(ts: np.ndarray, values: np.ndarray, buckets: int) -> list[dict]:
+    """Equal-count buckets with their start ts and min / max / avg."""
+    starts = np.linspace(0, len(values), buckets, endpoint=False).astype(np.int64)
+    starts = np.unique(starts)
+    counts = np.diff(np.append(starts, len(values)))
+    mins = np.minimum.reduceat(values, starts)
+    maxs = np.maximum.reduceat(values, starts)
+    avgs = np.add.reduceat(values, starts) / counts
+    return [
+        {"ts": int(t), "min": round(float(lo), 3), "max": round(float(hi), 3),
+         "avg": round(float(av), 3)}
+        for t, lo, hi, av in zip(ts[starts], mins, maxs, avgs)
+    ]
+
+
+def reduce_series(points: list[dict], budget: int, method: str = "lttb") -> list[dict]:
+    """Reduce *points* (``{"ts", "value"}``, ts-sorted) to at most *budget*."""
+    if len(points) <= budget:
+        return points
+    ts, values = _arrays(points)
+    if method == "envelope":
+        return envelope(ts, values, budget)
+    return [
+        {"ts": int(ts[i]), "value": round(float(values[i]), 3)}
+        for i in lttb_indices(ts, values, budget)
+    ]
@@ -0,0 +1,81 @@
+"""Bounded-concurrency fan-out for per-entity tool work.
+
+``fan_out`` runs an async function over a list of items with at most
+``limit`` calls in flight, keeps results in input order and collects
+per-item failures instead of aborting the whole batch. ``gather_all`` runs
+one item's own calls together and fails only once all of them are done.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Generic, Sequence, TypeVar
+
+import config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@dataclass
+class FanOutResult(Generic[R]):
+    """Per-item outcome of a fan-out, in input order.
+
+    ``results[i]`` is the return value for ``items[i]``, or None if that
+    item failed; ``errors`` maps the failed indexes to their exceptions.
+    """
+
+    results: list[R | None]
+    errors: dict[int, Exception] = field(default_factory=dict)
+
+    @property
+    def failed_count(self) -> int:
+        return len(self.errors)
+
+
+async def fan_out(
+    items: Sequence[T],
+    fn: Callable[[T], Awaitable[R]],
+    limit: int | None = None,
+) -> FanOutResult[R]:
+    """Run ``fn(item)`` for every item with at most *limit* in flight.
+
+    *limit* defaults to ``config.FANOUT_CONCURRENCY``. A fixed pool of
+    workers pulls the next index, so a 10,000-device site does not create
+    10,000 pending tasks at once.
+    """
+    limit = max(1, limit or config.FANOUT_CONCURRENCY)
+    results: list[R | None] = [None] * len(items)
+    errors: dict[int, Exception] = {}
+    next_index = iter(range(len(items)))
+
+    async def worker() -> None:
+        for i in next_index:
+            try:
+                results[i] = await fn(items[i])
+            except Exception as exc:
+                logger.warning(
+                    "Fan-out item %r failed: %s", items[i], str(exc) or type(exc).__name__,
+                )
+                errors[i] = exc
+
+    await asyncio.gather(*(worker() for _ in range(min(limit, len(items)))))
+    return FanOutResult(results, errors)
+
+
+async def gather_all(*aws: Awaitable[Any]) -> list[Any]:
+    """``asyncio.gather`` that lets every call finish before raising.
+
+    Plain gather raises on the first failure and leaves the sibling calls
+    running outside the fan-out's limit; here the first error is raised
+    only after all of them have returned.
+    """
+    results = await asyncio.gather(*aws, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
@@ -0,0 +1,292 @@
+"""LLM-free fast path for high-frequency, unambiguous intents.
+
+When the dashboard context names a single entity and the message is a
+plain "active alarms / current dim level / energy today" question, the
+matching tool is executed directly and the answer is rendered from a
+localised template (EN/TR) — no Claude call.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from enum import Enum
+
+from models import EntityContext
+from tb_client import TBClient
+from tools import execute_tool
+
+
+class Intent(str, Enum):
+    ACTIVE_ALARMS = "active_alarms"
+    DIM_LEVEL = "dim_level"
+    ENERGY_TODAY = "energy_today"
+
+
+@dataclass(frozen=True)
+class IntentMatch:
+    """Result of the deterministic matcher."""
+
+    intent: Intent
+    confidence: float
+    language: str  # "en" or "tr"
+
+
+@dataclass(frozen=True)
+class FastPathAnswer:
+    """A rendered fast-path response."""
+
+    intent: Intent
+    text: str
+    tool_name: str
+    tool_input: dict
+    tool_result: dict
+
+
+# ---------------------------------------------------------------------------
+# Matcher
+# ---------------------------------------------------------------------------
+
+_INTENT_PATTERNS: dict[Intent, re.Pattern] = {
+    Intent.ACTIVE_ALARMS: re.compile(
+        r"\b(alarms?|alerts?|faults?|alarm\w*|arıza\w*|uyarı\w*)\b",
+        re.IGNORECASE,
+    ),
+    Intent.DIM_LEVEL: re.compile(
+        r"\b(dim\s*(level|value)|dimming\s+level|brightness|dimmed|"
+        r"dim\s+seviye\w*|parlaklık\w*)\b",
+        re.IGNORECASE,
+    ),
+    Intent.ENERGY_TODAY: re.compile(
+        r"\b(energy|consumption|kwh|usage|enerji\w*|tüketim\w*)\b",
+        re.IGNORECASE,
+    ),
+}
+
+_TODAY = re.compile(r"\b(today|so\s+far|bugün\w*)\b", re.IGNORECASE)
+
+# Anything hinting at another time range, other entities, ranking or a command
+_DISQUALIFIERS = re.compile(
+    r"\b(yesterday|week|month|last|history|trend|compare|vs|versus|rank|top|"
+    r"all|every|each|other|sites|devices|why|how\s+much\s+did|"
+    r"set|change|turn|switch|schedule|send|adjust|increase|decrease|"
+    r"lower|reduce|raise|up|down|max|min|maximum|minimum|brighter|dimmer|"
+    r"cleared|resolved|past|"
+    r"dün|hafta\w*|bu\s+ay|aylık|geçen|karşılaştır\w*|tüm|hepsi|diğer|neden|"
+    r"ayarla|değiştir|kapat|aç|gönder|düşür\w*|yükselt\w*|artır\w*|azalt\w*)\b",
+    re.IGNORECASE,
+)
+
+# "dim" and "brightness" always rank a message COMMAND tier, so a dim-level
+# question must read as one to tell it from an instruction
+_QUESTION = re.compile(
+    r"\?|\b(what|what's|whats|which|how|current|currently|tell|show|"
+    r"ne|nedir|kaç|mı|mi|şu\s+an)\b",
+    re.IGNORECASE,
+)
+
+# A site or device named in the message ("energy today at site B?") may not
+# be the context entity; only "this site" / "my device" / "bu cihaz" is
+_ENTITY_MENTION = re.compile(
+    r"\b(?:(this|the|my|our|bu)\s+)?(site|device|controller|saha\w*|cihaz\w*)\b",
+    re.IGNORECASE,
+)
+
+# Turkish-only letters are matched case-sensitively: with IGNORECASE, "ı"/"İ"
+# would also match plain ASCII "i"/"I".
+_TURKISH_CHARS = re.compile(r"[çğıöşüÇĞİÖŞÜ]")
+_TURKISH_WORDS = re.compile(
+    r"\b(ne|nedir|kaç|var\s*mı|mı|mi|bugün|için|şu\s+an)\b",
+    re.IGNORECASE,
+)
+
+# Entity types each intent can be answered for
+_SUPPORTED_ENTITIES: dict[Intent, set[str]] = {
+    Intent.ACTIVE_ALARMS: {"DEVICE", "ASSET"},
+    Intent.DIM_LEVEL: {"DEVICE"},
+    Intent.ENERGY_TODAY: {"DEVICE", "ASSET"},
+}
+
+_MAX_MESSAGE_LEN = 100
+
+
+def detect_language(message: str) -> str:
+    """Return "tr" for Turkish-looking messages, otherwise "en"."""
+    if _TURKISH_CHARS.search(message) or _TURKISH_WORDS.search(message):
+        return "tr"
+    return "en"
+
+
+def match_intent(message: str, context: EntityContext | None) -> IntentMatch | None:
+    """Match *message* to a single fast-path intent, with a confidence score.
+
+    Returns None when no intent matches or the context entity cannot
+    answer it. Confidence drops for long messages, multiple intents and
+    any phrase hinting at other time ranges, entities or commands.
+    """
+    if not context or not context.entity_id or not context.entity_type:
+        return None
+    if context.entity_type == "ASSET" and (context.entity_subtype or "site").lower() != "site":
+        return None
+
+    text = message.strip()
+    matched = [i for i, p in _INTENT_PATTERNS.items() if p.search(text)]
+    if not matched:
+        return None
+
+    # ENERGY_TODAY needs an explicit "today" — otherwise the range is ambiguous
+    if Intent.ENERGY_TODAY in matched and not _TODAY.search(text):
+        matched.remove(Intent.ENERGY_TODAY)
+        if not matched:
+            return None
+
+    intent = matched[0]
+    if context.entity_type not in _SUPPORTED_ENTITIES[intent]:
+        return None
+
+    confidence = 1.0
+    if len(matched) > 1:
+        confidence -= 0.5
+    if _DISQUALIFIERS.search(text):
+        confidence -= 0.5
+    if any(m.group(1) is None for m in _ENTITY_MENTION.finditer(text)):
+        confidence -= 0.5
+    if intent == Intent.DIM_LEVEL and re.search(r"\d", text):
+        confidence -= 0.5  # "dim to 40" is a command, not a question
+    if intent == Intent.DIM_LEVEL and not _QUESTION.search(text):
+        confidence -= 0.5  # "brightness to full"
+    if len(text) > _MAX_MESSAGE_LEN:
+        confidence -= 0.3
+
+    return IntentMatch(intent=intent, confidence=max(confidence, 0.0), language=detect_language(text))
+
+
+# ---------------------------------------------------------------------------
+# Templates
+# ---------------------------------------------------------------------------
+
+_TEMPLATES: dict[str, dict[str, str]] = {
+    "en": {
+        "no_alarms": "There are no active alarms for {name}.",
+        "alarms": "I found {count} active alarm(s) for {name}: {items}.",
+        "alarms_more": " and {more} more",
+        "dim": "{name} is currently dimmed to {dim}%.",
+        "energy_device": "{name} has used {kwh} kWh so far today.",
+        "energy_site": (
+            "{name} has used {kwh} kWh so far today across {count} device(s) "
+            "({online} online)."
+        ),
+    },
+    "tr": {
+        "no_alarms": "{name} için aktif alarm bulunmuyor.",
+        "alarms": "{name} için {count} aktif alarm buldum: {items}.",
+        "alarms_more": " ve {more} tane daha",
+        "dim": "{name} şu anda %{dim} parlaklık seviyesinde.",
+        "energy_device": "{name} bugün şimdiye kadar {kwh} kWh enerji tüketti.",
+        "energy_site": (
+            "{name} bugün {count} cihazda ({online} çevrimiçi) toplam "
+            "{kwh} kWh enerji tüketti."
+        ),
+    },
+}
+
+_MAX_LISTED_ALARMS = 5
+
+
+def _fmt_number(value: float) -> str:
+    return f"{value:,.1f}"
+
+
+def _render(intent: Intent, lang: str, name: str, result: dict) -> str | None:
+    """Render a tool result with the localised template, or None if unusable."""
+    t = _TEMPLATES[lang]
+
+    if intent == Intent.ACTIVE_ALARMS:
+        alarms = result.get("alarms", [])
+        if not alarms:
+            return t["no_alarms"].format(name=name)
+        items = ", ".join(
+            f"{a.get('type', '?')} ({str(a.get('severity', '')).lower()})"
+            for a in alarms[:_MAX_LISTED_ALARMS]
+        )
+        if len(alarms) > _MAX_LISTED_ALARMS:
+            items += t["alarms_more"].format(more=len(alarms) - _MAX_LISTED_ALARMS)
+        return t["alarms"].format(count=len(alarms), name=name, items=items)
+
+    if intent == Intent.DIM_LEVEL:
+        dim = result.get("values", {}).get("dim_value")
+        if not isinstance(dim, (int, float)):
+            return None
+        return t["dim"].format(name=name, dim=int(round(dim)))
+
+    if intent == Intent.ENERGY_TODAY:
+        if "total_energy_kwh" in result:
+            return t["energy_site"].format(
+                name=name,
+                kwh=_fmt_number(result["total_energy_kwh"]),
+                count=result.get("device_count", 0),
+                online=result.get("online_count", 0),
+            )
+        wh = result.get("values", {}).get("energy_wh")
+        if not isinstance(wh, (int, float)):
+            return None
+        return t["energy_device"].format(name=name, kwh=_fmt_number(wh / 1000))
+
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Execution
+# ---------------------------------------------------------------------------
+
+def _tool_call(intent: Intent, ctx: EntityContext) -> tuple[str, dict]:
+    """Return the (tool_name, tool_input) that answers *intent* for *ctx*."""
+    if intent == Intent.ACTIVE_ALARMS:
+        return "get_alarms", {
+            "entity_id": ctx.entity_id,
+            "entity_type": ctx.entity_type,
+            "status": "ACTIVE",
+        }
+    if intent == Intent.DIM_LEVEL:
+        return "get_device_telemetry", {
+            "device_id": ctx.entity_id,
+            "keys": ["dim_value"],
+            "time_range": "latest",
+        }
+    if ctx.entity_type == "ASSET":
+        return "get_site_summary", {"site_id": ctx.entity_id, "time_range": "today"}
+    return "get_device_telemetry", {
+        "device_id": ctx.entity_id,
+        "keys": ["energy_wh"],
+        "time_range": "today",
+        "aggregation": "SUM",
+    }
+
+
+async def try_fast_path(
+    match: IntentMatch,
+    tb: TBClient,
+    ctx: EntityContext,
+) -> FastPathAnswer | None:
+    """Run the tool for *match* and render it; None means fall back to Claude."""
+    tool_name, tool_input = _tool_call(match.intent, ctx)
+    result = await execute_tool(tool_name, tool_input, tb, ctx)
+    if not isinstance(result, dict) or "error" in result:
+        return None
+
+    name = (
+        result.get("device_name")
+        or result.get("site_name")
+        or ctx.entity_name
+        or ("bu cihaz" if match.language == "tr" else "this device")
+    )
+    text = _render(match.intent, match.language, name, result)
+    if text is None:
+        return None
+    return FastPathAnswer(
+        intent=match.intent,
+        text=text,
+        tool_name=tool_name,
+        tool_input=tool_input,
+        tool_result=result,
+    )
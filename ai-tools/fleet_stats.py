@@ -0,0 +1,99 @@
+"""Vectorised ranking and peer anomaly scores over fleet telemetry.
+
+``rank_devices`` and ``find_anomalies`` fetch one value per device in bulk
+and hand arrays to these helpers, so only the handful of devices that
+matter go back to Claude.
+
+- ``top_k`` — indices of the *k* largest (or smallest) values.
+- ``peer_scores`` — each value's deviation from its peer group (the
+  devices at the same site) as a z-score or a robust z-score (median and
+  MAD scaled by 1.4826). Groups smaller than ``MIN_PEERS`` are compared
+  with the whole scope instead. Medians are computed for all groups at
+  once from one lexsort.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+MIN_PEERS = 5
+MAD_SCALE = 1.4826       # MAD → σ for normal data
+MEAN_AD_SCALE = 1.2533   # mean absolute deviation → σ, when the MAD is 0
+
+
+def top_k(values: np.ndarray, k: int, largest: bool = True) -> np.ndarray:
+    """Indices of the *k* largest (or smallest) values, best first."""
+    k = min(k, len(values))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    keyed = -values if largest else values
+    part = np.argpartition(keyed, k - 1)[:k]
+    return part[np.argsort(keyed[part], kind="stable")]
+
+
+def _group_medians(values: np.ndarray, groups: np.ndarray, n_groups: int) -> np.ndarray:
+    """Median of *values* per group code (0..n_groups-1)."""
+    order = np.lexsort((values, groups))
+    ordered = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    lo = starts + (counts - 1) // 2
+    hi = starts + counts // 2
+    medians = np.full(n_groups, np.nan)
+    has = counts > 0
+    medians[has] = (ordered[lo[has]] + ordered[hi[has]]) / 2
+    return medians
+
+
+def peer_scores(
+    values: np.ndarray, groups: np.ndarray, method: str = "mad"
+) -> tuple[np.ndarray, np.ndarray]:
+    """Return (score, peer centre) per value.
+
+    *groups* are integer peer-group codes. With ``method="mad"`` the centre
+    is the group median and the scale the scaled MAD; with ``"zscore"`` the
+    mean and standard deviation. A value whose peers show no spread at all
+    scores 0.
+    """
+    n_groups = int(groups.max()) + 1 if len(groups) else 0
+    counts = np.bincount(groups, minlength=n_groups)
+    # Devices in small groups are scored against the whole scope
+    small = counts[groups] < MIN_PEERS
+    codes = np.where(small, n_groups, groups)
+    n_codes = n_groups + 1
+
+    if method == "zscore":
+        # Each value counts in its own group and in the scope-wide slot
+        all_codes = np.concatenate((groups, np.full(len(values), n_groups)))
+        all_values = np.concatenate((values, values))
+        n = np.bincount(all_codes, minlength=n_codes)
+        sums = np.bincount(all_codes, weights=all_values, minlength=n_codes)
+        means = np.divide(sums, n, out=np.zeros(n_codes), where=n > 0)
+        sq = np.bincount(
+            all_codes, weights=(all_values - means[all_codes]) ** 2, minlength=n_codes
+        )
+        stds = np.sqrt(np.divide(sq, n, out=np.zeros(n_codes), where=n > 0))
+        centre, scale = means[codes], stds[codes]
+    else:
+        # Group medians, plus the scope-wide median in the extra slot
+        medians = np.append(
+            _group_medians(values, groups, n_groups), np.median(values)
+        )
+        dev = np.abs(values - medians[codes])
+        # Deviations of every value from its group median, and from the scope median
+        scope_dev = np.abs(values - medians[n_groups])
+        mads = np.append(
+            _group_medians(dev, groups, n_groups), np.median(scope_dev)
+        )
+        n = np.append(counts, len(values)).astype(np.float64)
+        dev_sums = np.append(
+            np.bincount(groups, weights=dev, minlength=n_groups), scope_dev.sum()
+        )
+        mean_ads = np.divide(dev_sums, n, out=np.zeros(n_codes), where=n > 0)
+        scales = np.where(mads > 0, MAD_SCALE * mads, MEAN_AD_SCALE * mean_ads)
+        centre, scale = medians[codes], scales[codes]
+
+    scores = np.divide(
+        values - centre, scale, out=np.zeros(len(values)), where=scale > 0
+    )
+    return scores, centre
@@ -1,9 +1,17 @@
-"""Input guardrails — topic restriction and prompt injection protection."""
+"""Input guardrails — topic restriction and prompt injection protection.
+
+All keyword groups (topic, tier, confirmation) are compiled into one word
+table, so ``scan_message`` finds every keyword flag in a single pass over
+the text; injection phrases are one combined regex searched anywhere in
+it. ``check_message`` runs the whole guard — cleaning, topic, length,
+injection and tier — on top of that one scan.
+"""
 
 from __future__ import annotations
 
 import re
 import unicodedata
+from dataclasses import dataclass
 from enum import Enum
 
 
@@ -18,121 +26,232 @@ class MessageTier(str, Enum):
     COMMAND = "command"         # Tier 2 — all tools (12)
 
 
+# ---------------------------------------------------------------------------
+# Keyword groups
+# ---------------------------------------------------------------------------
+# Entries are whole words, matched case-insensitively. A multi-word entry
+# ("go ahead") is a phrase: its first word is looked up like any other and
+# the rest must follow, separated by whitespace; regex syntax is allowed in
+# the rest ("set (?:to|the)").
+
+# Keywords that indicate an on-topic message
+_TOPIC_WORDS: tuple[str, ...] = (
+    # Lighting
+    "light", "lights", "lamp", "lamps", "dim", "dims", "dimm", "bright",
+    "brightness", "led", "dali", "d4i", "fixture", "luminaire", "controller",
+    "driver", "dimming", "dimLevel", "luminous", "lux", "schedule", "timer",
+    "automation", "sunrise", "sunset", "timetable", "program",
+    # Energy
+    "energy", "power", "watt", "watts", "kwh", "wh", "consumption", "saving",
+    "savings", "cost", "bill", "carbon", "co2", "emission", "efficiency",
+    "tariff", "rate",
+    # Status / devices
+    "device", "devices", "site", "sites", "online", "offline", "fault",
+    "faults", "alarm", "alarms", "alert", "alerts", "status", "health",
+    "temperature", "active", "inactive", "location", "gps", "coordinate",
+    "timezone", "latitude", "longitude",
+    # SignConnect / LoRaWAN
+    "signconnect", "lorawan", "lora", "sign", "gateway", "gateways", "mqtt",
+    "downlink", "uplink", "sensor", "sensors",
+    # Greetings / meta
+    "hello", "hi", "hey", "help", "what can you", "how do", "thank", "thanks",
+    "sorry", "please", "who are you", "can you",
+    # Confirmation / response (EN)
+    "yes", "no", "ok", "okay", "sure", "confirm", "confirmed", "go ahead",
+    "do it", "proceed", "cancel", "stop", "correct", "right", "exactly",
+    "approve", "deny", "reject", "absolutely", "definitely", "nope", "yep",
+    "yeah", "nah", "affirmative", "negative",
+    # Confirmation / response (TR)
+    "evet", "hayır", "tamam", "onayla", "onaylıyorum", "iptal", "devam", "dur",
+    "lütfen", "doğru", "yanlış", "kesinlikle", "olur", "olmaz", "yap", "yapma",
+    "gönder",
+    # Operations
+    "compare", "summary", "overview", "report", "trend", "history",
+    "dashboard", "chart", "graph", "total", "average", "aggregate",
+)
+
 # Positive confirmation words
-_POSITIVE_CONFIRMATION = re.compile(
-    r"\b(yes|ok|okay|sure|confirm|confirmed|go\s+ahead|do\s+it|proceed|"
-    r"approve|yep|yeah|absolutely|definitely|affirmative|correct|exactly|right|"
-    r"evet|tamam|onayla|onaylıyorum|olur|yap|gönder|kesinlikle|doğru|devam)\b",
-    re.IGNORECASE,
+_CONFIRMATION_WORDS: tuple[str, ...] = (
+    "yes", "ok", "okay", "sure", "confirm", "confirmed", "go ahead", "do it",
+    "proceed", "approve", "yep", "yeah", "absolutely", "definitely",
+    "affirmative", "correct", "exactly", "right",
+    "evet", "tamam", "onayla", "onaylıyorum", "olur", "yap", "gönder",
+    "kesinlikle", "doğru", "devam",
 )
 
 # Command action verbs (EN + TR)
-_COMMAND_KEYWORDS = re.compile(
-    r"\b(dim|dims|dimm|bright|brightness|"
-    r"set\s+(?:to|the|dim|level|brightness|location|timezone|coordinates?)|"
-    r"change|turn\s+(?:on|off)|switch|schedule|timer|automat|"
-    r"control|configure|adjust|deploy|delete|remove|update|"
-    r"send|execute|apply|activate|deactivate|"
+_COMMAND_WORDS: tuple[str, ...] = (
+    "dim", "dims", "dimm", "bright", "brightness",
+    "set (?:to|the|dim|level|brightness|location|timezone|coordinates?)",
+    "change", "turn (?:on|off)", "switch", "schedule", "timer", "automat",
+    "control", "configure", "adjust", "deploy", "delete", "remove", "update",
+    "send", "execute", "apply", "activate", "deactivate",
     # Turkish command verbs
-    r"kıs|kapat|aç|ayarla|değiştir|sil|kaldır|kurulum)\b",
-    re.IGNORECASE,
+    "kıs", "kapat", "aç", "ayarla", "değiştir", "sil", "kaldır", "kurulum",
 )
 
-# Data keywords — topic patterns MINUS greetings/confirmation
-_DATA_KEYWORDS = re.compile(
-    r"\b(lights?|lamps?|led|dali|d4i|fixture|luminaire|controller|"
-    r"driver|dimming|luminous|lux|sunrise|sunset|timetable|program|"
-    r"energy|power|watts?|kwh|wh|consumption|saving|savings|cost|bill|"
-    r"carbon|co2|emission|efficiency|tariff|rate|"
-    r"device|devices|site|sites|online|offline|fault|faults|alarm|alarms|"
-    r"alert|alerts|status|health|temperature|active|inactive|"
-    r"location|gps|coordinate|timezone|latitude|longitude|"
-    r"signconnect|lorawan|lora|gateway|gateways|mqtt|downlink|uplink|sensor|sensors|"
-    r"compare|summary|overview|report|trend|history|dashboard|chart|graph|"
-    r"total|average|aggregate)\b",
-    re.IGNORECASE,
+# Data keywords — topic words MINUS greetings/confirmation
+_DATA_WORDS: tuple[str, ...] = (
+    "light", "lights", "lamp", "lamps", "led", "dali", "d4i", "fixture",
+    "luminaire", "controller", "driver", "dimming", "luminous", "lux",
+    "sunrise", "sunset", "timetable", "program",
+    "energy", "power", "watt", "watts", "kwh", "wh", "consumption", "saving",
+    "savings", "cost", "bill", "carbon", "co2", "emission", "efficiency",
+    "tariff", "rate",
+    "device", "devices", "site", "sites", "online", "offline", "fault",
+    "faults", "alarm", "alarms", "alert", "alerts", "status", "health",
+    "temperature", "active", "inactive",
+    "location", "gps", "coordinate", "timezone", "latitude", "longitude",
+    "signconnect", "lorawan", "lora", "gateway", "gateways", "mqtt",
+    "downlink", "uplink", "sensor", "sensors",
+    "compare", "summary", "overview", "report", "trend", "history",
+    "dashboard", "chart", "graph", "total", "average", "aggregate",
 )
 
+# Prompt injection phrases — matched anywhere, even inside a longer word
+_INJECTION_PHRASES: tuple[str, ...] = (
+    r"ignore\s+(?:all\s+)?(?:previous|prior|above)",
+    r"forget\s+(?:your|all|previous)",
+    r"override\s+(?:your|the|system)",
+    r"pretend\s+(?:you|to\s+be)",
+    r"jailbreak",
+    r"you\s+are\s+now",
+    r"new\s+instructions",
+    r"disregard\s+(?:your|the|previous|all)",
+    r"system\s*prompt",
+    r"<\s*(?:system|admin|root)",
+    r"\]\s*\[?\s*(?:INST|SYS)",
+)
 
-def classify_message(
-    message: str,
-    has_pending_confirmation: bool = False,
-) -> MessageTier:
-    """Classify message to determine which tool tier to use.
+_WORD_GROUPS: dict[str, tuple[str, ...]] = {
+    "topic": _TOPIC_WORDS,
+    "confirmation": _CONFIRMATION_WORDS,
+    "command": _COMMAND_WORDS,
+    "data": _DATA_WORDS,
+}
 
-    Priority: COMMAND > DATA_QUERY > GREETING.
-    Called AFTER is_on_topic() has already rejected off-topic messages.
-    """
-    text = message.strip()
 
-    # Short positive confirmation with pending command → need all tools
-    if has_pending_confirmation and len(text) < 60:
-        if _POSITIVE_CONFIRMATION.search(text):
-            return MessageTier.COMMAND
+# ---------------------------------------------------------------------------
+# Combined single-pass matcher
+# ---------------------------------------------------------------------------
+# One tokenizer regex walks the words of the text. Words are looked up in a
+# table built from all keyword groups (word → flags, plus the phrases that
+# start with it), so each word costs one dict lookup no matter how many
+# keywords there are. Injection phrases are not tied to word boundaries
+# ("pleasejailbreak"), so they are one unanchored search of their own.
+
+# Match re.IGNORECASE for the Turkish dotted / dotless i
+_I_FOLD = str.maketrans({"İ": "i", "ı": "i"})
+
+
+def _fold(word: str) -> str:
+    return word.translate(_I_FOLD).lower()
+
 
-    # Command action verbs → all tools
-    if _COMMAND_KEYWORDS.search(text):
-        return MessageTier.COMMAND
+class _Entry:
+    """Keyword-table entry: flags of the bare word and of phrases it starts."""
 
-    # Data/topic keywords → read-only tools
-    if _DATA_KEYWORDS.search(text):
-        return MessageTier.DATA_QUERY
+    __slots__ = ("flags", "phrases")
+
+    def __init__(self):
+        self.flags: frozenset[str] = frozenset()
+        self.phrases: list[tuple[re.Pattern, frozenset[str]]] = []
+
+
+def _build_table() -> dict[str, _Entry]:
+    table: dict[str, _Entry] = {}
+    phrase_flags: dict[tuple[str, str], set[str]] = {}
+    for flag, words in _WORD_GROUPS.items():
+        for word in words:
+            first, _, rest = word.partition(" ")
+            entry = table.setdefault(_fold(first), _Entry())
+            if rest:
+                phrase_flags.setdefault((_fold(first), rest), set()).add(flag)
+            else:
+                entry.flags = entry.flags | {flag}
+    for (first, rest), flags in phrase_flags.items():
+        tail = re.compile(r"\s+" + rest.replace(" ", r"\s+") + r"\b", re.IGNORECASE)
+        table[first].phrases.append((tail, frozenset(flags)))
+    return table
+
+
+_KEYWORDS = _build_table()
+_TOKENIZER = re.compile(r"\w+")
+_INJECTION = re.compile("|".join(_INJECTION_PHRASES), re.IGNORECASE)
+_ALL_FLAGS = frozenset(_WORD_GROUPS)
+
+
+@dataclass(frozen=True)
+class ScanResult:
+    """Keyword flags found in one message."""
+
+    on_topic: bool
+    command: bool
+    data: bool
+    confirmation: bool
+    injection: bool
+
+    def tier(self, has_pending_confirmation: bool = False, length: int = 0) -> MessageTier:
+        """Tool tier for the message. Priority: COMMAND > DATA_QUERY > GREETING."""
+        # Short positive confirmation with pending command → need all tools
+        if has_pending_confirmation and length < 60 and self.confirmation:
+            return MessageTier.COMMAND
+        if self.command:
+            return MessageTier.COMMAND
+        if self.data:
+            return MessageTier.DATA_QUERY
+        # Pure greeting, confirmation without pending, meta → no tools
+        return MessageTier.GREETING
+
+
+def scan_message(text: str) -> ScanResult:
+    """Find topic, tier and confirmation flags in one pass, plus injection."""
+    text = _fold(text)
+    found: set[str] = set()
+    for m in _TOKENIZER.finditer(text):
+        entry = _KEYWORDS.get(m.group())
+        if entry is None:
+            continue
+        found |= entry.flags
+        for tail, flags in entry.phrases:
+            if tail.match(text, m.end()):
+                found |= flags
+        if found == _ALL_FLAGS:
+            break
+    return ScanResult(
+        on_topic="topic" in found,
+        command="command" in found,
+        data="data" in found,
+        confirmation="confirmation" in found,
+        injection=_INJECTION.search(text) is not None,
+    )
 
-    # Pure greeting, confirmation without pending, meta → no tools
-    return MessageTier.GREETING
 
 # ---------------------------------------------------------------------------
-# Topic restriction
+# Confirmation context
 # ---------------------------------------------------------------------------
 
-# Case-insensitive keyword sets that indicate an on-topic message
-_TOPIC_KEYWORDS: list[re.Pattern] = [
-    # Lighting
-    re.compile(
-        r"\b(lights?|lamps?|dim|dims|dimm|bright|brightness|led|dali|d4i|"
-        r"fixture|luminaire|controller|driver|dimming|dimLevel|luminous|lux|"
-        r"schedule|timer|automation|sunrise|sunset|timetable|program)\b",
-        re.IGNORECASE,
-    ),
-    # Energy
-    re.compile(
-        r"\b(energy|power|watts?|kwh|wh|consumption|saving|savings|cost|"
-        r"bill|carbon|co2|emission|efficiency|tariff|rate)\b",
-        re.IGNORECASE,
-    ),
-    # Status / devices
-    re.compile(
-        r"\b(device|devices|site|sites|online|offline|fault|faults|alarm|"
-        r"alarms|alert|alerts|status|health|temperature|active|inactive|"
-        r"location|gps|coordinate|timezone|latitude|longitude)\b",
-        re.IGNORECASE,
-    ),
-    # SignConnect / LoRaWAN
-    re.compile(
-        r"\b(signconnect|lorawan|lora|sign|gateway|gateways|mqtt|downlink|"
-        r"uplink|sensor|sensors)\b",
-        re.IGNORECASE,
-    ),
-    # Greetings / meta / confirmation
-    re.compile(
-        r"\b(hello|hi|hey|help|what can you|how do|thank|thanks|sorry|"
-        r"please|who are you|can you|"
-        # Confirmation / response (EN)
-        r"yes|no|ok|okay|sure|confirm|confirmed|go ahead|do it|proceed|"
-        r"cancel|stop|correct|right|exactly|approve|deny|reject|"
-        r"absolutely|definitely|nope|yep|yeah|nah|affirmative|negative|"
-        # Confirmation / response (TR)
-        r"evet|hayır|tamam|onayla|onaylıyorum|iptal|devam|dur|lütfen|"
-        r"doğru|yanlış|kesinlikle|olur|olmaz|yap|yapma|gönder)\b",
-        re.IGNORECASE,
-    ),
-    # Operations
-    re.compile(
-        r"\b(compare|summary|overview|report|trend|history|schedule|"
-        r"dashboard|chart|graph|total|average|aggregate)\b",
-        re.IGNORECASE,
-    ),
-]
+# Assistant phrases that ask the user to confirm a command (EN + TR)
+_CONFIRMATION_PROMPTS = (
+    "confirm", "shall i", "proceed", "go ahead",
+    "would you like", "want me to", "should i",
+    "onaylıyor", "onaylayın", "devam edeyim",
+    "yapmamı ister", "göndere", "onay",
+)
+
+
+def has_pending_confirmation(chat_history) -> bool:
+    """Return True if the last assistant turn asked the user to confirm."""
+    for msg in reversed(chat_history):
+        if msg.role == "assistant":
+            text_lower = msg.content.lower()
+            return any(phrase in text_lower for phrase in _CONFIRMATION_PROMPTS)
+    return False
+
+
+# ---------------------------------------------------------------------------
+# Responses
+# ---------------------------------------------------------------------------
 
 REJECTION_RESPONSE = (
     "I can only help with SignConnect lighting and energy queries. "
@@ -145,41 +264,109 @@ REJECTION_SUGGESTIONS = [
     "Energy savings today?",
 ]
 
+INJECTION_RESPONSE = (
+    "I'm not able to process that request. "
+    "Please ask about your lighting or energy data."
+)
+
+MAX_MESSAGE_LENGTH = 2000
 
-def is_on_topic(message: str) -> bool:
-    """Return True if the message matches any lighting/energy topic keyword."""
-    for pattern in _TOPIC_KEYWORDS:
-        if pattern.search(message):
-            return True
-    return False
+LENGTH_RESPONSE = "Please keep your message shorter (under 2,000 characters)."
 
 
 # ---------------------------------------------------------------------------
-# Prompt injection protection
+# Input cleaning
 # ---------------------------------------------------------------------------
 
-_INJECTION_PATTERNS: list[re.Pattern] = [
-    re.compile(r"ignore\s+(all\s+)?(previous|prior|above)", re.IGNORECASE),
-    re.compile(r"forget\s+(your|all|previous)", re.IGNORECASE),
-    re.compile(r"override\s+(your|the|system)", re.IGNORECASE),
-    re.compile(r"pretend\s+(you|to\s+be)", re.IGNORECASE),
-    re.compile(r"jailbreak", re.IGNORECASE),
-    re.compile(r"you\s+are\s+now", re.IGNORECASE),
-    re.compile(r"new\s+instructions", re.IGNORECASE),
-    re.compile(r"disregard\s+(your|the|previous|all)", re.IGNORECASE),
-    re.compile(r"system\s*prompt", re.IGNORECASE),
-    re.compile(r"<\s*(system|admin|root)", re.IGNORECASE),
-    re.compile(r"\]\s*\[?\s*(INST|SYS)", re.IGNORECASE),
-]
+class _StripTable(dict):
+    """``str.translate`` table deleting control / format / unassigned chars.
 
-INJECTION_RESPONSE = (
-    "I'm not able to process that request. "
-    "Please ask about your lighting or energy data."
+    Pre-filled with the BMP control and format characters (zero-width
+    spaces, bidi marks, BOM); any other code point is classified on first
+    sight and cached. Newlines and tabs are kept.
+    """
+
+    def __missing__(self, codepoint: int) -> int | None:
+        value = None if _is_stripped(codepoint) else codepoint
+        self[codepoint] = value
+        return value
+
+
+def _is_stripped(codepoint: int) -> bool:
+    ch = chr(codepoint)
+    return ch not in ("\n", "\t", "\r") and unicodedata.category(ch).startswith("C")
+
+
+_STRIP_TABLE = _StripTable(
+    (cp, None) for cp in range(0x10000)
+    if unicodedata.category(chr(cp)) in ("Cc", "Cf") and _is_stripped(cp)
 )
 
-MAX_MESSAGE_LENGTH = 2000
+_RUN_OF_SPACES = re.compile(r"[ \t]{10,}")
+_RUN_OF_NEWLINES = re.compile(r"\n{4,}")
 
-LENGTH_RESPONSE = "Please keep your message shorter (under 2,000 characters)."
+
+def clean_message(message: str) -> str:
+    """Strip zero-width / control characters and collapse long whitespace."""
+    cleaned = message.translate(_STRIP_TABLE)
+    cleaned = _RUN_OF_SPACES.sub(" ", cleaned)
+    return _RUN_OF_NEWLINES.sub("\n\n\n", cleaned)
+
+
+# ---------------------------------------------------------------------------
+# Guard entry points
+# ---------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class GuardResult:
+    """Outcome of ``check_message``.
+
+    ``rejection`` is None when the message may proceed; otherwise it is the
+    response to send back and ``reason`` is one of off_topic / too_long /
+    injection.
+    """
+
+    cleaned: str
+    tier: MessageTier
+    rejection: str | None = None
+    reason: str | None = None
+
+
+def check_message(message: str, has_pending_confirmation: bool = False) -> GuardResult:
+    """Run the full input guard with a single keyword scan.
+
+    The message is cleaned first, so keywords split by zero-width
+    characters are still recognised. Checks apply in the order topic →
+    length → injection.
+    """
+    cleaned = clean_message(message)
+    flags = scan_message(cleaned)
+    if not flags.on_topic:
+        return GuardResult(cleaned, MessageTier.OFF_TOPIC, REJECTION_RESPONSE, "off_topic")
+    if len(message) > MAX_MESSAGE_LENGTH:
+        return GuardResult(cleaned, MessageTier.OFF_TOPIC, LENGTH_RESPONSE, "too_long")
+    if flags.injection:
+        return GuardResult(cleaned, MessageTier.OFF_TOPIC, INJECTION_RESPONSE, "injection")
+    tier = flags.tier(has_pending_confirmation, len(cleaned.strip()))
+    return GuardResult(cleaned, tier)
+
+
+def is_on_topic(message: str) -> bool:
+    """Return True if the message matches any lighting/energy topic keyword."""
+    return scan_message(message).on_topic
+
+
+def classify_message(
+    message: str,
+    has_pending_confirmation: bool = False,
+) -> MessageTier:
+    """Classify message to determine which tool tier to use.
+
+    Priority: COMMAND > DATA_QUERY > GREETING.
+    Called AFTER is_on_topic() has already rejected off-topic messages.
+    """
+    text = message.strip()
+    return scan_message(text).tier(has_pending_confirmation, len(text))
 
 
 def sanitize_input(message: str) -> tuple[bool, str]:
@@ -187,23 +374,9 @@ def sanitize_input(message: str) -> tuple[bool, str]:
 
     Returns (is_safe, cleaned_message_or_rejection_reason).
     """
-    # Length check
     if len(message) > MAX_MESSAGE_LENGTH:
         return False, LENGTH_RESPONSE
-
-    # Strip zero-width and control characters (keep newlines/tabs)
-    cleaned = "".join(
-        ch for ch in message
-        if ch in ("\n", "\t", "\r")
-        or not unicodedata.category(ch).startswith("C")
-    )
-    # Collapse excessive whitespace
-    cleaned = re.sub(r"[ \t]{10,}", " ", cleaned)
-    cleaned = re.sub(r"\n{4,}", "\n\n\n", cleaned)
-
-    # Check injection patterns
-    for pattern in _INJECTION_PATTERNS:
-        if pattern.search(cleaned):
-            return False, INJECTION_RESPONSE
-
+    cleaned = clean_message(message)
+    if scan_message(cleaned).injection:
+        return False, INJECTION_RESPONSE
     return True, cleaned
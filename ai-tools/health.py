@@ -0,0 +1,165 @@
+"""Background health prober for ThingsBoard and Anthropic.
+
+Probes both upstreams every ``HEALTH_PROBE_INTERVAL`` seconds and keeps
+the result in memory, so ``/api/health`` answers from cache without any
+network I/O. A target is only reported down after
+``HEALTH_FAILURE_THRESHOLD`` consecutive failed probes, which keeps
+probes from flapping on a single slow response.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+import anthropic
+
+import config
+from metrics import HEALTH_PROBE_SECONDS, HEALTH_UP
+from tb_client import TBClient
+
+logger = logging.getLogger(__name__)
+
+
+class ProbeState:
+    """Last known reachability and latency of one upstream."""
+
+    def __init__(self, target: str):
+        self.target = target
+        self.ok: bool | None = None  # None until the first probe completes
+        self.last_check: float | None = None
+        self.last_success: float | None = None
+        self.last_latency: float | None = None
+        self.last_error: str | None = None
+        self.consecutive_failures = 0
+
+    def record(self, success: bool, latency: float, error: str | None, threshold: int) -> None:
+        now = time.time()
+        self.last_check = now
+        self.last_latency = latency
+        if success:
+            self.last_success = now
+            self.last_error = None
+            self.consecutive_failures = 0
+            self.ok = True
+        else:
+            self.last_error = error
+            self.consecutive_failures += 1
+            if self.ok is None or self.consecutive_failures >= threshold:
+                self.ok = False
+        HEALTH_PROBE_SECONDS.observe(latency, target=self.target)
+        HEALTH_UP.set(1 if self.ok else 0, target=self.target)
+
+    def as_dict(self) -> dict:
+        now = time.time()
+
+        def age(ts: float | None) -> float | None:
+            return round(now - ts, 1) if ts is not None else None
+
+        return {
+            "ok": self.ok,
+            "last_success_age_s": age(self.last_success),
+            "last_check_age_s": age(self.last_check),
+            "latency_ms": round(self.last_latency * 1000, 1) if self.last_latency is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "latency_histogram": HEALTH_PROBE_SECONDS.snapshot(target=self.target),
+        }
+
+
+class HealthProber:
+    """Periodically probes ThingsBoard and Anthropic in the background."""
+
+    def __init__(
+        self,
+        tb: TBClient,
+        anthropic_client: anthropic.AsyncAnthropic,
+        interval: float,
+        timeout: float,
+        failure_threshold: int,
+    ):
+        self.tb = tb
+        self.anthropic_client = anthropic_client
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.thingsboard = ProbeState("thingsboard")
+        self.anthropic = ProbeState("anthropic")
+        self._task: asyncio.Task | None = None
+
+    # -- Probes ----------------------------------------------------------
+
+    async def _probe_tb(self) -> None:
+        ok = await self.tb.check_connectivity()
+        if not ok:
+            raise RuntimeError("ThingsBoard auth/user check failed")
+
+    async def _probe_anthropic(self) -> None:
+        if not config.ANTHROPIC_API_KEY:
+            raise RuntimeError("ANTHROPIC_API_KEY not configured")
+        # Model listing is authenticated but costs no tokens
+        await self.anthropic_client.models.list(limit=1)
+
+    async def _run_probe(self, state: ProbeState, probe: Callable[[], Awaitable[None]]) -> None:
+        start = time.perf_counter()
+        error = None
+        try:
+            await asyncio.wait_for(probe(), self.timeout)
+        except asyncio.TimeoutError:
+            error = f"timeout after {self.timeout:g}s"
+        except Exception as exc:
+            error = str(exc) or type(exc).__name__
+        state.record(error is None, time.perf_counter() - start, error, self.failure_threshold)
+        if error is not None:
+            logger.warning(
+                "Health probe %s failed (%d in a row): %s",
+                state.target, state.consecutive_failures, error,
+            )
+
+    async def probe_once(self) -> None:
+        """Probe both targets concurrently and update the cached state."""
+        await asyncio.gather(
+            self._run_probe(self.thingsboard, self._probe_tb),
+            self._run_probe(self.anthropic, self._probe_anthropic),
+        )
+
+    # -- Lifecycle -------------------------------------------------------
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.probe_once()
+            except Exception:
+                logger.exception("Health probe loop error")
+
+    async def start(self) -> None:
+        """Run a first probe, then keep probing in the background."""
+        await self.probe_once()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # -- Reporting -------------------------------------------------------
+
+    def is_up(self, state: ProbeState) -> bool:
+        """True if *state* is up and was probed recently (prober not stuck)."""
+        if not state.ok or state.last_check is None:
+            return False
+        return time.time() - state.last_check < 3 * self.interval + self.timeout
+
+    def status(self) -> dict:
+        """Cached health of both targets — no network I/O."""
+        return {
+            "thingsboard": self.thingsboard.as_dict(),
+            "anthropic": self.anthropic.as_dict(),
+        }
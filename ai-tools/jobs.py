@@ -0,0 +1,251 @@
+"""Background job mode for long-running chat requests.
+
+Fleet-wide questions ("compare all 60 sites this month") fan out into
+hundreds of ThingsBoard calls and can outlive proxy timeouts. When the
+estimated fan-out of a request exceeds ``JOB_FANOUT_THRESHOLD`` the
+endpoint returns a job ID straight away and ``process_chat`` continues in
+a background task. Concurrency across jobs is bounded by a semaphore, and
+at most ``JOB_MAX_PENDING`` jobs may be queued or running; beyond that a
+job request is shed with 503 like an inline one.
+Progress events (tool started / finished, per-site partial results) are
+collected via ``progress.emit`` and can be polled or streamed as SSE.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import re
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable
+
+from admission import AdmissionRejected
+from cache import get_cached_hierarchy, get_cached_scope
+from metrics import JOBS_ACTIVE, JOBS_TOTAL
+from models import ChatResponse, EntityContext
+from progress import use_sink
+
+logger = logging.getLogger(__name__)
+
+# ThingsBoard requests per device for a site summary (latest + history + attrs)
+TB_CALLS_PER_DEVICE = 4
+
+# Smoothing factor for the job-duration average used in Retry-After
+_JOB_EWMA_ALPHA = 0.2
+
+# Questions that span many sites rather than the dashboard entity
+_FLEET_WIDE = re.compile(
+    r"\b(compar\w*|rank\w*|all\s+(the\s+)?sites|every\s+site|each\s+site|"
+    r"across|whole\s+(estate|fleet|region)|fleet|"
+    r"karşılaştır\w*|tüm|bütün|her\s+saha)\b",
+    re.IGNORECASE,
+)
+
+
+# ---------------------------------------------------------------------------
+# Fan-out estimation
+# ---------------------------------------------------------------------------
+
+def _find_node(node: dict, entity_id: str) -> dict | None:
+    """Depth-first search of the hierarchy for the node with *entity_id*."""
+    if node.get("id") == entity_id:
+        return node
+    for key in ("estates", "regions", "sites"):
+        for child in node.get(key, []):
+            found = _find_node(child, entity_id)
+            if found is not None:
+                return found
+    return None
+
+
+def _count(node: dict) -> tuple[int, int]:
+    """Return (sites, devices) under a hierarchy node."""
+    if "devices" in node and "sites" not in node and "regions" not in node:
+        return 1, len(node["devices"])
+    sites = devices = 0
+    for key in ("estates", "regions", "sites"):
+        for child in node.get(key, []):
+            s, d = _count(child)
+            sites += s
+            devices += d
+    return sites, devices
+
+
+def estimate_fanout(message: str, context: EntityContext | None) -> tuple[int, int]:
+    """Estimate (ThingsBoard calls, sites) a request is likely to trigger.
+
+    Uses the cached hierarchy only (or, for a site-scoped request, the
+    context's cached branch) — with neither the estimate is 0 and the
+    request runs inline. Fleet-wide wording scopes the
+    estimate to the whole customer (or the estate / region on screen);
+    otherwise an asset context is scoped to that asset's subtree.
+    """
+    if not context or not context.customer_id:
+        return 0, 0
+    hierarchy = get_cached_hierarchy(context.customer_id)
+    if hierarchy is None and context.entity_id:
+        # A site's own branch still sizes site-scoped requests
+        hierarchy = get_cached_scope(context.customer_id, context.entity_id)
+    if hierarchy is None:
+        return 0, 0
+
+    node = _find_node(hierarchy, context.entity_id) if context.entity_id else None
+    if _FLEET_WIDE.search(message):
+        if hierarchy.get("partial"):
+            return 0, 0
+        subtype = (context.entity_subtype or "").lower()
+        if node is None or subtype not in ("estate", "region"):
+            node = hierarchy
+    elif node is None or context.entity_type != "ASSET":
+        return 0, 0
+
+    sites, devices = _count(node)
+    return devices * TB_CALLS_PER_DEVICE, sites
+
+
+# ---------------------------------------------------------------------------
+# Job store
+# ---------------------------------------------------------------------------
+
+class Job:
+    """One background chat request and the progress events it produced."""
+
+    def __init__(self, customer_id: str | None):
+        self.id = uuid.uuid4().hex
+        self.customer_id = customer_id
+        self.status = "queued"  # queued → running → done | failed
+        self.created = time.time()
+        self.updated = self.created
+        self.events: list[dict] = []
+        self.result: ChatResponse | None = None
+        self.task: asyncio.Task | None = None
+        self._changed = asyncio.Event()
+
+    def add_event(self, event: dict) -> None:
+        """Append a progress event and wake any subscribers."""
+        self.events.append({"seq": len(self.events), "ts": time.time(), **event})
+        self._touch()
+
+    def set_status(self, status: str) -> None:
+        self.status = status
+        self.add_event({"type": "status", "status": status})
+
+    def _touch(self) -> None:
+        self.updated = time.time()
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def snapshot(self, since: int = 0) -> dict:
+        """Serialisable view of the job with events from *since* onwards."""
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "events": self.events[since:],
+            "next": len(self.events),
+            "result": self.result.model_dump() if self.result else None,
+        }
+
+    async def wait(self, timeout: float) -> None:
+        """Wait until the next change (or *timeout* seconds)."""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def stream(self, since: int = 0, keepalive: float = 15.0) -> AsyncIterator[dict | None]:
+        """Yield events from *since* until the job finishes; None = keep-alive."""
+        while True:
+            while since < len(self.events):
+                yield self.events[since]
+                since += 1
+            if self.finished:
+                return
+            changed = self._changed
+            try:
+                await asyncio.wait_for(changed.wait(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+
+class JobManager:
+    """In-memory job registry with bounded concurrency and TTL expiry."""
+
+    def __init__(self, max_concurrent: int, max_pending: int, ttl: float):
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._jobs: dict[str, Job] = {}
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._avg_job_seconds = 60.0
+
+    @property
+    def pending(self) -> int:
+        """Jobs queued or running."""
+        return sum(1 for j in self._jobs.values() if not j.finished)
+
+    def retry_after(self) -> int:
+        """Estimated seconds until a job slot frees up."""
+        return max(1, math.ceil(self._avg_job_seconds / max(1, self.max_concurrent)))
+
+    def get(self, job_id: str) -> Job | None:
+        self._prune()
+        return self._jobs.get(job_id)
+
+    def submit(
+        self,
+        customer_id: str | None,
+        run: Callable[[], Awaitable[ChatResponse]],
+    ) -> Job:
+        """Start *run* in the background and return its job.
+
+        Raises AdmissionRejected when ``max_pending`` jobs are already
+        queued or running.
+        """
+        self._prune()
+        if self.pending >= self.max_pending:
+            JOBS_TOTAL.inc(outcome="rejected")
+            raise AdmissionRejected("jobs_full", self.retry_after())
+        job = Job(customer_id)
+        self._jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, run))
+        JOBS_TOTAL.inc(outcome="submitted")
+        return job
+
+    async def _run(self, job: Job, run: Callable[[], Awaitable[ChatResponse]]) -> None:
+        async with self._semaphore:
+            job.set_status("running")
+            JOBS_ACTIVE.inc()
+            started = time.perf_counter()
+            try:
+                with use_sink(job.add_event):
+                    job.result = await run()
+                job.set_status("done")
+                JOBS_TOTAL.inc(outcome="done")
+            except Exception:
+                logger.exception("Chat job %s failed", job.id)
+                job.result = ChatResponse(
+                    response="An internal error occurred. Please try again.",
+                )
+                job.set_status("failed")
+                JOBS_TOTAL.inc(outcome="failed")
+            finally:
+                JOBS_ACTIVE.dec()
+                duration = time.perf_counter() - started
+                self._avg_job_seconds += _JOB_EWMA_ALPHA * (duration - self._avg_job_seconds)
+                logger.info(
+                    "CHAT_JOB id=%s customer=%s status=%s duration=%.1fs events=%d",
+                    job.id, job.customer_id or "anon", job.status,
+                    duration, len(job.events),
+                )
+
+    def _prune(self) -> None:
+        """Drop finished jobs older than the TTL."""
+        cutoff = time.time() - self.ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.updated < cutoff]:
+            del self._jobs[job_id]
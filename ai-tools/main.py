@@ -2,21 +2,27 @@
 
 from __future__ import annotations
 
+import json
 import logging
 from contextlib import asynccontextmanager
 
 import anthropic
 import uvicorn
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
 
 import config
-from chat import process_chat
-from models import ChatRequest, ChatResponse
+import metrics
+from admission import AdmissionController, AdmissionRejected, request_priority
+from chat import process_chat, start_warmup
+from health import HealthProber
+from jobs import Job, JobManager, estimate_fanout
+from models import ChatMetadata, ChatRequest, ChatResponse, EntityContext
+from multicast import multicast_groups
 from tb_client import TBClient
 
 logging.basicConfig(
@@ -41,9 +47,28 @@ async def lifespan(app: FastAPI):
 
     app.state.tb_client = tb
     app.state.anthropic_client = ac
+    app.state.admission = AdmissionController(
+        max_in_flight=config.ADMISSION_MAX_IN_FLIGHT,
+        max_queue=config.ADMISSION_MAX_QUEUE,
+        queue_timeout=config.ADMISSION_QUEUE_TIMEOUT,
+    )
+    app.state.jobs = JobManager(
+        max_concurrent=config.JOB_MAX_CONCURRENT,
+        max_pending=config.JOB_MAX_PENDING,
+        ttl=config.JOB_TTL,
+    )
+    app.state.health = HealthProber(
+        tb, ac,
+        interval=config.HEALTH_PROBE_INTERVAL,
+        timeout=config.HEALTH_PROBE_TIMEOUT,
+        failure_threshold=config.HEALTH_FAILURE_THRESHOLD,
+    )
+    await app.state.health.start()
 
     yield
 
+    await app.state.health.stop()
+    await multicast_groups.close()
     await tb.close()
     logger.info("SignConnect AI Chatbot service stopped")
 
@@ -82,29 +107,152 @@ app.add_middleware(
 
 @app.post("/api/chat", response_model=ChatResponse)
 @limiter.limit(config.RATE_LIMIT_PER_IP)
-async def chat_endpoint(request: Request, body: ChatRequest):
-    """Process a chat message and return the AI response."""
+async def chat_endpoint(request: Request, response: Response, body: ChatRequest):
+    """Process a chat message and return the AI response.
+
+    High fan-out requests return 202 with ``metadata.job_id`` instead; the
+    answer is then fetched from ``/api/chat/jobs/{job_id}``.
+    """
     tb: TBClient = app.state.tb_client
     ac: anthropic.AsyncAnthropic = app.state.anthropic_client
-    return await process_chat(body, tb, ac)
+    admission: AdmissionController = app.state.admission
+
+    if config.JOB_MODE_ENABLED:
+        fanout, sites = estimate_fanout(body.message, body.context)
+        if fanout > config.JOB_FANOUT_THRESHOLD:
+            jobs: JobManager = app.state.jobs
+            customer_id = body.context.customer_id if body.context else None
+            try:
+                job = jobs.submit(customer_id, lambda: process_chat(body, tb, ac))
+            except AdmissionRejected as exc:
+                logger.warning("Chat job shed (%s), pending=%d", exc.reason, jobs.pending)
+                return _busy_response(exc)
+            logger.info(
+                "Chat request moved to job %s (est. %d TB calls, %d sites)",
+                job.id, fanout, sites,
+            )
+            response.status_code = 202
+            return ChatResponse(
+                response=(
+                    f"This covers {sites} sites, so I'm working on it in the "
+                    "background. Results will appear here as they come in."
+                ),
+                metadata=ChatMetadata(job_id=job.id),
+            )
+
+    try:
+        async with admission.slot(request_priority(body)):
+            return await process_chat(body, tb, ac)
+    except AdmissionRejected as exc:
+        logger.warning(
+            "Chat request shed (%s), in_flight=%d queue=%d",
+            exc.reason, admission.in_flight, admission.queue_depth,
+        )
+        return _busy_response(exc)
+
+
+def _busy_response(exc: AdmissionRejected) -> JSONResponse:
+    """503 with Retry-After for a shed chat request."""
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)},
+        content={
+            "response": "The assistant is busy right now. Please try again in a moment.",
+            "metadata": {"tools_used": [], "entity_references": [], "suggestions": []},
+        },
+    )
+
+
+@app.post("/api/chat/warmup", status_code=202)
+@limiter.limit(config.RATE_LIMIT_PER_IP)
+async def chat_warmup(request: Request, body: EntityContext):
+    """Warm the caches for a widget context before the first message.
+
+    Returns at once; the customer check, hierarchy load and prefetch of the
+    context entity run in the background.
+    """
+    if not config.WARMUP_ENABLED:
+        return {"warming": False}
+    return {"warming": start_warmup(body, app.state.tb_client)}
+
+
+def _get_job(job_id: str) -> Job:
+    """Look up a job; the random 128-bit ID is the only capability to read it."""
+    job = app.state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/api/chat/jobs/{job_id}")
+@limiter.limit(config.RATE_LIMIT_PER_IP)
+async def chat_job(request: Request, job_id: str, since: int = 0, wait: float = 0):
+    """Poll a background chat job.
+
+    Returns the status, progress events from index *since* and, once done,
+    the final ChatResponse. With *wait* > 0 the call long-polls until there
+    is something new (max 25 s).
+    """
+    job = _get_job(job_id)
+    if wait > 0 and not job.finished and since >= len(job.events):
+        await job.wait(min(wait, 25.0))
+    return job.snapshot(since)
+
+
+@app.get("/api/chat/jobs/{job_id}/events")
+@limiter.limit(config.RATE_LIMIT_PER_IP)
+async def chat_job_events(request: Request, job_id: str, since: int = 0):
+    """Subscribe to a background chat job as Server-Sent Events.
+
+    Each progress event is sent as ``data: {...}``; the stream ends with an
+    ``event: result`` carrying the final ChatResponse.
+    """
+    job = _get_job(job_id)
+
+    async def stream():
+        async for event in job.stream(since):
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"id: {event['seq']}\ndata: {json.dumps(event)}\n\n"
+        yield f"event: result\ndata: {json.dumps(job.snapshot(len(job.events)))}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
 
 
 @app.get("/api/health")
 async def health():
-    """Health check — includes ThingsBoard and Anthropic key status."""
-    tb: TBClient = app.state.tb_client
-    tb_ok = await tb.check_connectivity()
+    """Health check — cached ThingsBoard / Anthropic status from the prober.
+
+    No upstream calls are made here; the background prober refreshes the
+    state every ``HEALTH_PROBE_INTERVAL`` seconds.
+    """
+    prober: HealthProber = app.state.health
+    tb_ok = prober.is_up(prober.thingsboard)
+    anthropic_ok = prober.is_up(prober.anthropic)
     api_key_ok = bool(
         config.ANTHROPIC_API_KEY and len(config.ANTHROPIC_API_KEY) > 10
     )
     return {
-        "status": "ok" if (tb_ok and api_key_ok) else "degraded",
+        "status": "ok" if (tb_ok and anthropic_ok and api_key_ok) else "degraded",
         "thingsboard": "connected" if tb_ok else "disconnected",
+        "anthropic": "reachable" if anthropic_ok else "unreachable",
         "anthropic_key": "configured" if api_key_ok else "missing",
         "model": config.AI_MODEL,
+        "model_fast": config.AI_MODEL_FAST if config.AI_ROUTING_ENABLED else None,
+        "probes": prober.status(),
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus scrape endpoint — per-stage latency, tokens, tiers."""
+    return PlainTextResponse(
+        metrics.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
 # ---------------------------------------------------------------------------
 # Global exception handler
 # ---------------------------------------------------------------------------
@@ -0,0 +1,316 @@
+"""Simple in-memory Prometheus-style metrics for the chat pipeline.
+
+Histograms and counters are kept in process memory and rendered in the
+Prometheus text exposition format by ``render()`` (served on ``/metrics``).
+"""
+
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+# Default latency buckets (seconds) — spans sub-ms guardrails to slow Claude calls
+LATENCY_BUCKETS: tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _label_key(labelnames: tuple[str, ...], labels: dict[str, str]) -> tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(
+    labelnames: tuple[str, ...],
+    values: tuple[str, ...],
+    extra: dict[str, str] | None = None,
+) -> str:
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.extend(extra.items())
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+# ---------------------------------------------------------------------------
+# Metric types
+# ---------------------------------------------------------------------------
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    def __init__(self, name: str, doc: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        _REGISTRY.append(self)
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = _label_key(self.labelnames, labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0.0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        for key, val in sorted(self._values.items()):
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(val)}"
+            )
+        return lines
+
+
+class Gauge:
+    """Point-in-time value with optional labels."""
+
+    def __init__(self, name: str, doc: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        _REGISTRY.append(self)
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[_label_key(self.labelnames, labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = _label_key(self.labelnames, labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0.0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge"]
+        for key, val in sorted(self._values.items()):
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(val)}"
+            )
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    def __init__(
+        self,
+        name: str,
+        doc: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.doc = doc
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # key → (per-bucket counts, sum, count)
+        self._series: dict[tuple[str, ...], tuple[list[int], float, int]] = {}
+        _REGISTRY.append(self)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _label_key(self.labelnames, labels)
+        counts, total, n = self._series.get(key, ([0] * len(self.buckets), 0.0, 0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        self._series[key] = (counts, total + value, n + 1)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the wall-clock duration of the ``with`` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        entry = self._series.get(_label_key(self.labelnames, labels))
+        return entry[2] if entry else 0
+
+    def snapshot(self, **labels: str) -> dict:
+        """Cumulative bucket counts, sum and count of one series as a dict."""
+        counts, total, n = self._series.get(
+            _label_key(self.labelnames, labels), ([0] * len(self.buckets), 0.0, 0),
+        )
+        buckets: dict[str, int] = {}
+        cumulative = 0
+        for bound, c in zip(self.buckets, counts):
+            cumulative += c
+            buckets[_format_value(bound)] = cumulative
+        buckets["+Inf"] = n
+        return {"buckets": buckets, "sum": round(total, 6), "count": n}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, n) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                le = _format_labels(self.labelnames, key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, key, {"le": "+Inf"})
+            lines.append(f"{self.name}_bucket{le} {n}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {n}")
+        return lines
+
+
+_REGISTRY: list[Counter | Gauge | Histogram] = []
+
+
+def render() -> str:
+    """Render every registered metric in Prometheus text format."""
+    lines: list[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------------------
+# Chat pipeline metrics
+# ---------------------------------------------------------------------------
+
+CHAT_REQUEST_SECONDS = Histogram(
+    "chat_request_seconds",
+    "End-to-end process_chat latency by message tier.",
+    ("tier",),
+)
+CHAT_REQUESTS_TOTAL = Counter(
+    "chat_requests_total",
+    "Chat requests by message tier (off_topic/rejected included).",
+    ("tier",),
+)
+GUARDRAIL_SECONDS = Histogram(
+    "chat_guardrail_seconds",
+    "Latency of each guardrail stage.",
+    ("stage",),
+)
+HIERARCHY_LOAD_SECONDS = Histogram(
+    "chat_hierarchy_load_seconds",
+    "Hierarchy load latency by cache outcome.",
+    ("cache",),
+)
+CLAUDE_CALL_SECONDS = Histogram(
+    "chat_claude_call_seconds",
+    "Latency of each Claude messages.create call.",
+    ("model", "status"),
+)
+TOOL_SECONDS = Histogram(
+    "chat_tool_seconds",
+    "Tool execution latency by tool name.",
+    ("tool", "status"),
+)
+TB_REQUEST_SECONDS = Histogram(
+    "tb_request_seconds",
+    "ThingsBoard REST latency by endpoint class.",
+    ("endpoint", "status"),
+)
+TOKENS_TOTAL = Counter(
+    "chat_tokens_total",
+    "Claude tokens consumed, by direction (in/out) and model.",
+    ("direction", "model"),
+)
+ITERATIONS_PER_REQUEST = Histogram(
+    "chat_iterations_per_request",
+    "Claude tool-loop iterations per chat request.",
+    ("tier",),
+    buckets=(1, 2, 3, 4, 5, 6, 8, 10),
+)
+ROUTE_SECONDS = Histogram(
+    "chat_route_claude_seconds",
+    "Claude call latency by model route.",
+    ("route",),
+)
+ROUTE_COST_USD = Counter(
+    "chat_route_cost_usd_total",
+    "Estimated Claude spend (USD) by model route.",
+    ("route",),
+)
+ROUTE_ESCALATIONS = Counter(
+    "chat_route_escalations_total",
+    "Fast-route escalations to the large model, by reason.",
+    ("source", "reason"),
+)
+FAST_PATH_TOTAL = Counter(
+    "chat_fast_path_total",
+    "Fast-path decisions by intent and outcome (taken/below_threshold/fallback).",
+    ("intent", "outcome"),
+)
+PREFETCH_TOTAL = Counter(
+    "chat_prefetch_total",
+    "Speculative prefetches by tool and outcome (hit/wasted/cancelled/expired/invalidated).",
+    ("tool", "outcome"),
+)
+TOOL_SCHEMA_TOKENS = Counter(
+    "chat_tool_schema_tokens_total",
+    "Estimated tool-schema tokens per chat request: sent vs saved by pruning.",
+    ("kind",),
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "chat_admission_in_flight",
+    "Chat requests currently holding an admission slot.",
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "chat_admission_queue_depth",
+    "Chat requests waiting for an admission slot.",
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "chat_admission_wait_seconds",
+    "Time spent queued before admission, by priority.",
+    ("priority",),
+)
+ADMISSION_REJECTED = Counter(
+    "chat_admission_rejected_total",
+    "Requests shed with 503, by reason (queue_full/queue_timeout/jobs_full) and priority.",
+    ("reason", "priority"),
+)
+JOBS_TOTAL = Counter(
+    "chat_jobs_total",
+    "Background chat jobs by outcome (submitted/rejected/done/failed).",
+    ("outcome",),
+)
+JOBS_ACTIVE = Gauge(
+    "chat_jobs_active",
+    "Background chat jobs currently running.",
+)
+HEALTH_PROBE_SECONDS = Histogram(
+    "health_probe_seconds",
+    "Background health-probe latency by target (thingsboard/anthropic).",
+    ("target",),
+)
+HEALTH_UP = Gauge(
+    "health_up",
+    "1 if the target's last health probes succeeded, else 0.",
+    ("target",),
+)
+DISPATCH_TOTAL = Counter(
+    "chat_command_dispatch_total",
+    "Device command writes by command and outcome (sent/failed/timed_out/skipped).",
+    ("command", "outcome"),
+)
+MULTICAST_TOTAL = Counter(
+    "chat_multicast_dispatch_total",
+    "Site-wide dims by route outcome (multicast/failed/unicast_fallback).",
+    ("outcome",),
+)
@@ -49,6 +49,7 @@ class ChatMetadata(BaseModel):
     tools_used: list[str] = Field(default_factory=list)
     entity_references: list[EntityReference] = Field(default_factory=list)
     suggestions: list[str] = Field(default_factory=list)
+    job_id: str | None = None  # set when the request continues as a background job
 
 
 class ChatResponse(BaseModel):
@@ -0,0 +1,210 @@
+"""Class C multicast dispatch of site-wide dim commands.
+
+A site-wide dim writes ``dimLevel`` to every device, and the bridge turns
+each write into a unicast downlink — hundreds for a large site. When every
+device at a site is a Class C controller, one multicast downlink to the
+site's group does the same job.
+
+The contract with the bridge and The Things Stack (TTS):
+
+- **Membership** — the site asset's ``multicast_group`` server attribute,
+  ``{"group_id", "members", "updated_at"}``. ``MulticastGroups.sync`` keeps
+  it to the site's devices whose ``supports_class_c`` server attribute is
+  true (saved by the register-service) when a site dim is confirmed;
+  previews only read it. The bridge reads it to set up the members'
+  multicast sessions.
+- **Readiness** — the TTS end device ``group_id`` in ``TTS_APP_ID`` with
+  ``multicast`` and ``supports_class_c`` set, read from the Network Server
+  registry and cached for ``MULTICAST_READY_TTL`` seconds.
+- **Command** — the site asset's ``multicast_command`` shared attribute,
+  ``{"command": "dim", "group_id", "dim_value", "members", "request_id"}``.
+  The bridge encodes it like a unicast ``dimLevel`` write and schedules it
+  on the group's end device.
+
+A multicast leaves the members' ``dimLevel`` attributes behind, so
+``effective_values`` reads a member's level as the multicast value whenever
+the command is newer than its last ``dimLevel`` write.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+
+import httpx
+
+import config
+from tb_client import TBClient
+
+logger = logging.getLogger(__name__)
+
+GROUP_ATTR = "multicast_group"      # site asset, SERVER_SCOPE
+COMMAND_ATTR = "multicast_command"  # site asset, SHARED_SCOPE — read by the bridge
+CLASS_C_ATTR = "supports_class_c"   # device, SERVER_SCOPE
+
+
+def group_id_for(site_id: str) -> str:
+    """TTS end-device ID of a site's group (lowercase, at most 36 chars)."""
+    return "mc-" + site_id.replace("-", "").lower()[:24]
+
+
+def _load(raw: object) -> dict:
+    try:
+        data = json.loads(raw) if isinstance(raw, str) else raw
+    except (json.JSONDecodeError, TypeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _truthy(value: object) -> bool:
+    return value is True or str(value).lower() == "true"
+
+
+@dataclass
+class MulticastGroup:
+    """A site's multicast group and whether a dim can go through it."""
+
+    site_id: str
+    group_id: str
+    members: list[str] = field(default_factory=list)
+    ready: bool = False
+    reason: str = ""  # why not, when not ready
+
+
+def effective_values(
+    current: dict[str, tuple[object, int]], command: dict, command_ts: int
+) -> dict[str, object]:
+    """``dimLevel`` per device, taking the last multicast where it is newer.
+
+    *current* maps device ID → ``(dimLevel, ts)``; *command* is the last
+    ``multicast_command`` and *command_ts* its ``lastUpdateTs``.
+    """
+    members = set(command.get("members", ()))
+    values: dict[str, object] = {}
+    for dev_id in members | current.keys():
+        value, ts = current.get(dev_id, (None, 0))
+        if dev_id in members and command_ts > ts:
+            value = command.get("dim_value")
+        if value is not None:
+            values[dev_id] = value
+    return values
+
+
+class MulticastGroups:
+    """Per-site group membership, TTS readiness and multicast sends."""
+
+    def __init__(self) -> None:
+        self._ready: dict[str, tuple[bool, float]] = {}  # group_id → (ready, checked)
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return config.MULTICAST_ENABLED and bool(
+            config.TTS_BASE_URL and config.TTS_APP_ID and config.TTS_API_KEY
+        )
+
+    async def sync(
+        self, site_id: str, devices: list[dict], tb: TBClient, persist: bool = True,
+    ) -> MulticastGroup:
+        """Work out the site's membership, store it and check readiness.
+
+        The group is ready only if every device at the site is a member, the
+        stored membership already matched and the group exists in TTS. Without *persist* (a command preview) the
+        membership record is only read, never written.
+        """
+        ids = [d["id"] for d in devices]
+        flags = await tb.get_latest_values_bulk(ids, [CLASS_C_ATTR], "SERVER_ATTRIBUTE")
+        members = sorted(d for d in ids if _truthy(flags.get(d, {}).get(CLASS_C_ATTR)))
+
+        stored = await tb.get_attributes("ASSET", site_id, "SERVER_SCOPE", [GROUP_ATTR])
+        record = _load(stored.get(GROUP_ATTR))
+        group = MulticastGroup(site_id, record.get("group_id") or group_id_for(site_id), members)
+        stale = (
+            record.get("group_id") != group.group_id
+            or sorted(record.get("members", [])) != members
+        )
+        if stale and persist:
+            await tb.save_attributes("ASSET", site_id, "SERVER_SCOPE", {
+                GROUP_ATTR: json.dumps({
+                    "group_id": group.group_id,
+                    "members": members,
+                    "updated_at": int(time.time() * 1000),
+                }),
+            })
+            logger.info(
+                "MULTICAST_GROUP_SYNC site=%s group=%s members=%d of %d",
+                site_id, group.group_id, len(members), len(ids),
+            )
+
+        if len(members) < len(ids):
+            group.reason = f"{len(ids) - len(members)} device(s) do not support Class C"
+        elif stale:
+            # The bridge has not seen the new record yet; unicast this time
+            group.reason = "membership just updated"
+        elif not await self._is_ready(group.group_id):
+            group.reason = f"group {group.group_id} is not provisioned in TTS"
+        else:
+            group.ready = True
+        return group
+
+    async def send_dim(self, group: MulticastGroup, dim_value: int, tb: TBClient) -> str:
+        """Write the multicast dim command for the bridge; return its request ID."""
+        request_id = uuid.uuid4().hex
+        command = {
+            "command": "dim",
+            "group_id": group.group_id,
+            "dim_value": dim_value,
+            "members": group.members,
+            "request_id": request_id,
+        }
+        await tb.save_attributes(
+            "ASSET", group.site_id, "SHARED_SCOPE", {COMMAND_ATTR: json.dumps(command)}
+        )
+        return request_id
+
+    async def last_command(self, site_id: str, tb: TBClient) -> tuple[dict, int] | None:
+        """The site's last multicast command and its ``lastUpdateTs``, if any."""
+        attrs = await tb.get_attributes_with_ts("ASSET", site_id, "SHARED_SCOPE", [COMMAND_ATTR])
+        if COMMAND_ATTR not in attrs:
+            return None
+        raw, ts = attrs[COMMAND_ATTR]
+        command = _load(raw)
+        return (command, ts) if command.get("command") == "dim" else None
+
+    async def _is_ready(self, group_id: str) -> bool:
+        cached = self._ready.get(group_id)
+        if cached is not None and time.monotonic() - cached[1] < config.MULTICAST_READY_TTL:
+            return cached[0]
+        try:
+            resp = await self._tts().get(
+                f"/api/v3/ns/applications/{config.TTS_APP_ID}/devices/{group_id}",
+                params={"field_mask": "multicast,supports_class_c"},
+            )
+        except httpx.HTTPError as exc:
+            # Not cached: the next command asks again
+            logger.warning("TTS readiness check for %s failed: %s", group_id, exc)
+            return False
+        body = resp.json() if resp.status_code == 200 else {}
+        ready = bool(body.get("multicast") and body.get("supports_class_c"))
+        self._ready[group_id] = (ready, time.monotonic())
+        return ready
+
+    def _tts(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=config.TTS_BASE_URL,
+                headers={"Authorization": f"Bearer {config.TTS_API_KEY}"},
+                timeout=10.0,
+            )
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+multicast_groups = MulticastGroups()
@@ -0,0 +1,315 @@
+"""Duty-cycle-aware pacing of LoRaWAN downlinks.
+
+Every command write becomes a downlink from the site's gateway, and EU868
+limits each gateway's transmit time to a duty cycle (``PACING_DUTY_CYCLE``,
+default 10% for the RX2 sub-band). Sending a schedule to 300 controllers
+at once makes the gateway drop or delay most of them.
+
+``DownlinkPacer`` keeps one airtime budget per site: a token bucket of
+``PACING_BURST_S`` seconds of airtime, refilled at the duty cycle. Writes
+wait in a per-site priority queue (dim before schedule before location)
+and are released only when the budget covers their estimated airtime.
+Each dispatched command is a ``PacedBatch`` whose progress and ETA can be
+queried while it drains.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+import config
+from metrics import DISPATCH_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# Estimated airtime per downlink (seconds), EU868 SF9/125 kHz with MAC overhead
+AIRTIME_S: dict[str, float] = {
+    "dim": 0.12,        # dimLevel — a few bytes
+    "schedule": 0.40,   # send_task — multi-slot payload
+    "location": 0.20,   # location_setup
+}
+
+# Lower is sent first
+PRIORITY: dict[str, int] = {"dim": 0, "schedule": 1, "location": 2}
+
+# Dispatch command → downlink kind
+COMMAND_KIND: dict[str, str] = {
+    "DIM_COMMAND": "dim",
+    "TASK_SCHEDULE": "schedule",
+    "DELETE_SCHEDULE": "schedule",
+    "LOCATION_SETUP": "location",
+}
+
+BATCH_TTL = 3600  # keep finished batches queryable for an hour
+
+
+# ---------------------------------------------------------------------------
+# Airtime budget
+# ---------------------------------------------------------------------------
+
+class AirtimeBudget:
+    """Token bucket of transmit airtime for one site's gateway."""
+
+    def __init__(self, duty_cycle: float, burst: float):
+        self.rate = duty_cycle      # airtime seconds earned per wall second
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, airtime: float) -> float:
+        """Seconds until *airtime* fits in the budget (0 if it fits now)."""
+        self._refill()
+        return max(0.0, (airtime - self.tokens) / self.rate)
+
+    def consume(self, airtime: float) -> None:
+        self._refill()
+        self.tokens -= airtime
+
+
+# ---------------------------------------------------------------------------
+# Batches
+# ---------------------------------------------------------------------------
+
+@dataclass
+class PacedBatch:
+    """One command's writes to the devices of a site."""
+
+    command: str
+    kind: str
+    site: str
+    customer_id: str
+    results: list[dict]
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    created: float = field(default_factory=time.time)
+    finished_at: float | None = None
+    eta_s: float = 0.0
+    _done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def record(self, index: int, status: str, error: str | None = None) -> None:
+        self.results[index]["status"] = status
+        if error:
+            self.results[index]["error"] = error
+        DISPATCH_TOTAL.inc(command=self.command, outcome=status)
+        if all(r["status"] != "queued" for r in self.results):
+            self.finished_at = time.time()
+            self._done.set()
+            counts = self.counts()
+            logger.info(
+                "%s_PACED_DONE customer=%s site=%s batch=%s sent=%d failed=%d timed_out=%d "
+                "duration=%.0fs",
+                self.command, self.customer_id, self.site, self.id, counts.get("sent", 0),
+                counts.get("failed", 0), counts.get("timed_out", 0),
+                self.finished_at - self.created,
+            )
+
+    @property
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait up to *timeout* seconds for every write; True if finished."""
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.finished
+
+    def counts(self) -> dict[str, int]:
+        counts: dict[str, int] = {}
+        for r in self.results:
+            counts[r["status"]] = counts.get(r["status"], 0) + 1
+        return counts
+
+    def progress(self) -> dict:
+        remaining = None
+        if not self.finished:
+            remaining = round(max(0.0, self.created + self.eta_s - time.time()))
+        return {
+            "batch_id": self.id,
+            "command": self.command,
+            "site_id": self.site,
+            "status": "done" if self.finished else "in_progress",
+            "total": len(self.results),
+            **self.counts(),
+            "eta_remaining_s": remaining,
+            "age_s": round(time.time() - self.created),
+        }
+
+
+@dataclass(order=True)
+class _Write:
+    priority: int
+    seq: int
+    batch: PacedBatch = field(compare=False)
+    index: int = field(compare=False)
+    airtime: float = field(compare=False)
+    send: Callable[[], Awaitable[None]] = field(compare=False)
+
+
+# ---------------------------------------------------------------------------
+# Pacer
+# ---------------------------------------------------------------------------
+
+class DownlinkPacer:
+    """Per-site airtime budgets and priority queues for command writes."""
+
+    def __init__(self) -> None:
+        self._budgets: dict[str, AirtimeBudget] = {}
+        self._queues: dict[str, list[_Write]] = {}
+        self._wake: dict[str, asyncio.Event] = {}
+        self._workers: dict[str, asyncio.Task] = {}
+        self._batches: dict[str, PacedBatch] = {}
+        self._seq = itertools.count()
+
+    def _budget(self, site: str) -> AirtimeBudget:
+        budget = self._budgets.get(site)
+        if budget is None:
+            budget = AirtimeBudget(config.PACING_DUTY_CYCLE, config.PACING_BURST_S)
+            self._budgets[site] = budget
+        return budget
+
+    def estimate(self, site: str, command: str, devices: int) -> float:
+        """ETA (seconds) for *devices* writes of *command* queued now.
+
+        Counts the airtime already queued at equal or higher priority.
+        """
+        kind = COMMAND_KIND.get(command, "schedule")
+        ahead = sum(
+            w.airtime for w in self._queues.get(site, ())
+            if w.priority <= PRIORITY[kind]
+        )
+        return self._budget(site).delay_for(ahead + devices * AIRTIME_S[kind])
+
+    def charge(self, site: str, command: str) -> None:
+        """Spend one downlink's airtime sent outside the queue (a multicast)."""
+        self._budget(site).consume(AIRTIME_S[COMMAND_KIND.get(command, "schedule")])
+
+    def submit(
+        self,
+        site: str,
+        command: str,
+        devices: list[dict],
+        send: Callable[[dict], Awaitable[None]],
+        customer_id: str,
+        timeout: float,
+    ) -> PacedBatch:
+        """Queue ``send(device)`` for every device; returns the batch."""
+        self._prune()
+        kind = COMMAND_KIND.get(command, "schedule")
+        batch = PacedBatch(
+            command=command,
+            kind=kind,
+            site=site,
+            customer_id=customer_id,
+            results=[
+                {"device_name": d["name"], "device_id": d["id"], "status": "queued"}
+                for d in devices
+            ],
+        )
+        batch.eta_s = self.estimate(site, command, len(devices))
+        self._batches[batch.id] = batch
+        if not devices:
+            batch._done.set()
+            return batch
+
+        async def write(dev: dict, index: int) -> None:
+            try:
+                await asyncio.wait_for(send(dev), timeout)
+            except asyncio.TimeoutError:
+                batch.record(index, "timed_out", f"no response within {timeout:g}s")
+            except Exception as exc:
+                logger.warning("Paced write to %s failed: %s", dev["id"], exc)
+                batch.record(index, "failed", str(exc) or type(exc).__name__)
+            else:
+                batch.record(index, "sent")
+
+        queue = self._queues.setdefault(site, [])
+        for i, dev in enumerate(devices):
+            heapq.heappush(queue, _Write(
+                PRIORITY[kind], next(self._seq), batch, i, AIRTIME_S[kind],
+                lambda dev=dev, i=i: write(dev, i),
+            ))
+        self._wake.setdefault(site, asyncio.Event()).set()
+        worker = self._workers.get(site)
+        if worker is None or worker.done():
+            self._workers[site] = asyncio.create_task(self._drain(site))
+        if batch.eta_s > 0:
+            logger.info(
+                "Pacing %s to %d device(s) at site %s — ETA %.0fs",
+                command, len(devices), site, batch.eta_s,
+            )
+        return batch
+
+    async def _drain(self, site: str) -> None:
+        """Release the site's queued writes as its airtime budget allows."""
+        queue = self._queues[site]
+        budget = self._budget(site)
+        wake = self._wake[site]
+        in_flight: set[asyncio.Task] = set()
+        while queue or in_flight:
+            if not queue:
+                # submit() sees this worker as live and won't start another,
+                # so writes queued while the last ones finish are ours to send
+                await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            delay = budget.delay_for(queue[0].airtime)
+            if delay > 0:
+                # A higher-priority write may arrive while we wait
+                wake.clear()
+                try:
+                    await asyncio.wait_for(wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if len(in_flight) >= config.DISPATCH_CONCURRENCY:
+                await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            item = heapq.heappop(queue)
+            budget.consume(item.airtime)
+            task = asyncio.create_task(item.send())
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+    def get(self, batch_id: str) -> PacedBatch | None:
+        return self._batches.get(batch_id)
+
+    def batches(self, customer_id: str) -> list[PacedBatch]:
+        """The customer's batches, newest first."""
+        self._prune()
+        return sorted(
+            (b for b in self._batches.values() if b.customer_id == customer_id),
+            key=lambda b: b.created, reverse=True,
+        )
+
+    def _prune(self) -> None:
+        cutoff = time.time() - BATCH_TTL
+        for bid in [
+            bid for bid, b in self._batches.items()
+            if b.finished_at is not None and b.finished_at < cutoff
+        ]:
+            del self._batches[bid]
+
+
+def format_eta(seconds: float) -> str:
+    """Human-readable ETA: "under a minute", "~3 min", "~2 h 10 min"."""
+    if seconds < 60:
+        return "under a minute"
+    minutes = round(seconds / 60)
+    if minutes < 60:
+        return f"~{minutes} min"
+    return f"~{minutes // 60} h {minutes % 60} min"
+
+
+pacer = DownlinkPacer()
@@ -0,0 +1,202 @@
+"""Speculative prefetch of context-entity data while Claude plans.
+
+When the widget context names a site or device, the first Claude call
+almost always asks for that entity's summary, alarms or telemetry. A
+``PrefetchMemo`` starts those tool calls concurrently with the first
+``messages.create`` and serves matching tool calls from the memo.
+Unused fetches are cancelled at the end of the request and counted so
+the policy can be tuned (``chat_prefetch_total{tool,outcome}``). A command
+tool run in the same request drops the memo, since the data fetched before
+it may no longer hold ("dim to 40% then show me the site").
+
+``warm`` starts the same calls before any message, when the chat widget
+opens (``POST /api/chat/warmup``). The first request's ``PrefetchMemo``
+adopts them instead of fetching again, for up to ``WARMUP_TTL`` seconds.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+
+import config
+from metrics import PREFETCH_TOTAL
+from models import EntityContext
+from tb_client import TBClient
+from tools import execute_tool
+
+logger = logging.getLogger(__name__)
+
+# Keys prefetched for a device's latest telemetry — the common keys listed in
+# the get_device_telemetry tool description. Requests for a subset are served
+# from the memo.
+DEVICE_LATEST_KEYS = [
+    "power_watts", "energy_wh", "dim_value", "saving_pct", "driver_temperature",
+]
+
+
+def _memo_key(tool_name: str, tool_input: dict) -> str:
+    """Canonical memo key for a tool call, with tool defaults filled in."""
+    inp = dict(tool_input)
+    if tool_name == "get_site_summary":
+        inp.setdefault("time_range", "today")
+    elif tool_name == "get_alarms":
+        inp.setdefault("status", "ACTIVE")
+    elif tool_name == "get_device_telemetry":
+        inp.setdefault("time_range", "latest")
+        inp.pop("keys", None)  # key subsets are resolved in PrefetchMemo.get
+        if inp["time_range"] == "latest":
+            inp.pop("aggregation", None)
+    return f"{tool_name}:{json.dumps(inp, sort_keys=True)}"
+
+
+def prefetch_plan(ctx: EntityContext | None) -> list[tuple[str, dict]]:
+    """Return the (tool_name, tool_input) calls to start for *ctx*."""
+    if not ctx or not ctx.entity_id:
+        return []
+    if ctx.entity_type == "DEVICE":
+        return [
+            ("get_device_telemetry", {
+                "device_id": ctx.entity_id,
+                "keys": DEVICE_LATEST_KEYS,
+                "time_range": "latest",
+            }),
+            ("get_alarms", {
+                "entity_id": ctx.entity_id,
+                "entity_type": "DEVICE",
+                "status": "ACTIVE",
+            }),
+        ]
+    if ctx.entity_type == "ASSET" and (ctx.entity_subtype or "site").lower() == "site":
+        return [
+            ("get_site_summary", {"site_id": ctx.entity_id, "time_range": "today"}),
+            ("get_alarms", {
+                "entity_id": ctx.entity_id,
+                "entity_type": "ASSET",
+                "status": "ACTIVE",
+            }),
+        ]
+    return []
+
+
+# Warmup fetches waiting for their first request: (customer, memo key) → (task, started)
+_warm: dict[tuple[str | None, str], tuple[asyncio.Task, float]] = {}
+
+
+def _prune_warm() -> None:
+    cutoff = time.monotonic() - config.WARMUP_TTL
+    for key in [k for k, (_, started) in _warm.items() if started < cutoff]:
+        task, _ = _warm.pop(key)
+        task.cancel()
+        PREFETCH_TOTAL.inc(tool=key[1].split(":", 1)[0], outcome="expired")
+
+
+def warm(tb: TBClient, ctx: EntityContext | None) -> list[str]:
+    """Start the prefetch plan for *ctx* ahead of its first request.
+
+    Calls already warm are not started again. Returns the tools started.
+    """
+    _prune_warm()
+    customer_id = ctx.customer_id if ctx else None
+    started: list[str] = []
+    for tool_name, tool_input in prefetch_plan(ctx):
+        key = (customer_id, _memo_key(tool_name, tool_input))
+        if key in _warm:
+            continue
+        task = asyncio.create_task(execute_tool(tool_name, tool_input, tb, ctx))
+        _warm[key] = (task, time.monotonic())
+        started.append(tool_name)
+    return started
+
+
+def _take_warm(customer_id: str | None, key: str) -> asyncio.Task | None:
+    """Hand a warm fetch to a request (each is used once)."""
+    _prune_warm()
+    entry = _warm.pop((customer_id, key), None)
+    return entry[0] if entry else None
+
+
+class PrefetchMemo:
+    """Per-request memo of speculatively started tool calls."""
+
+    def __init__(self, tb: TBClient, ctx: EntityContext | None):
+        self._tb = tb
+        self._ctx = ctx
+        self._tasks: dict[str, tuple[str, dict, asyncio.Task]] = {}
+        self._used: set[str] = set()
+        self._dropped: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Kick off every call in the prefetch plan (non-blocking).
+
+        Calls started by ``warm`` for the same customer are adopted.
+        """
+        customer_id = self._ctx.customer_id if self._ctx else None
+        for tool_name, tool_input in prefetch_plan(self._ctx):
+            key = _memo_key(tool_name, tool_input)
+            task = _take_warm(customer_id, key) or asyncio.create_task(
+                execute_tool(tool_name, tool_input, self._tb, self._ctx)
+            )
+            self._tasks[key] = (tool_name, tool_input, task)
+
+    async def get(self, tool_name: str, tool_input: dict) -> dict | None:
+        """Return the prefetched result for a tool call, or None on a miss."""
+        entry = self._tasks.get(_memo_key(tool_name, tool_input))
+        if entry is None:
+            return None
+        _, prefetched_input, task = entry
+
+        if tool_name == "get_device_telemetry":
+            wanted = tool_input.get("keys") or []
+            if not set(wanted) <= set(prefetched_input["keys"]):
+                return None
+
+        result = await task
+        if "error" in result:
+            return None
+        self._used.add(_memo_key(tool_name, tool_input))
+
+        if tool_name == "get_device_telemetry":
+            wanted = tool_input.get("keys") or []
+            result = {
+                **result,
+                "values": {k: v for k, v in result.get("values", {}).items() if k in wanted},
+            }
+        return result
+
+    def invalidate(self) -> None:
+        """Drop every entry after a command tool ran; later calls go to TB."""
+        if not self._tasks:
+            return
+        self._settle(unused="invalidated")
+        self._dropped.extend(task for _, _, task in self._tasks.values())
+        self._tasks.clear()
+        self._used.clear()
+
+    def _settle(self, unused: str) -> None:
+        """Record each entry's outcome, cancelling unused in-flight fetches."""
+        for key, (tool_name, _, task) in self._tasks.items():
+            if key in self._used:
+                outcome = "hit"
+            elif task.done():
+                outcome = "wasted"
+            else:
+                outcome = unused
+                task.cancel()
+            PREFETCH_TOTAL.inc(tool=tool_name, outcome=outcome)
+
+    async def close(self) -> None:
+        """Cancel unused in-flight fetches and record hit / waste metrics."""
+        self._settle(unused="cancelled")
+        pending = [
+            t for t in [*self._dropped, *(t for _, _, t in self._tasks.values())]
+            if not t.done()
+        ]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        if self._tasks:
+            logger.debug(
+                "Prefetch: %d started, %d used", len(self._tasks), len(self._used),
+            )
@@ -0,0 +1,40 @@
+"""Progress events for long-running chats (job mode, streaming).
+
+Code deep in the pipeline calls ``emit(event)``; whoever runs the chat
+installs a sink with ``use_sink`` for the current task. Without a sink
+``emit`` is a no-op, so tools can report partial results unconditionally.
+"""
+
+from __future__ import annotations
+
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+ProgressSink = Callable[[dict], None]
+
+_sink: contextvars.ContextVar[ProgressSink | None] = contextvars.ContextVar(
+    "progress_sink", default=None,
+)
+
+
+def emit(event: dict) -> None:
+    """Publish a progress event to the current sink, if any."""
+    sink = _sink.get()
+    if sink is not None:
+        sink(event)
+
+
+def is_active() -> bool:
+    """Return True if someone is listening for progress events."""
+    return _sink.get() is not None
+
+
+@contextmanager
+def use_sink(sink: ProgressSink) -> Iterator[None]:
+    """Route ``emit`` calls in this context (and tasks it spawns) to *sink*."""
+    token = _sink.set(sink)
+    try:
+        yield
+    finally:
+        _sink.reset(token)
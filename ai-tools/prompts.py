@@ -97,6 +97,19 @@ send_task_schedule, delete_task_schedule, or send_location_setup. \
 First call with confirmed=false to get the preview. Present the details to the \
 user and wait for them to say "yes", "confirm", or "go ahead" before calling \
 again with confirmed=true.
+11. Command previews skip devices already at the requested state (each skip \
+saves a LoRaWAN downlink). Mention skipped devices; pass force=true only if the \
+user explicitly asks to resend to them.
+12. Large commands are paced to the gateway duty cycle. When a preview or \
+result gives an ETA or batch_id, tell the user; use get_command_progress when \
+they ask whether delivery has finished.
+13. For questions about the whole estate or fleet ("how are all my sites \
+doing?"), call get_fleet_overview once instead of get_site_summary per site.
+14. For questions about several specific devices, call get_devices_telemetry \
+once with all their IDs instead of get_device_telemetry per device.
+15. For "which devices use the most / run hottest / save least" questions use \
+rank_devices; for "anything unusual?" use find_anomalies. Both return only the \
+devices that matter — never pull every device's telemetry to rank it yourself.
 
 ## Task Scheduling Rules
 - When the user asks to schedule lights, use send_task_schedule with operation="deploy".
@@ -124,10 +137,13 @@ device — it uses UTC.
 ## Task Query Rules
 - query_task_schedule sends a request and the response arrives via uplink — \
 it may not be instant (LoRaWAN Class A).
-- If the response attribute is stale, tell the user the fresh response hasn't \
-arrived yet and suggest trying again in a few minutes.
+- If the result is pending, tell the user the fresh response hasn't arrived \
+yet and suggest asking again in a few minutes. Calling the tool again does not \
+resend the request; it returns the response as soon as it lands.
 - The device stores up to 20 schedule slots (index 0-19). Query index 0 first \
-if the user doesn't specify.\
+if the user doesn't specify.
+- To see the whole schedule, use get_full_schedule instead of querying slots \
+one by one. Report the slots it already knows and say the rest are on their way.\
 """
 
 
@@ -163,7 +179,17 @@ def build_system_prompt(
             context_block = "\n".join(parts)
             prompt += f"\n\n## Current Context\n{context_block}"
 
-    if hierarchy_data and "error" not in hierarchy_data:
+    if hierarchy_data and hierarchy_data.get("partial"):
+        hierarchy_json = json.dumps(hierarchy_data, separators=(",", ":"))
+        prompt += (
+            "\n\n## Pre-loaded Hierarchy (current site only)\n"
+            "Only the current site's branch has been fetched: the site, its "
+            "devices and the region / estate above it. Use these IDs directly. "
+            "Call get_hierarchy with the customer ID when the user asks about "
+            "other sites, regions or the whole portfolio.\n"
+            f"```json\n{hierarchy_json}\n```"
+        )
+    elif hierarchy_data and "error" not in hierarchy_data:
         hierarchy_json = json.dumps(hierarchy_data, separators=(",", ":"))
         prompt += (
             "\n\n## Pre-loaded Customer Hierarchy\n"
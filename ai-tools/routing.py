@@ -0,0 +1,90 @@
+"""Tier-based model routing — pick a Claude model and token budget per request."""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+
+import config
+from guardrails import MessageTier
+from models import EntityContext
+
+
+@dataclass(frozen=True)
+class Route:
+    """A model + budget choice for one chat request."""
+
+    name: str
+    model: str
+    max_tokens: int
+    max_iterations: int | None = None  # None → config.MAX_TOOL_ITERATIONS
+    escalate_to: str | None = None     # route name to fall back to
+
+
+ROUTES: dict[str, Route] = {
+    "fast": Route(
+        name="fast",
+        model=config.AI_MODEL_FAST,
+        max_tokens=config.AI_MAX_TOKENS_FAST,
+        max_iterations=config.AI_FAST_MAX_ITERATIONS,
+        escalate_to="standard",
+    ),
+    "standard": Route(
+        name="standard",
+        model=config.AI_MODEL,
+        max_tokens=config.AI_MAX_TOKENS,
+    ),
+}
+
+# Phrases that imply multi-step reasoning or cross-entity work
+_COMPLEX_QUERY = re.compile(
+    r"\b(compare|comparison|versus|vs\.?|rank|ranking|top|worst|best|"
+    r"all\s+sites|every|each|across|trend|history|why|explain|analy[sz]e|"
+    r"karşılaştır|tüm|hepsi|neden)\b",
+    re.IGNORECASE,
+)
+
+# Longest DATA_QUERY message still considered a "simple lookup"
+_SIMPLE_QUERY_MAX_LEN = 120
+
+
+def select_route(
+    tier: MessageTier,
+    message: str,
+    context: EntityContext | None = None,
+) -> Route:
+    """Return the route for a classified message.
+
+    GREETING → fast. DATA_QUERY → fast when it is a short, single-entity
+    lookup scoped by the dashboard context; otherwise standard.
+    COMMAND → standard (multi-step confirmation flows).
+    """
+    if not config.AI_ROUTING_ENABLED:
+        return ROUTES["standard"]
+
+    if tier == MessageTier.GREETING:
+        return ROUTES["fast"]
+
+    if tier == MessageTier.DATA_QUERY:
+        scoped = bool(context and context.entity_id)
+        simple = (
+            len(message) <= _SIMPLE_QUERY_MAX_LEN
+            and not _COMPLEX_QUERY.search(message)
+        )
+        if scoped and simple:
+            return ROUTES["fast"]
+
+    return ROUTES["standard"]
+
+
+def escalate(route: Route) -> Route | None:
+    """Return the route to retry with, or None if *route* cannot escalate."""
+    if route.escalate_to is None:
+        return None
+    return ROUTES[route.escalate_to]
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """Return the USD cost of a call, or 0.0 for models without pricing."""
+    price_in, price_out = config.MODEL_PRICING.get(model, (0.0, 0.0))
+    return (input_tokens * price_in + output_tokens * price_out) / 1_000_000
@@ -0,0 +1,359 @@
+"""Pending schedule-slot queries and their uplink responses.
+
+``query_task_schedule`` asks a DALI controller for one schedule slot by
+writing a ``task_request`` command. The answer lands in the
+``task_query_response`` client attribute only when the controller next
+sends an uplink (LoRaWAN Class A), often minutes later.
+
+``TaskQueryRegistry`` sends each query once and starts a watcher that polls
+the attribute with backoff (``TASK_QUERY_POLL_MIN_S`` doubling up to
+``TASK_QUERY_POLL_MAX_S``) until a response newer than the query arrives,
+or ``TASK_QUERY_DEADLINE_S`` passes. Freshness is judged by the attribute's
+``lastUpdateTs`` against its value just before the query was sent, so the
+two hosts' clocks never need to agree. A later call for the same slot
+waits on the pending query instead of sending another downlink, and gets
+the response the moment the watcher sees it. The controller does not
+always echo ``task_index``, so only one query per device is in flight at a
+time: an answer without an index can then only belong to that query.
+
+``ScheduleSnapshots`` reads a controller's whole schedule the same way:
+all 20 slot requests are written back to back, one watcher collects the
+answers as uplinks deliver them, and the assembled table is cached per
+device so ``get_full_schedule`` can return what is known at once. With 20
+requests in flight only answers that name their ``task_index`` can be
+filed; the rest are counted, and slots still unanswered at the deadline
+are requested again by the next call. A snapshot and a
+single-slot query never run on the same device at once.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import config
+from tb_client import TBClient
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_KEY = "task_query_response"
+SLOT_COUNT = 20
+
+
+def parse_response(raw: object) -> dict:
+    """Decode a ``task_query_response`` value (JSON string or object)."""
+    try:
+        data = json.loads(raw) if isinstance(raw, str) else raw
+    except (json.JSONDecodeError, TypeError):
+        return {"raw": raw}
+    return data if isinstance(data, dict) else {"raw": raw}
+
+
+@dataclass
+class PendingQuery:
+    """One ``task_request`` awaiting its uplink response."""
+
+    device_id: str
+    task_index: int
+    baseline_ts: int  # lastUpdateTs of the response attribute before sending
+    sent_at: float = field(default_factory=time.time)
+    response: dict | None = None
+    response_ts: int | None = None
+    expired: bool = False
+    _done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+    _watcher: asyncio.Task | None = field(default=None, repr=False)
+
+    @property
+    def deadline(self) -> float:
+        return self.sent_at + config.TASK_QUERY_DEADLINE_S
+
+    @property
+    def answered(self) -> bool:
+        return self.response is not None
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait up to *timeout* seconds; True once answered or expired."""
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._done.is_set()
+
+    def accept(self, raw: object, ts: int) -> bool:
+        """Take *raw* as the response if it is newer than the query.
+
+        A response naming another slot is not ours. One without
+        ``task_index`` is, as the registry sends one query per device.
+        """
+        if ts <= self.baseline_ts:
+            return False
+        data = parse_response(raw)
+        index = data.get("task_index")
+        if index is not None and index != self.task_index:
+            return False
+        self.response = data
+        self.response_ts = ts
+        self._done.set()
+        return True
+
+
+class TaskQueryRegistry:
+    """Pending slot queries, at most one per device."""
+
+    def __init__(self) -> None:
+        self._pending: dict[str, PendingQuery] = {}  # device ID → query
+
+    async def query(self, tb: TBClient, device_id: str, task_index: int) -> tuple[PendingQuery, bool]:
+        """Return the slot's pending query, sending one if needed.
+
+        The second element is True when a new ``task_request`` downlink was
+        sent by this call. While another slot's query on the device is
+        unanswered, that query is returned and nothing is sent; callers
+        compare its ``task_index``.
+        """
+        self._prune()
+        pending = self._pending.get(device_id)
+        if pending is not None and not pending.expired and (
+            pending.task_index == task_index or not pending.answered
+        ):
+            return pending, False
+
+        current = await tb.get_attributes_with_ts(
+            "DEVICE", device_id, "CLIENT_SCOPE", keys=[RESPONSE_KEY]
+        )
+        baseline_ts = current.get(RESPONSE_KEY, (None, 0))[1]
+        command = {"command": "task_request", "task_index": task_index}
+        await tb.update_shared_attributes(device_id, {"task_command": json.dumps(command)})
+
+        pending = PendingQuery(device_id, task_index, baseline_ts)
+        pending._watcher = asyncio.create_task(self._watch(tb, pending))
+        self._pending[device_id] = pending
+        return pending, True
+
+    def busy(self, device_id: str) -> PendingQuery | None:
+        """The device's query still awaiting its answer, if any."""
+        pending = self._pending.get(device_id)
+        if pending is None or pending.answered or pending.expired:
+            return None
+        return pending
+
+    def consume(self, pending: PendingQuery) -> None:
+        """Forget an answered or expired query once it has been reported."""
+        if self._pending.get(pending.device_id) is pending:
+            del self._pending[pending.device_id]
+
+    async def _watch(self, tb: TBClient, pending: PendingQuery) -> None:
+        """Poll the response attribute with backoff until answered or expired."""
+        interval = config.TASK_QUERY_POLL_MIN_S
+        while time.time() < pending.deadline:
+            await asyncio.sleep(min(interval, max(0.0, pending.deadline - time.time())))
+            try:
+                attrs = await tb.get_attributes_with_ts(
+                    "DEVICE", pending.device_id, "CLIENT_SCOPE", keys=[RESPONSE_KEY]
+                )
+            except Exception as exc:
+                logger.warning(
+                    "Task query poll for %s failed: %s", pending.device_id, exc
+                )
+            else:
+                if RESPONSE_KEY in attrs and pending.accept(*attrs[RESPONSE_KEY]):
+                    logger.info(
+                        "TASK_QUERY_ANSWERED device=%s slot=%d after=%.0fs",
+                        pending.device_id, pending.task_index,
+                        time.time() - pending.sent_at,
+                    )
+                    return
+            interval = min(interval * 2, config.TASK_QUERY_POLL_MAX_S)
+        pending.expired = True
+        pending._done.set()
+        logger.info(
+            "TASK_QUERY_EXPIRED device=%s slot=%d after=%.0fs",
+            pending.device_id, pending.task_index, config.TASK_QUERY_DEADLINE_S,
+        )
+
+    def _prune(self) -> None:
+        # Answered queries nobody asked about again are dropped at the deadline
+        now = time.time()
+        for key in [
+            k for k, p in self._pending.items()
+            if p.expired or (p.answered and p.deadline < now)
+        ]:
+            del self._pending[key]
+
+
+# ---------------------------------------------------------------------------
+# Full-schedule snapshots
+# ---------------------------------------------------------------------------
+
+@dataclass
+class ScheduleSnapshot:
+    """A controller's schedule table, assembled slot by slot."""
+
+    device_id: str
+    slots: dict[int, dict] = field(default_factory=dict)  # index → {"response", "received_ts"}
+    outstanding: deque[int] = field(default_factory=deque)  # in the order requested
+    requested_at: float | None = None
+    last_ts: int = 0  # lastUpdateTs of the last response consumed
+    unattributed: int = 0  # responses without a usable task_index
+    _watcher: asyncio.Task | None = field(default=None, repr=False)
+
+    @property
+    def complete(self) -> bool:
+        return len(self.slots) == SLOT_COUNT
+
+    @property
+    def collecting(self) -> bool:
+        return self._watcher is not None and not self._watcher.done()
+
+    def record(self, index: int, data: dict, ts: int) -> None:
+        self.slots[index] = {"response": data, "received_ts": ts}
+        if index in self.outstanding:
+            self.outstanding.remove(index)
+
+    def take(self, raw: object, ts: int) -> int | None:
+        """File a new response under its slot; return the slot index.
+
+        Only a response naming its ``task_index`` can be filed: with many
+        requests in flight and one polled attribute, a missed or foreign
+        answer would shift every guess after it. Others return None.
+        """
+        self.last_ts = max(self.last_ts, ts)
+        data = parse_response(raw)
+        index = data.get("task_index")
+        if not isinstance(index, int) or not 0 <= index < SLOT_COUNT:
+            self.unattributed += 1
+            return None
+        self.record(index, data, ts)
+        return index
+
+    def table(self) -> dict:
+        """Known slots plus what is still outstanding."""
+        return {
+            "device_id": self.device_id,
+            "complete": self.complete,
+            "slots_known": len(self.slots),
+            "slots": [
+                {"task_index": i, **self.slots[i]} for i in sorted(self.slots)
+            ],
+            "outstanding": sorted(self.outstanding),
+            "unattributed_responses": self.unattributed,
+            "requested_age_s": (
+                round(time.time() - self.requested_at) if self.requested_at else None
+            ),
+        }
+
+
+class ScheduleSnapshots:
+    """Per-device schedule tables and the watchers that fill them."""
+
+    def __init__(self) -> None:
+        self._snapshots: dict[str, ScheduleSnapshot] = {}
+
+    def get(self, device_id: str) -> ScheduleSnapshot | None:
+        snap = self._snapshots.get(device_id)
+        if snap is not None and not snap.collecting and snap.requested_at is not None:
+            if time.time() - snap.requested_at > config.SCHEDULE_SNAPSHOT_TTL:
+                del self._snapshots[device_id]
+                return None
+        return snap
+
+    async def request(self, tb: TBClient, device_id: str, refresh: bool = False) -> tuple[ScheduleSnapshot, int]:
+        """Request every slot not yet known or in flight; return (snapshot, sent).
+
+        With *refresh*, cached slots are dropped and all 20 are requested
+        again. Requests the device never answered before the deadline are
+        re-sent. Callers make sure no single-slot query is pending on the
+        device (``TaskQueryRegistry.busy``).
+        """
+        snap = self.get(device_id)
+        if snap is None or refresh:
+            if snap is not None and snap._watcher is not None:
+                snap._watcher.cancel()
+            snap = ScheduleSnapshot(device_id)
+            self._snapshots[device_id] = snap
+        if not snap.collecting:
+            snap.outstanding.clear()
+
+        missing = [
+            i for i in range(SLOT_COUNT)
+            if i not in snap.slots and i not in snap.outstanding
+        ]
+        if not missing:
+            return snap, 0
+
+        if not snap.collecting:
+            current = await tb.get_attributes_with_ts(
+                "DEVICE", device_id, "CLIENT_SCOPE", keys=[RESPONSE_KEY]
+            )
+            snap.last_ts = max(snap.last_ts, current.get(RESPONSE_KEY, (None, 0))[1])
+        # Written in order: each write is one queued downlink
+        for index in missing:
+            command = {"command": "task_request", "task_index": index}
+            await tb.update_shared_attributes(
+                device_id, {"task_command": json.dumps(command)}
+            )
+            snap.outstanding.append(index)
+        snap.requested_at = time.time()
+        if not snap.collecting:
+            snap._watcher = asyncio.create_task(self._watch(tb, snap))
+        logger.info(
+            "SCHEDULE_SNAPSHOT_REQUESTED device=%s slots=%d", device_id, len(missing)
+        )
+        return snap, len(missing)
+
+    def record(self, device_id: str, index: int, data: dict, ts: int) -> None:
+        """Add a slot answered through ``query_task_schedule`` to the cache."""
+        snap = self._snapshots.get(device_id)
+        if snap is not None:
+            snap.record(index, data, ts)
+
+    def invalidate(self, device_id: str) -> None:
+        """Drop a device's table after a schedule write changed it."""
+        snap = self._snapshots.pop(device_id, None)
+        if snap is not None and snap._watcher is not None:
+            snap._watcher.cancel()
+
+    async def _watch(self, tb: TBClient, snap: ScheduleSnapshot) -> None:
+        """Poll the response attribute, filing each new answer under its slot."""
+        interval = config.TASK_QUERY_POLL_MIN_S
+        while snap.outstanding:
+            deadline = (snap.requested_at or 0) + config.SCHEDULE_SNAPSHOT_DEADLINE_S
+            if time.time() >= deadline:
+                logger.info(
+                    "SCHEDULE_SNAPSHOT_EXPIRED device=%s outstanding=%d",
+                    snap.device_id, len(snap.outstanding),
+                )
+                return
+            await asyncio.sleep(interval)
+            try:
+                attrs = await tb.get_attributes_with_ts(
+                    "DEVICE", snap.device_id, "CLIENT_SCOPE", keys=[RESPONSE_KEY]
+                )
+            except Exception as exc:
+                logger.warning(
+                    "Schedule snapshot poll for %s failed: %s", snap.device_id, exc
+                )
+                interval = min(interval * 2, config.TASK_QUERY_POLL_MAX_S)
+                continue
+            raw, ts = attrs.get(RESPONSE_KEY, (None, 0))
+            if ts > snap.last_ts:
+                if snap.take(raw, ts) is None:
+                    logger.warning(
+                        "Schedule snapshot for %s: response without task_index ignored",
+                        snap.device_id,
+                    )
+                # The next answer rides the next uplink; poll quickly again
+                interval = config.TASK_QUERY_POLL_MIN_S
+            else:
+                interval = min(interval * 2, config.TASK_QUERY_POLL_MAX_S)
+        logger.info(
+            "SCHEDULE_SNAPSHOT_COMPLETE device=%s slots=%d", snap.device_id, len(snap.slots)
+        )
+
+
+task_queries = TaskQueryRegistry()
+schedule_snapshots = ScheduleSnapshots()
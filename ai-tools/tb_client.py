@@ -2,19 +2,48 @@
 
 from __future__ import annotations
 
+import asyncio
 import logging
+import time
 
 import httpx
 
-from config import TB_URL, TB_USERNAME, TB_PASSWORD
+from config import TB_MAX_CONCURRENCY, TB_URL, TB_USERNAME, TB_PASSWORD
+from metrics import TB_REQUEST_SECONDS
 
 logger = logging.getLogger(__name__)
 
 
+def endpoint_class(path: str) -> str:
+    """Map a TB REST path to a coarse endpoint class for metrics labels."""
+    if path.startswith("/api/auth"):
+        return "auth"
+    if "/values/timeseries" in path:
+        return "timeseries"
+    if "/values/attributes" in path or "/attributes/" in path:
+        return "attributes"
+    if path.startswith("/api/relations"):
+        return "relations"
+    if path.startswith("/api/alarm"):
+        return "alarms"
+    if path.startswith("/api/rpc"):
+        return "rpc"
+    if path.startswith("/api/entitiesQuery"):
+        return "entities_query"
+    if path.startswith("/api/customer/") and path.endswith("/assets"):
+        return "customer_assets"
+    for prefix in ("device", "asset", "customer"):
+        if path.startswith(f"/api/{prefix}"):
+            return prefix
+    return "other"
+
+
 class TBClient:
     """Async wrapper around the ThingsBoard REST API.
 
-    Handles JWT authentication with automatic refresh on 401.
+    Handles JWT authentication with automatic refresh on 401. At most
+    ``TB_MAX_CONCURRENCY`` requests are in flight at once across every
+    tool call and job sharing the client.
     """
 
     def __init__(
@@ -29,6 +58,10 @@ class TBClient:
         self.token: str | None = None
         self.refresh_token: str | None = None
         self.client = httpx.AsyncClient(timeout=30.0)
+        self._slots = asyncio.Semaphore(TB_MAX_CONCURRENCY)
+        # Cleared on the first 404/405/501 from POST /api/relations/info (old TB);
+        # a 400 only makes that one call fall back
+        self.relations_query_supported = True
 
     # -- lifecycle ----------------------------------------------------------
 
@@ -62,19 +95,30 @@ class TBClient:
             await self.authenticate()
 
         url = f"{self.base_url}{path}"
-        resp = await self.client.request(
-            method, url, headers=self._auth_headers(), **kwargs
-        )
-
-        if resp.status_code == 401:
-            logger.info("JWT expired — re-authenticating")
-            await self.authenticate()
-            resp = await self.client.request(
-                method, url, headers=self._auth_headers(), **kwargs
-            )
-
-        resp.raise_for_status()
-        return resp
+        async with self._slots:
+            start = time.perf_counter()
+            status = "error"
+            try:
+                resp = await self.client.request(
+                    method, url, headers=self._auth_headers(), **kwargs
+                )
+
+                if resp.status_code == 401:
+                    logger.info("JWT expired — re-authenticating")
+                    await self.authenticate()
+                    resp = await self.client.request(
+                        method, url, headers=self._auth_headers(), **kwargs
+                    )
+
+                status = str(resp.status_code)
+                resp.raise_for_status()
+                return resp
+            finally:
+                TB_REQUEST_SECONDS.observe(
+                    time.perf_counter() - start,
+                    endpoint=endpoint_class(path),
+                    status=status,
+                )
 
     # -- entity lookups -----------------------------------------------------
 
@@ -87,6 +131,21 @@ class TBClient:
     async def get_customer(self, customer_id: str) -> dict:
         return (await self._request("GET", f"/api/customer/{customer_id}")).json()
 
+    async def get_devices_by_ids(
+        self, device_ids: list[str], batch_size: int = 100
+    ) -> list[dict]:
+        """Bulk device lookup via ``GET /api/devices?deviceIds=…``.
+
+        IDs are sent in batches of *batch_size* to keep the URL short.
+        """
+        devices: list[dict] = []
+        for i in range(0, len(device_ids), batch_size):
+            params = {"deviceIds": ",".join(device_ids[i:i + batch_size])}
+            devices.extend(
+                (await self._request("GET", "/api/devices", params=params)).json()
+            )
+        return devices
+
     # -- relations ----------------------------------------------------------
 
     async def get_entity_relations(
@@ -101,6 +160,45 @@ class TBClient:
         }
         return (await self._request("GET", "/api/relations", params=params)).json()
 
+    async def get_parent_relations(
+        self, entity_id: str, entity_type: str
+    ) -> list[dict]:
+        """Return 'Contains' relations to the given entity (its parents)."""
+        params = {
+            "toId": entity_id,
+            "toType": entity_type,
+            "relationType": "Contains",
+            "relationTypeGroup": "COMMON",
+        }
+        return (await self._request("GET", "/api/relations", params=params)).json()
+
+    async def find_relations_info(
+        self, root_id: str, root_type: str, max_level: int, direction: str = "FROM"
+    ) -> list[dict]:
+        """Return every 'Contains' relation up to *max_level* below an entity.
+
+        One ``POST /api/relations/info`` (EntityRelationsQuery) replaces a
+        ``GET /api/relations`` per node. Each entry also carries ``toName``.
+        With ``direction="TO"`` the relations above the entity (its
+        ancestors) are returned instead, each with ``fromName``.
+        """
+        query = {
+            "parameters": {
+                "rootId": root_id,
+                "rootType": root_type,
+                "direction": direction,
+                "relationTypeGroup": "COMMON",
+                "maxLevel": max_level,
+                "fetchLastLevelOnly": False,
+            },
+            "filters": [
+                {"relationType": "Contains", "entityTypes": ["ASSET", "DEVICE"]},
+            ],
+        }
+        return (
+            await self._request("POST", "/api/relations/info", json=query)
+        ).json()
+
     async def get_customer_assets(
         self, customer_id: str, asset_type: str | None = None
     ) -> list[dict]:
@@ -215,6 +313,77 @@ class TBClient:
         resp = await self._request("GET", path, params=params)
         return {item["key"]: item["value"] for item in resp.json()}
 
+    async def get_attributes_with_ts(
+        self,
+        entity_type: str,
+        entity_id: str,
+        scope: str = "SERVER_SCOPE",
+        keys: list[str] | None = None,
+    ) -> dict[str, tuple[object, int]]:
+        """Return attributes as a {key: (value, lastUpdateTs)} dict."""
+        path = (
+            f"/api/plugins/telemetry/{entity_type}/{entity_id}"
+            f"/values/attributes/{scope}"
+        )
+        params = {}
+        if keys:
+            params["keys"] = ",".join(keys)
+        resp = await self._request("GET", path, params=params)
+        return {
+            item["key"]: (item["value"], item.get("lastUpdateTs", 0))
+            for item in resp.json()
+        }
+
+    async def get_shared_attributes_bulk(
+        self, device_ids: list[str], keys: list[str], page_size: int = 100
+    ) -> dict[str, dict]:
+        """Shared attributes of many devices via ``POST /api/entitiesQuery/find``.
+
+        One entity data query per page of *page_size* devices. Returns
+        ``{device_id: {key: value}}``; keys a device has never had are omitted.
+        """
+        return await self.get_latest_values_bulk(
+            device_ids, keys, "SHARED_ATTRIBUTE", page_size
+        )
+
+    async def get_latest_values_bulk(
+        self,
+        device_ids: list[str],
+        keys: list[str],
+        value_type: str,
+        page_size: int = 100,
+        with_ts: bool = False,
+    ) -> dict[str, dict]:
+        """Latest values of one type (``SHARED_ATTRIBUTE``, ``SERVER_ATTRIBUTE``,
+        ``TIME_SERIES``...) for many devices, as ``{device_id: {key: value}}``.
+
+        With *with_ts* each value is a ``(value, ts)`` tuple instead.
+        """
+        result: dict[str, dict] = {}
+        query = {
+            "entityFilter": {
+                "type": "entityList",
+                "entityType": "DEVICE",
+                "entityList": device_ids,
+            },
+            "entityFields": [],
+            "latestValues": [{"type": value_type, "key": k} for k in keys],
+            "pageLink": {"pageSize": page_size, "page": 0},
+        }
+        while True:
+            resp = await self._request("POST", "/api/entitiesQuery/find", json=query)
+            body = resp.json()
+            for row in body.get("data", []):
+                latest = row.get("latest", {}).get(value_type, {})
+                result[row["entityId"]["id"]] = {
+                    k: (v["value"], v["ts"]) if with_ts else v["value"]
+                    for k, v in latest.items() if v.get("ts")
+                }
+            if not body.get("hasNext", False):
+                break
+            query["pageLink"]["page"] += 1
+        return result
+
     # -- alarms -------------------------------------------------------------
 
     async def get_alarms(
@@ -281,6 +450,17 @@ class TBClient:
         )
         return {"status": resp.status_code}
 
+    async def save_attributes(
+        self, entity_type: str, entity_id: str, scope: str, attributes: dict
+    ) -> dict:
+        """Save attributes of any entity (e.g. a site asset) in *scope*."""
+        resp = await self._request(
+            "POST",
+            f"/api/plugins/telemetry/{entity_type}/{entity_id}/attributes/{scope}",
+            json=attributes,
+        )
+        return {"status": resp.status_code}
+
     # -- connectivity check -------------------------------------------------
 
     async def check_connectivity(self) -> bool:
@@ -0,0 +1,223 @@
+"""Context-aware tool selection — send Claude only the tools a request needs.
+
+The tier picks the base set (none / read-only / all). The selection is then
+pruned by the dashboard context (entity type, pre-loaded hierarchy,
+dashboard tier) and, for commands, by which command family the
+conversation is about. Descriptions are trimmed to their essentials,
+always keeping the confirmation, scope and default guidance.
+Pruned tools stay reachable through the ``request_more_tools`` meta-tool,
+which re-expands the selection mid-conversation.
+"""
+
+from __future__ import annotations
+
+import copy
+import json
+import re
+
+from guardrails import MessageTier
+from models import EntityContext
+from tools import ALL_TOOLS, READ_ONLY_TOOLS, TOOL_DEFINITIONS
+
+EXPAND_TOOL_NAME = "request_more_tools"
+
+_COMMAND_NAMES = {
+    "send_dim_command", "send_task_schedule", "query_task_schedule",
+    "get_full_schedule", "send_location_setup", "delete_task_schedule",
+}
+
+# Command families, matched against the user message + last assistant turn
+_COMMAND_FAMILIES: list[tuple[re.Pattern, set[str]]] = [
+    (
+        re.compile(
+            r"\b(dim\w*|bright\w*|turn\s+(on|off)|switch\s+(on|off)|"
+            r"kıs\w*|parlaklık\w*)\b",
+            re.IGNORECASE,
+        ),
+        {"send_dim_command"},
+    ),
+    (
+        re.compile(
+            r"\b(schedul\w*|timer|program\w*|sunrise|sunset|slot|profile|"
+            r"timetable|zamanla\w*|takvim\w*)\b",
+            re.IGNORECASE,
+        ),
+        {
+            "send_task_schedule", "delete_task_schedule", "query_task_schedule",
+            "get_full_schedule",
+        },
+    ),
+    (
+        re.compile(
+            r"\b(location|gps|coordinat\w*|latitude|longitude|timezone|konum\w*)\b",
+            re.IGNORECASE,
+        ),
+        {"send_location_setup"},
+    ),
+]
+
+# Property descriptions kept verbatim — they carry usage guidance Claude needs
+_KEEP_FULL_DESCRIPTIONS = {("get_device_telemetry", "aggregation")}
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# Sentences kept whatever their position: the confirmation flow, what a
+# site ID fans out to, defaults, value conventions and key lists
+_ALWAYS_KEEP = re.compile(
+    r"^(Default|Required|Common|Omit|Use\s|Without)|confirm|Two-step|\bALL\b|UUID|"
+    r"'latest'|'forever'|auto-generated|FIRST|re-send|Call again|uplinks?\b|"
+    r"\b(energy_wh|SUM|AVG|MAX)\b",
+)
+
+
+def estimate_tokens(payload) -> int:
+    """Rough token count (~4 chars/token) of a JSON-serialisable payload."""
+    if not payload:
+        return 0
+    return len(json.dumps(payload, ensure_ascii=False)) // 4
+
+
+def _trim_description(text: str) -> str:
+    """Keep the first sentence plus every sentence ``_ALWAYS_KEEP`` matches."""
+    sentences = _SENTENCE_END.split(text.strip())
+    kept = [sentences[0]] + [s for s in sentences[1:] if _ALWAYS_KEEP.search(s)]
+    return " ".join(kept)
+
+
+def _trim_schema(node: dict, tool_name: str, prop: str | None = None) -> None:
+    """Trim property descriptions in a JSON schema in place."""
+    if prop is not None and "description" in node:
+        if (tool_name, prop) not in _KEEP_FULL_DESCRIPTIONS:
+            node["description"] = _trim_description(node["description"])
+    for name, child in node.get("properties", {}).items():
+        _trim_schema(child, tool_name, name)
+    if isinstance(node.get("items"), dict):
+        _trim_schema(node["items"], tool_name, prop)
+
+
+def _trim_tool(tool: dict) -> dict:
+    trimmed = copy.deepcopy(tool)
+    trimmed["description"] = _trim_description(trimmed["description"])
+    _trim_schema(trimmed["input_schema"], trimmed["name"])
+    return trimmed
+
+
+TRIMMED_TOOLS: dict[str, dict] = {t["name"]: _trim_tool(t) for t in TOOL_DEFINITIONS}
+
+
+def _tier_tools(tier: MessageTier) -> list[dict]:
+    """The full, untrimmed tool list the tier used before pruning."""
+    if tier == MessageTier.GREETING:
+        return []
+    if tier == MessageTier.DATA_QUERY:
+        return READ_ONLY_TOOLS
+    return ALL_TOOLS
+
+
+class ToolSelection:
+    """The tool subset offered to Claude for one request."""
+
+    def __init__(
+        self,
+        tier: MessageTier,
+        names: list[str],
+        pruned: list[str],
+        dashboard_tier: str | None = None,
+    ):
+        self.tier = tier
+        self.names = names
+        self.pruned = pruned
+        self.dashboard_tier = dashboard_tier
+        self.expanded: list[str] = []
+
+    @property
+    def tools(self) -> list[dict] | None:
+        """Tool definitions to send, or None when no tools are offered."""
+        if not self.names:
+            return None
+        tools = [self._definition(n) for n in self.names]
+        if self.pruned:
+            tools.append(self._expand_tool())
+        return tools
+
+    def _definition(self, name: str) -> dict:
+        tool = TRIMMED_TOOLS[name]
+        # Standard (DALI2) fixtures have no driver diagnostics
+        if name == "get_device_telemetry" and (self.dashboard_tier or "").lower() == "standard":
+            tool = copy.deepcopy(tool)
+            keys = tool["input_schema"]["properties"]["keys"]
+            keys["description"] = keys["description"].replace(", driver_temperature", "")
+        return tool
+
+    def _expand_tool(self) -> dict:
+        return {
+            "name": EXPAND_TOOL_NAME,
+            "description": (
+                "Request tools not in your current list. Available: "
+                + ", ".join(self.pruned) + "."
+            ),
+            "input_schema": {
+                "type": "object",
+                "properties": {
+                    "tool_names": {
+                        "type": "array",
+                        "items": {"type": "string", "enum": list(self.pruned)},
+                    },
+                },
+                "required": ["tool_names"],
+            },
+        }
+
+    def expand(self, names: list[str]) -> list[str]:
+        """Add pruned tools back to the selection; return the names added."""
+        added = [n for n in names if n in self.pruned]
+        for name in added:
+            self.pruned.remove(name)
+            self.names.append(name)
+        self.expanded.extend(added)
+        return added
+
+    def schema_tokens(self) -> tuple[int, int]:
+        """Return (tokens sent, tokens the unpruned tier set would cost)."""
+        return estimate_tokens(self.tools), estimate_tokens(_tier_tools(self.tier))
+
+
+def select_tools(
+    tier: MessageTier,
+    context: EntityContext | None = None,
+    hierarchy_loaded: bool = False,
+    hint_text: str = "",
+) -> ToolSelection:
+    """Pick the tool subset for a request.
+
+    - Pre-loaded hierarchy → ``get_hierarchy`` is pruned.
+    - Device dashboard → ``compare_sites`` is pruned.
+    - Commands → only the command family mentioned in *hint_text* (the user
+      message and the assistant turn it replies to); all commands when
+      nothing matches.
+    """
+    names = [t["name"] for t in _tier_tools(tier)]
+    keep = set(names)
+
+    if hierarchy_loaded:
+        keep.discard("get_hierarchy")
+
+    if context and context.entity_type == "DEVICE":
+        keep.discard("compare_sites")
+
+    if tier == MessageTier.COMMAND:
+        wanted: set[str] = set()
+        for pattern, family in _COMMAND_FAMILIES:
+            if pattern.search(hint_text):
+                wanted |= family
+        if wanted:
+            keep -= _COMMAND_NAMES - wanted
+
+    selected = [n for n in names if n in keep]
+    pruned = [n for n in names if n not in keep]
+    return ToolSelection(
+        tier,
+        selected,
+        pruned,
+        dashboard_tier=context.dashboard_tier if context else None,
+    )
@@ -7,10 +7,30 @@ import json
 import logging
 import time
 from datetime import date, datetime
-
-from cache import get_cached_entity, set_cached_entity
+from typing import Callable
+
+import httpx
+import numpy as np
+
+import config
+from cache import (
+    get_cached_entity,
+    get_cached_hierarchy,
+    get_cached_scope,
+    set_cached_entity,
+    set_cached_hierarchy,
+)
 from config import resolve_time_range
+from dispatch import dispatch, dispatch_multicast
+from downsample import reduce_series, summarize
+from fanout import fan_out, gather_all
+from fleet_stats import peer_scores, top_k
+from metrics import MULTICAST_TOTAL, TOOL_SECONDS
 from models import EntityContext
+from multicast import MulticastGroup, effective_values, multicast_groups
+from pacing import format_eta, pacer
+from progress import emit
+from task_query import schedule_snapshots, task_queries
 from tb_client import TBClient
 
 logger = logging.getLogger(__name__)
@@ -112,13 +132,182 @@ TOOL_DEFINITIONS = [
                         "Aggregation type for historical data. "
                         "Use SUM for energy_wh, cost_currency, co2_grams. "
                         "Use AVG for power_watts, saving_pct, dim_value. "
-                        "Use MAX for driver_temperature."
+                        "Use MAX for driver_temperature. "
+                        "NONE returns raw points, downsampled to max_points."
+                    ),
+                },
+                "max_points": {
+                    "type": "integer",
+                    "description": (
+                        "Point budget per key for NONE series (3-1000). "
+                        "Default: 200."
+                    ),
+                },
+                "downsample": {
+                    "type": "string",
+                    "enum": ["lttb", "envelope"],
+                    "description": (
+                        "How to reduce long series: 'lttb' keeps the curve's shape "
+                        "(peaks, dips); 'envelope' returns min/max/avg per bucket "
+                        "for ranges. Default: lttb."
                     ),
                 },
             },
             "required": ["device_id", "keys"],
         },
     },
+    {
+        "name": "get_devices_telemetry",
+        "description": (
+            "Telemetry for several devices in one call, as a device × key "
+            "table. Use instead of repeated get_device_telemetry calls when "
+            "the question covers more than one device."
+        ),
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "device_ids": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Device UUIDs (max 50).",
+                },
+                "keys": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": (
+                        "Telemetry keys to fetch. Common: power_watts, "
+                        "energy_wh, dim_value, saving_pct, driver_temperature"
+                    ),
+                },
+                "time_range": {
+                    "type": "string",
+                    "enum": [
+                        "latest", "today", "yesterday", "this_week",
+                        "this_month", "last_7_days", "last_30_days",
+                    ],
+                    "description": (
+                        "Time range. 'latest' returns most recent values only."
+                    ),
+                },
+                "aggregation": {
+                    "type": "string",
+                    "enum": ["AVG", "SUM", "MIN", "MAX"],
+                    "description": (
+                        "One value per device and key over the range. "
+                        "Use SUM for energy_wh, AVG for power_watts / dim_value, "
+                        "MAX for driver_temperature. Default: SUM."
+                    ),
+                },
+            },
+            "required": ["device_ids", "keys"],
+        },
+    },
+    {
+        "name": "rank_devices",
+        "description": (
+            "Top-K devices by one telemetry key across a site, region, estate "
+            "or the whole customer, computed server-side (e.g. most energy, "
+            "hottest drivers, lowest savings). Returns only the ranked devices."
+        ),
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "entity_id": {
+                    "type": "string",
+                    "description": (
+                        "Site, region or estate asset UUID to rank within. "
+                        "Default: the dashboard entity, else the whole customer."
+                    ),
+                },
+                "key": {
+                    "type": "string",
+                    "description": (
+                        "Telemetry key, e.g. energy_wh, power_watts, "
+                        "driver_temperature, saving_pct"
+                    ),
+                },
+                "time_range": {
+                    "type": "string",
+                    "enum": [
+                        "latest", "today", "yesterday", "this_week",
+                        "this_month", "last_7_days", "last_30_days",
+                    ],
+                    "description": "Time range. Default: latest",
+                },
+                "aggregation": {
+                    "type": "string",
+                    "enum": ["AVG", "SUM", "MIN", "MAX"],
+                    "description": (
+                        "Aggregation over a range. SUM for energy_wh, AVG for "
+                        "power_watts / saving_pct, MAX for driver_temperature. "
+                        "Default: SUM."
+                    ),
+                },
+                "order": {
+                    "type": "string",
+                    "enum": ["top", "bottom"],
+                    "description": "top = highest values first. Default: top",
+                },
+                "k": {
+                    "type": "integer",
+                    "description": "Number of devices to return (max 50). Default: 10.",
+                },
+            },
+            "required": ["key"],
+        },
+    },
+    {
+        "name": "find_anomalies",
+        "description": (
+            "Devices whose power_watts, driver_temperature or saving_pct "
+            "deviate from their site peers (robust z-score from median/MAD, "
+            "or plain z-score), computed server-side. Returns only the "
+            "flagged devices with an explanation."
+        ),
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "entity_id": {
+                    "type": "string",
+                    "description": (
+                        "Site, region or estate asset UUID to scan. "
+                        "Default: the dashboard entity, else the whole customer."
+                    ),
+                },
+                "keys": {
+                    "type": "array",
+                    "items": {
+                        "type": "string",
+                        "enum": ["power_watts", "driver_temperature", "saving_pct"],
+                    },
+                    "description": "Keys to check. Default: all three.",
+                },
+                "method": {
+                    "type": "string",
+                    "enum": ["mad", "zscore"],
+                    "description": "Scoring method. Default: mad.",
+                },
+                "threshold": {
+                    "type": "number",
+                    "description": "Minimum |score| to flag. Default: 3.5.",
+                },
+                "time_range": {
+                    "type": "string",
+                    "enum": [
+                        "latest", "today", "yesterday", "this_week",
+                        "this_month", "last_7_days", "last_30_days",
+                    ],
+                    "description": (
+                        "latest values, or the AVG over a range. Default: latest"
+                    ),
+                },
+                "k": {
+                    "type": "integer",
+                    "description": "Maximum devices to return (max 50). Default: 10.",
+                },
+            },
+        },
+    },
     {
         "name": "get_energy_savings",
         "description": (
@@ -228,6 +417,13 @@ TOOL_DEFINITIONS = [
                         "confirmed the command. Default: false."
                     ),
                 },
+                "force": {
+                    "type": "boolean",
+                    "description": (
+                        "Resend to devices already at the requested state. "
+                        "Default: false."
+                    ),
+                },
             },
             "required": ["device_id", "dim_value"],
         },
@@ -337,6 +533,13 @@ TOOL_DEFINITIONS = [
                         "true=execute. Default: false."
                     ),
                 },
+                "force": {
+                    "type": "boolean",
+                    "description": (
+                        "Resend to devices already at the requested state. "
+                        "Default: false."
+                    ),
+                },
             },
             "required": ["device_id", "operation", "time_slots"],
         },
@@ -345,7 +548,8 @@ TOOL_DEFINITIONS = [
         "name": "query_task_schedule",
         "description": (
             "Query the schedule at a specific index (0-19) on a controller. "
-            "Response arrives via uplink (may take minutes)."
+            "Response arrives via uplink (may take minutes); repeat calls "
+            "wait on the pending query without re-sending it."
         ),
         "input_schema": {
             "type": "object",
@@ -364,6 +568,31 @@ TOOL_DEFINITIONS = [
             "required": ["device_id"],
         },
     },
+    {
+        "name": "get_full_schedule",
+        "description": (
+            "All 20 schedule slots of a controller in one call. Requests every "
+            "slot at once and returns the slots already known immediately; the "
+            "rest arrive over the next uplinks. Call again to see progress."
+        ),
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "device_id": {
+                    "type": "string",
+                    "description": "Device UUID of the controller.",
+                },
+                "refresh": {
+                    "type": "boolean",
+                    "description": (
+                        "Discard the cached table and request every slot again. "
+                        "Default: false."
+                    ),
+                },
+            },
+            "required": ["device_id"],
+        },
+    },
     {
         "name": "send_location_setup",
         "description": (
@@ -407,6 +636,13 @@ TOOL_DEFINITIONS = [
                         "false=preview and confirm, true=execute. Default: false."
                     ),
                 },
+                "force": {
+                    "type": "boolean",
+                    "description": (
+                        "Resend to devices already at the requested state. "
+                        "Default: false."
+                    ),
+                },
             },
             "required": ["device_id", "latitude", "longitude", "timezone"],
         },
@@ -436,6 +672,13 @@ TOOL_DEFINITIONS = [
                         "false=preview and confirm, true=execute. Default: false."
                     ),
                 },
+                "force": {
+                    "type": "boolean",
+                    "description": (
+                        "Resend to devices already at the requested state. "
+                        "Default: false."
+                    ),
+                },
             },
             "required": ["device_id", "profile_id"],
         },
@@ -443,7 +686,8 @@ TOOL_DEFINITIONS = [
     {
         "name": "compare_sites",
         "description": (
-            "Compare energy, cost, and savings across multiple sites in parallel."
+            "Compare site-level totals (energy, cost, CO₂, power, online/offline) "
+            "across multiple sites in one call."
         ),
         "input_schema": {
             "type": "object",
@@ -461,10 +705,81 @@ TOOL_DEFINITIONS = [
                     ],
                     "description": "Time range for comparison",
                 },
+                "metrics": {
+                    "type": "array",
+                    "items": {
+                        "type": "string",
+                        "enum": ["energy", "cost", "co2", "power", "online", "offline"],
+                    },
+                    "description": "Totals to return per site. Default: all.",
+                },
+                "sort_by": {
+                    "type": "string",
+                    "enum": ["energy", "cost", "co2", "power", "online", "offline"],
+                    "description": "Rank sites by this total, highest first.",
+                },
+                "top_k": {
+                    "type": "integer",
+                    "description": "Return only the first top_k sites (after sorting).",
+                },
+                "include_devices": {
+                    "type": "boolean",
+                    "description": "Include per-device rows. Default: false.",
+                },
             },
             "required": ["site_ids"],
         },
     },
+    {
+        "name": "get_fleet_overview",
+        "description": (
+            "Customer-wide overview in one call: per-site and per-region "
+            "online/offline devices, active faults, energy, cost, CO₂ and "
+            "savings, with sites ranked by sort_by."
+        ),
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "time_range": {
+                    "type": "string",
+                    "enum": [
+                        "today", "yesterday", "this_week",
+                        "this_month", "last_7_days", "last_30_days",
+                    ],
+                    "description": "Time range for energy/cost/savings. Default: today",
+                },
+                "sort_by": {
+                    "type": "string",
+                    "enum": ["energy", "cost", "saving_pct", "faults", "offline"],
+                    "description": (
+                        "Site ranking: highest first, except saving_pct which "
+                        "lists the worst savers first. Default: energy."
+                    ),
+                },
+                "limit": {
+                    "type": "integer",
+                    "description": "Number of ranked sites to return. Default: 20.",
+                },
+            },
+        },
+    },
+    {
+        "name": "get_command_progress",
+        "description": (
+            "Delivery progress of paced device commands (dim, schedule, "
+            "location) that were queued for duty-cycle pacing. Without "
+            "batch_id, lists this account's recent command batches."
+        ),
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "batch_id": {
+                    "type": "string",
+                    "description": "Batch ID from a command result (optional)",
+                },
+            },
+        },
+    },
 ]
 
 
@@ -473,9 +788,10 @@ TOOL_DEFINITIONS = [
 # ---------------------------------------------------------------------------
 
 _READ_ONLY_NAMES = {
-    "get_hierarchy", "get_site_summary", "get_device_telemetry",
+    "get_hierarchy", "get_site_summary", "get_device_telemetry", "get_devices_telemetry",
     "get_energy_savings", "get_alarms", "get_device_attributes",
-    "compare_sites",
+    "compare_sites", "get_command_progress", "get_fleet_overview",
+    "rank_devices", "find_anomalies",
 }
 
 READ_ONLY_TOOLS = [t for t in TOOL_DEFINITIONS if t["name"] in _READ_ONLY_NAMES]
@@ -497,34 +813,53 @@ async def execute_tool(
         "get_hierarchy": _get_hierarchy,
         "get_site_summary": _get_site_summary,
         "get_device_telemetry": _get_device_telemetry,
+        "get_devices_telemetry": _get_devices_telemetry,
         "get_energy_savings": _get_energy_savings,
         "get_alarms": _get_alarms,
         "get_device_attributes": _get_device_attributes,
         "send_dim_command": _send_dim_command,
         "send_task_schedule": _send_task_schedule,
         "query_task_schedule": _query_task_schedule,
+        "get_full_schedule": _get_full_schedule,
         "send_location_setup": _send_location_setup,
         "delete_task_schedule": _delete_task_schedule,
         "compare_sites": _compare_sites,
+        "get_command_progress": _get_command_progress,
+        "get_fleet_overview": _get_fleet_overview,
+        "rank_devices": _rank_devices,
+        "find_anomalies": _find_anomalies,
     }
     executor = executors.get(tool_name)
     if executor is None:
         return {"error": f"Unknown tool: {tool_name}"}
 
+    start = time.perf_counter()
     try:
-        return await executor(tool_input, tb, context)
+        result = await executor(tool_input, tb, context)
     except Exception as exc:
         logger.exception("Tool %s failed", tool_name)
+        TOOL_SECONDS.observe(time.perf_counter() - start, tool=tool_name, status="error")
         return {"error": f"Tool {tool_name} failed: {exc}"}
+    status = "error" if isinstance(result, dict) and "error" in result else "ok"
+    TOOL_SECONDS.observe(time.perf_counter() - start, tool=tool_name, status=status)
+    return result
 
 
 # ---------------------------------------------------------------------------
 # Individual tool executors
 # ---------------------------------------------------------------------------
 
+def _cached_as(entity_id: str, entity_type: str) -> dict | None:
+    """Cached entity of *entity_type*; assets and devices share the cache."""
+    cached = get_cached_entity(entity_id)
+    if cached is not None and cached.get("id", {}).get("entityType", entity_type) != entity_type:
+        return None
+    return cached
+
+
 async def _cached_get_device(device_id: str, tb: TBClient) -> dict:
     """Get device with entity cache."""
-    cached = get_cached_entity(device_id)
+    cached = _cached_as(device_id, "DEVICE")
     if cached is not None:
         return cached
     data = await tb.get_device(device_id)
@@ -534,7 +869,7 @@ async def _cached_get_device(device_id: str, tb: TBClient) -> dict:
 
 async def _cached_get_asset(asset_id: str, tb: TBClient) -> dict:
     """Get asset with entity cache."""
-    cached = get_cached_entity(asset_id)
+    cached = _cached_as(asset_id, "ASSET")
     if cached is not None:
         return cached
     data = await tb.get_asset(asset_id)
@@ -542,164 +877,413 @@ async def _cached_get_asset(asset_id: str, tb: TBClient) -> dict:
     return data
 
 
+# Relation depth below each root type (estate → region → site → device)
+_HIERARCHY_DEPTH = {"estate": 3, "region": 2, "site": 1}
+
+# Status codes from TB versions without the relations query or bulk lookup
+_UNSUPPORTED_STATUS = {404, 405, 501}
+
+
+def _unsupported(exc: httpx.HTTPStatusError) -> bool:
+    """True if the endpoint is missing, or TB rejected this one request (400).
+
+    Either way the call falls back to per-entity requests; only a missing
+    endpoint is remembered (see ``_endpoint_missing``).
+    """
+    return exc.response.status_code == 400 or _endpoint_missing(exc)
+
+
+def _endpoint_missing(exc: httpx.HTTPStatusError) -> bool:
+    return exc.response.status_code in _UNSUPPORTED_STATUS
+
+
+async def _relation_tree(
+    root_id: str, max_level: int, tb: TBClient
+) -> dict[str, list[dict]]:
+    """Map every asset below *root_id* to its 'Contains' relations.
+
+    Uses one relations query per root; TB versions without it get a
+    level-by-level walk with one bounded fan-out of ``GET /api/relations``
+    per level.
+    """
+    children: dict[str, list[dict]] = {}
+    if tb.relations_query_supported:
+        try:
+            rels = await tb.find_relations_info(root_id, "ASSET", max_level)
+        except httpx.HTTPStatusError as exc:
+            if not _unsupported(exc):
+                raise
+            if _endpoint_missing(exc):
+                logger.info(
+                    "Relations query unsupported (HTTP %d) — walking relations per node",
+                    exc.response.status_code,
+                )
+                tb.relations_query_supported = False
+            else:
+                logger.warning("Relations query rejected (HTTP 400) — walking relations per node")
+        else:
+            for rel in rels:
+                children.setdefault(rel["from"]["id"], []).append(rel)
+            return children
+
+    frontier = [root_id]
+    for _ in range(max_level):
+        fan = await fan_out(
+            frontier, lambda eid: tb.get_entity_relations(eid, "ASSET")
+        )
+        if fan.errors:
+            raise next(iter(fan.errors.values()))
+        next_frontier: list[str] = []
+        for eid, rels in zip(frontier, fan.results):
+            children[eid] = rels
+            next_frontier.extend(
+                r["to"]["id"] for r in rels if r["to"]["entityType"] == "ASSET"
+            )
+        if not next_frontier:
+            break
+        frontier = next_frontier
+    return children
+
+
+async def _lookup_devices(device_ids: list[str], tb: TBClient) -> dict[str, dict]:
+    """Fetch devices not in the entity cache in bulk and cache them."""
+    found = {d: e for d in device_ids if (e := get_cached_entity(d)) is not None}
+    missing = [d for d in device_ids if d not in found]
+    if not missing:
+        return found
+    try:
+        for dev in await tb.get_devices_by_ids(missing):
+            dev_id = dev["id"]["id"]
+            set_cached_entity(dev_id, dev)
+            found[dev_id] = dev
+    except httpx.HTTPStatusError as exc:
+        if not _unsupported(exc):
+            raise
+        fan = await fan_out(missing, lambda d: _cached_get_device(d, tb))
+        if fan.errors:
+            raise next(iter(fan.errors.values()))
+        found.update(zip(missing, fan.results))
+    return found
+
+
 async def _get_hierarchy(inp: dict, tb: TBClient, ctx: EntityContext | None = None) -> dict:
-    """Walk customer → estate → region → site → device."""
+    """Build customer → estate → region → site → device in a few requests.
+
+    The customer's assets come from one paginated listing, the tree below
+    each root from one relations query and device names/types from a bulk
+    lookup.
+    """
     customer_id = inp["customer_id"]
-    customer = await tb.get_customer(customer_id)
-    all_assets = await tb.get_customer_assets(customer_id)
+    customer, all_assets = await asyncio.gather(
+        tb.get_customer(customer_id), tb.get_customer_assets(customer_id),
+    )
+
+    assets: dict[str, dict] = {}
+    for a in all_assets:
+        assets[a["id"]["id"]] = a
+        set_cached_entity(a["id"]["id"], a)
+
+    def of_type(asset_type: str) -> list[dict]:
+        return [a for a in all_assets if a.get("type", "").lower() == asset_type]
+
+    roots = of_type("estate") or of_type("region") or of_type("site")
+    root_type = roots[0].get("type", "").lower() if roots else ""
+
+    fan = await fan_out(
+        roots,
+        lambda r: _relation_tree(r["id"]["id"], _HIERARCHY_DEPTH[root_type], tb),
+    )
+    if fan.errors:
+        raise next(iter(fan.errors.values()))
+    children: dict[str, list[dict]] = {}
+    for tree in fan.results:
+        children.update(tree)
+
+    # Assets linked into the tree but not assigned to the customer
+    unknown = [
+        rel["to"]["id"]
+        for rels in children.values() for rel in rels
+        if rel["to"]["entityType"] == "ASSET" and rel["to"]["id"] not in assets
+    ]
+    if unknown:
+        extra = await fan_out(unknown, lambda a: _cached_get_asset(a, tb))
+        if extra.errors:
+            raise next(iter(extra.errors.values()))
+        assets.update(zip(unknown, extra.results))
+
+    devices = await _lookup_devices(
+        [
+            rel["to"]["id"]
+            for rels in children.values() for rel in rels
+            if rel["to"]["entityType"] == "DEVICE"
+        ],
+        tb,
+    )
+
+    def child_assets(parent_id: str, asset_type: str) -> list[dict]:
+        return [
+            assets[rel["to"]["id"]]
+            for rel in children.get(parent_id, [])
+            if rel["to"]["entityType"] == "ASSET"
+            and assets[rel["to"]["id"]].get("type", "").lower() == asset_type
+        ]
+
+    def site_node(site: dict) -> dict:
+        site_id = site["id"]["id"]
+        return {
+            "id": site_id,
+            "name": site.get("name", ""),
+            "devices": [
+                {
+                    "id": rel["to"]["id"],
+                    "name": devices.get(rel["to"]["id"], {}).get("name", rel.get("toName", "")),
+                    "type": devices.get(rel["to"]["id"], {}).get("type", ""),
+                }
+                for rel in children.get(site_id, [])
+                if rel["to"]["entityType"] == "DEVICE"
+            ],
+        }
+
+    def region_node(region: dict) -> dict:
+        region_id = region["id"]["id"]
+        return {
+            "id": region_id,
+            "name": region.get("name", ""),
+            "sites": [site_node(s) for s in child_assets(region_id, "site")],
+        }
 
-    estates = [a for a in all_assets if a.get("type", "").lower() == "estate"]
-    regions = [a for a in all_assets if a.get("type", "").lower() == "region"]
-    sites_assets = [a for a in all_assets if a.get("type", "").lower() == "site"]
+    def estate_node(estate: dict) -> dict:
+        estate_id = estate["id"]["id"]
+        return {
+            "id": estate_id,
+            "name": estate.get("name", ""),
+            "regions": [region_node(r) for r in child_assets(estate_id, "region")],
+            "sites": [site_node(s) for s in child_assets(estate_id, "site")],
+        }
 
-    hierarchy: dict = {
+    # No estates — regions (or bare sites) sit at the top level
+    build = {"estate": estate_node, "region": region_node, "site": site_node}.get(root_type)
+    return {
         "customer": customer.get("title", ""),
         "customer_id": customer_id,
-        "estates": [],
+        "estates": [build(r) for r in roots] if build else [],
     }
 
-    async def build_site(site_id: str, site_name: str) -> dict:
-        rels = await tb.get_entity_relations(site_id, "ASSET")
-        devices = []
-        for rel in rels:
-            child = rel["to"]
-            if child["entityType"] == "DEVICE":
-                dev = await _cached_get_device(child["id"], tb)
-                devices.append({
-                    "id": child["id"],
-                    "name": dev.get("name", ""),
-                    "type": dev.get("type", ""),
-                })
-        return {"id": site_id, "name": site_name, "devices": devices}
-
-    async def build_region(region_id: str, region_name: str) -> dict:
-        rels = await tb.get_entity_relations(region_id, "ASSET")
-        site_nodes = []
-        for rel in rels:
-            child = rel["to"]
-            if child["entityType"] == "ASSET":
-                asset = await _cached_get_asset(child["id"], tb)
-                if asset.get("type", "").lower() == "site":
-                    site_nodes.append(await build_site(child["id"], asset["name"]))
-        return {"id": region_id, "name": region_name, "sites": site_nodes}
-
-    if estates:
-        for est in estates:
-            eid = est["id"]["id"]
-            rels = await tb.get_entity_relations(eid, "ASSET")
-            region_nodes: list[dict] = []
-            direct_sites: list[dict] = []
-            for rel in rels:
-                child = rel["to"]
-                if child["entityType"] == "ASSET":
-                    asset = await _cached_get_asset(child["id"], tb)
-                    child_type = asset.get("type", "").lower()
-                    if child_type == "region":
-                        region_nodes.append(
-                            await build_region(child["id"], asset["name"])
-                        )
-                    elif child_type == "site":
-                        direct_sites.append(
-                            await build_site(child["id"], asset["name"])
-                        )
-            hierarchy["estates"].append({
-                "id": eid,
-                "name": est.get("name", ""),
-                "regions": region_nodes,
-                "sites": direct_sites,
-            })
-    elif regions:
-        # No estates — flat region → site
-        for reg in regions:
-            rid = reg["id"]["id"]
-            hierarchy["estates"].append(
-                await build_region(rid, reg.get("name", ""))
-            )
-    elif sites_assets:
-        # Bare sites directly under customer
-        for s in sites_assets:
-            sid = s["id"]["id"]
-            hierarchy["estates"].append(
-                await build_site(sid, s.get("name", ""))
+
+async def _parent_relations(entity_id: str, entity_type: str, tb: TBClient) -> dict[str, dict]:
+    """Map the entity and each asset above it to its parent 'Contains' relation.
+
+    One upward relations query, or one ``GET /api/relations`` per level on
+    TB versions without it.
+    """
+    if tb.relations_query_supported:
+        try:
+            rels = await tb.find_relations_info(
+                entity_id, entity_type, _HIERARCHY_DEPTH["estate"], direction="TO"
             )
+        except httpx.HTTPStatusError as exc:
+            if not _unsupported(exc):
+                raise
+            if _endpoint_missing(exc):
+                logger.info(
+                    "Relations query unsupported (HTTP %d) — walking relations per node",
+                    exc.response.status_code,
+                )
+                tb.relations_query_supported = False
+            else:
+                logger.warning("Relations query rejected (HTTP 400) — walking relations per node")
+        else:
+            return {rel["to"]["id"]: rel for rel in rels}
+
+    parents: dict[str, dict] = {}
+    current, current_type = entity_id, entity_type
+    for _ in range(_HIERARCHY_DEPTH["estate"]):
+        rels = [
+            r for r in await tb.get_parent_relations(current, current_type)
+            if r["from"]["entityType"] == "ASSET"
+        ]
+        if not rels:
+            break
+        parents[current] = rels[0]
+        current, current_type = rels[0]["from"]["id"], "ASSET"
+    return parents
+
+
+async def scoped_hierarchy(customer_id: str, ctx: EntityContext, tb: TBClient) -> dict | None:
+    """The context's branch of the hierarchy: ancestors, its site and devices.
+
+    Same shape as ``get_hierarchy`` with one node per level, marked
+    ``"partial": true``. None when the context is not a site or a device
+    under one, or the branch does not belong to *customer_id*.
+    """
+    if not ctx.entity_id or ctx.entity_type not in ("ASSET", "DEVICE"):
+        return None
+    parents = await _parent_relations(ctx.entity_id, ctx.entity_type, tb)
+    path = [ctx.entity_id] if ctx.entity_type == "ASSET" else []
+    node_id = ctx.entity_id
+    while node_id in parents and len(path) < len(_HIERARCHY_DEPTH):
+        node_id = parents[node_id]["from"]["id"]
+        path.append(node_id)
+
+    fan = await fan_out(path, lambda a: _cached_get_asset(a, tb))
+    if fan.errors:
+        raise next(iter(fan.errors.values()))
+    path_assets = fan.results
+    if not path_assets or path_assets[0].get("type", "").lower() != "site":
+        return None
+    # Same rule as the full tree: the branch hangs off an asset the customer owns
+    if not any(a.get("customerId", {}).get("id") == customer_id for a in path_assets):
+        return None
+
+    site = path_assets[0]
+    site_id = site["id"]["id"]
+    device_ids = await _site_device_ids(site_id, tb)
+    devices = await _lookup_devices(device_ids, tb)
+    node = {
+        "id": site_id,
+        "name": site.get("name", ""),
+        "devices": [
+            {
+                "id": d,
+                "name": devices.get(d, {}).get("name", ""),
+                "type": devices.get(d, {}).get("type", ""),
+            }
+            for d in device_ids
+        ],
+    }
+    child_type = "site"
+    for asset in path_assets[1:]:
+        asset_type = asset.get("type", "").lower()
+        if asset_type == "region":
+            node = {"id": asset["id"]["id"], "name": asset.get("name", ""), "sites": [node]}
+        elif asset_type == "estate":
+            node = {
+                "id": asset["id"]["id"],
+                "name": asset.get("name", ""),
+                "regions": [node] if child_type == "region" else [],
+                "sites": [node] if child_type == "site" else [],
+            }
+        else:
+            break
+        child_type = asset_type
+
+    customer_name = ctx.customer_name or (await tb.get_customer(customer_id)).get("title", "")
+    return {
+        "customer": customer_name,
+        "customer_id": customer_id,
+        "partial": True,
+        "scope_site_id": site_id,
+        "estates": [node],
+    }
 
-    return hierarchy
 
+_SITE_ENERGY_KEYS = ["energy_wh", "co2_grams", "cost_currency"]
+_SITE_POWER_KEYS = ["power_watts", "dim_value"]
 
-async def _get_site_summary(inp: dict, tb: TBClient, ctx: EntityContext | None = None) -> dict:
-    """Aggregate telemetry across all devices at a site."""
-    site_id = inp["site_id"]
-    time_range = inp.get("time_range", "today")
-    start_ts, end_ts = resolve_time_range(time_range)
 
-    site = await _cached_get_asset(site_id, tb)
+async def _site_device_ids(site_id: str, tb: TBClient) -> list[str]:
     rels = await tb.get_entity_relations(site_id, "ASSET")
+    return [rel["to"]["id"] for rel in rels if rel["to"]["entityType"] == "DEVICE"]
+
+
+async def _device_summary(
+    dev_id: str, start_ts: int, end_ts: int, tb: TBClient
+) -> tuple[dict, float, float, float]:
+    """(row, energy Wh, CO₂ g, cost) for one device of a site summary."""
+    # Name, energy sums, latest power and online flag in one round trip
+    dev, hist, latest, attrs = await gather_all(
+        _cached_get_device(dev_id, tb),
+        tb.get_historical_telemetry(
+            "DEVICE", dev_id, _SITE_ENERGY_KEYS, start_ts, end_ts, agg="SUM"
+        ),
+        tb.get_latest_telemetry("DEVICE", dev_id, _SITE_POWER_KEYS),
+        tb.get_attributes("DEVICE", dev_id, "SERVER_SCOPE", ["active"]),
+    )
+    energy = sum(b["value"] for b in hist.get("energy_wh", []))
+    co2 = sum(b["value"] for b in hist.get("co2_grams", []))
+    cost = sum(b["value"] for b in hist.get("cost_currency", []))
+    info = {
+        "id": dev_id,
+        "name": dev.get("name", ""),
+        "power_watts": latest.get("power_watts", 0),
+        "dim_value": latest.get("dim_value", "N/A"),
+        "energy_kwh": wh_to_kwh(energy),
+        "online": attrs.get("active", False),
+    }
+    return info, energy, co2, cost
 
-    device_ids: list[tuple[str, str]] = []  # (id, name)
-    for rel in rels:
-        child = rel["to"]
-        if child["entityType"] == "DEVICE":
-            dev = await _cached_get_device(child["id"], tb)
-            device_ids.append((child["id"], dev.get("name", "")))
-
-    energy_keys = ["energy_wh", "co2_grams", "cost_currency"]
-    power_keys = ["power_watts", "dim_value"]
 
+def _site_totals(
+    site: dict,
+    site_id: str,
+    time_range: str,
+    device_ids: list[str],
+    outcomes: dict[str, tuple | Exception],
+) -> dict:
+    """Site summary from per-device ``_device_summary`` results or errors."""
     total_energy_wh = 0.0
     total_co2_g = 0.0
     total_cost = 0.0
     total_power_w = 0.0
     devices_info: list[dict] = []
     online_count = 0
+    failed_count = 0
 
-    for dev_id, dev_name in device_ids:
-        # Historical energy sums
-        hist = await tb.get_historical_telemetry(
-            "DEVICE", dev_id, energy_keys, start_ts, end_ts, agg="SUM"
-        )
-        energy = sum(b["value"] for b in hist.get("energy_wh", []))
-        co2 = sum(b["value"] for b in hist.get("co2_grams", []))
-        cost = sum(b["value"] for b in hist.get("cost_currency", []))
-
-        # Latest power
-        latest = await tb.get_latest_telemetry("DEVICE", dev_id, power_keys)
-        power = latest.get("power_watts", 0)
-        dim = latest.get("dim_value", "N/A")
-
+    for dev_id in device_ids:
+        outcome = outcomes[dev_id]
+        if isinstance(outcome, Exception):
+            devices_info.append(_failed_device(dev_id, outcome))
+            failed_count += 1
+            continue
+        info, energy, co2, cost = outcome
         total_energy_wh += energy
         total_co2_g += co2
         total_cost += cost
-        if isinstance(power, (int, float)):
-            total_power_w += power
-
-        # Check active attrs for online status
-        attrs = await tb.get_attributes("DEVICE", dev_id, "SERVER_SCOPE", ["active"])
-        is_online = attrs.get("active", False)
-        if is_online:
+        if isinstance(info["power_watts"], (int, float)):
+            total_power_w += info["power_watts"]
+        if info["online"]:
             online_count += 1
+        devices_info.append(info)
 
-        devices_info.append({
-            "id": dev_id,
-            "name": dev_name,
-            "power_watts": power,
-            "dim_value": dim,
-            "energy_kwh": wh_to_kwh(energy),
-            "online": is_online,
-        })
-
-    return {
+    result = {
         "site_name": site.get("name", ""),
         "site_id": site_id,
         "time_range": time_range,
         "device_count": len(device_ids),
         "online_count": online_count,
-        "offline_count": len(device_ids) - online_count,
+        "offline_count": len(device_ids) - online_count - failed_count,
         "total_energy_kwh": wh_to_kwh(total_energy_wh),
         "total_co2_kg": grams_to_kg(total_co2_g),
         "total_cost": round(total_cost, 2),
         "total_power_watts": round(total_power_w, 2),
         "devices": devices_info,
     }
+    if failed_count:
+        # Totals cover only the devices that answered
+        result["failed_count"] = failed_count
+    return result
+
+
+async def _get_site_summary(inp: dict, tb: TBClient, ctx: EntityContext | None = None) -> dict:
+    """Aggregate telemetry across all devices at a site."""
+    site_id = inp["site_id"]
+    time_range = inp.get("time_range", "today")
+    start_ts, end_ts = resolve_time_range(time_range)
+
+    site, device_ids = await asyncio.gather(
+        _cached_get_asset(site_id, tb), _site_device_ids(site_id, tb),
+    )
+    fan = await fan_out(device_ids, lambda d: _device_summary(d, start_ts, end_ts, tb))
+    outcomes = {
+        dev_id: fan.errors.get(i) or fan.results[i] for i, dev_id in enumerate(device_ids)
+    }
+    return _site_totals(site, site_id, time_range, device_ids, outcomes)
+
+
+def _failed_device(dev_id: str, exc: Exception) -> dict:
+    """Per-device entry for a device whose data could not be fetched."""
+    cached = get_cached_entity(dev_id) or {}
+    return {"id": dev_id, "name": cached.get("name", ""), "error": str(exc)}
 
 
 async def _get_device_telemetry(inp: dict, tb: TBClient, ctx: EntityContext | None = None) -> dict:
@@ -721,20 +1305,125 @@ async def _get_device_telemetry(inp: dict, tb: TBClient, ctx: EntityContext | No
         hist = await tb.get_historical_telemetry(
             "DEVICE", device_id, keys, start_ts, end_ts, agg=agg
         )
-        # Flatten single-bucket results
+        budget = max(3, min(inp.get("max_points") or config.TELEMETRY_POINT_BUDGET, 1000))
+        method = inp.get("downsample", "lttb")
+        # Flatten single-bucket results; summarise and reduce long series
         values: dict = {}
+        summary: dict = {}
+        downsampled: dict = {}
         for key, buckets in hist.items():
             if len(buckets) == 1:
                 values[key] = buckets[0]["value"]
-            else:
-                values[key] = buckets
+                continue
+            if buckets:
+                summary[key] = summarize(buckets)
+            values[key] = reduce_series(buckets, budget, method)
+            if len(values[key]) < len(buckets):
+                downsampled[key] = {
+                    "method": method,
+                    "original_points": len(buckets),
+                    "returned_points": len(values[key]),
+                }
         result["time_range"] = time_range
         result["aggregation"] = agg
         result["values"] = values
+        if summary:
+            result["summary"] = summary
+        if downsampled:
+            result["downsampled"] = downsampled
 
     return result
 
 
+MAX_TELEMETRY_DEVICES = 50
+
+
+def _to_number(value: object) -> object:
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return value
+
+
+async def _telemetry_values(
+    device_ids: list[str], keys: list[str], time_range: str, agg: str, tb: TBClient
+) -> tuple[dict[str, dict], dict[str, str]]:
+    """One value per device and key: ``({device_id: {key: value}}, {device_id: error})``.
+
+    ``latest`` reads TIME_SERIES latest values through bulk entity data
+    queries; a range makes one *agg*-aggregated history call per device.
+    """
+    if time_range == "latest":
+        try:
+            rows = await tb.get_latest_values_bulk(device_ids, keys, "TIME_SERIES")
+        except httpx.HTTPStatusError as exc:
+            if not _unsupported(exc):
+                raise
+            fan = await fan_out(
+                device_ids, lambda d: tb.get_latest_telemetry("DEVICE", d, keys)
+            )
+        else:
+            return {
+                d: {k: _to_number(v) for k, v in row.items()} for d, row in rows.items()
+            }, {}
+    else:
+        start_ts, end_ts = resolve_time_range(time_range)
+
+        async def one(dev_id: str) -> dict:
+            hist = await tb.get_historical_telemetry(
+                "DEVICE", dev_id, keys, start_ts, end_ts, agg=agg
+            )
+            return {k: b[0]["value"] for k, b in hist.items() if b}
+
+        fan = await fan_out(device_ids, one)
+    return (
+        {d: r for d, r in zip(device_ids, fan.results) if r is not None},
+        {device_ids[i]: str(exc) for i, exc in fan.errors.items()},
+    )
+
+
+async def _get_devices_telemetry(inp: dict, tb: TBClient, ctx: EntityContext | None = None) -> dict:
+    """Latest or aggregated telemetry for several devices as a table.
+
+    Latest values come from bulk entity data queries; a range costs one
+    aggregated history call per device, run through the bounded fan-out.
+    """
+    device_ids = list(dict.fromkeys(inp["device_ids"]))
+    keys = inp["keys"]
+    time_range = inp.get("time_range", "latest")
+    agg = inp.get("aggregation", "SUM")
+    if not device_ids:
+        return {"error": "device_ids is empty."}
+    if len(device_ids) > MAX_TELEMETRY_DEVICES:
+        return {
+            "error": f"At most {MAX_TELEMETRY_DEVICES} devices per call; "
+            "use get_site_summary or get_fleet_overview for larger sets."
+        }
+
+    devices, (values, errors) = await asyncio.gather(
+        _lookup_devices(device_ids, tb),
+        _telemetry_values(device_ids, keys, time_range, agg, tb),
+    )
+
+    result: dict = {
+        "time_range": time_range,
+        # Columnar table: one row per device, values in key order
+        "columns": ["device", "device_id", *keys],
+        "rows": [
+            [devices.get(d, {}).get("name", ""), d, *(values.get(d, {}).get(k) for k in keys)]
+            for d in device_ids if d not in errors
+        ],
+    }
+    if time_range != "latest":
+        result["aggregation"] = agg
+    if errors:
+        result["errors"] = [
+            {"device": devices.get(d, {}).get("name", ""), "device_id": d, "error": e}
+            for d, e in errors.items()
+        ]
+    return result
+
+
 async def _get_energy_savings(inp: dict, tb: TBClient, ctx: EntityContext | None = None) -> dict:
     """Get savings metrics for a device or all devices at a site."""
     entity_id = inp["entity_id"]
@@ -775,45 +1464,61 @@ async def _get_energy_savings(inp: dict, tb: TBClient, ctx: EntityContext | None
     site = await _cached_get_asset(entity_id, tb)
     rels = await tb.get_entity_relations(entity_id, "ASSET")
 
-    total_saving_wh = 0.0
-    total_cost_saving = 0.0
-    total_co2_saving_g = 0.0
-    pct_values: list[float] = []
-    device_savings: list[dict] = []
+    device_ids = [
+        rel["to"]["id"] for rel in rels if rel["to"]["entityType"] == "DEVICE"
+    ]
 
-    for rel in rels:
-        child = rel["to"]
-        if child["entityType"] != "DEVICE":
-            continue
-        dev = await _cached_get_device(child["id"], tb)
-        hist = await tb.get_historical_telemetry(
-            "DEVICE", child["id"], savings_keys, start_ts, end_ts, agg="SUM"
-        )
-        avg_hist = await tb.get_historical_telemetry(
-            "DEVICE", child["id"], ["saving_pct"], start_ts, end_ts, agg="AVG"
+    async def device_savings_for(dev_id: str) -> tuple[dict, float, float, float, float]:
+        dev, hist, avg_hist = await gather_all(
+            _cached_get_device(dev_id, tb),
+            tb.get_historical_telemetry(
+                "DEVICE", dev_id, savings_keys, start_ts, end_ts, agg="SUM"
+            ),
+            tb.get_historical_telemetry(
+                "DEVICE", dev_id, ["saving_pct"], start_ts, end_ts, agg="AVG"
+            ),
         )
         s_wh = sum(b["value"] for b in hist.get("energy_saving_wh", []))
         c_s = sum(b["value"] for b in hist.get("cost_saving", []))
         co2_s = sum(b["value"] for b in hist.get("co2_saving_grams", []))
         avg_vals = avg_hist.get("saving_pct", [])
         avg_p = avg_vals[0]["value"] if avg_vals else 0
+        info = {
+            "device_name": dev.get("name", ""),
+            "device_id": dev_id,
+            "energy_saving_kwh": wh_to_kwh(s_wh),
+            "average_saving_pct": round(avg_p, 1),
+        }
+        return info, s_wh, c_s, co2_s, avg_p
+
+    fan = await fan_out(device_ids, device_savings_for)
+
+    total_saving_wh = 0.0
+    total_cost_saving = 0.0
+    total_co2_saving_g = 0.0
+    pct_values: list[float] = []
+    device_savings: list[dict] = []
 
+    for i, dev_id in enumerate(device_ids):
+        if i in fan.errors:
+            failed = _failed_device(dev_id, fan.errors[i])
+            device_savings.append({
+                "device_name": failed["name"],
+                "device_id": dev_id,
+                "error": failed["error"],
+            })
+            continue
+        info, s_wh, c_s, co2_s, avg_p = fan.results[i]
         total_saving_wh += s_wh
         total_cost_saving += c_s
         total_co2_saving_g += co2_s
         if avg_p:
             pct_values.append(avg_p)
-
-        device_savings.append({
-            "device_name": dev.get("name", ""),
-            "device_id": child["id"],
-            "energy_saving_kwh": wh_to_kwh(s_wh),
-            "average_saving_pct": round(avg_p, 1),
-        })
+        device_savings.append(info)
 
     overall_pct = round(sum(pct_values) / len(pct_values), 1) if pct_values else 0
 
-    return {
+    result = {
         "entity_name": site.get("name", ""),
         "entity_type": "ASSET",
         "time_range": time_range,
@@ -823,6 +1528,10 @@ async def _get_energy_savings(inp: dict, tb: TBClient, ctx: EntityContext | None
         "average_saving_pct": overall_pct,
         "devices": device_savings,
     }
+    if fan.failed_count:
+        # Totals cover only the devices that answered
+        result["failed_count"] = fan.failed_count
+    return result
 
 
 async def _get_alarms(inp: dict, tb: TBClient, ctx: EntityContext | None = None) -> dict:
@@ -883,12 +1592,14 @@ async def _resolve_device_ids(entity_id: str, tb: TBClient) -> list[dict]:
     # Try as asset — get child device relations
     try:
         rels = await tb.get_entity_relations(entity_id, "ASSET")
-        devices = []
-        for rel in rels:
-            child = rel["to"]
-            if child["entityType"] == "DEVICE":
-                dev = await _cached_get_device(child["id"], tb)
-                devices.append({"id": child["id"], "name": dev.get("name", "")})
+        device_ids = [
+            rel["to"]["id"] for rel in rels if rel["to"]["entityType"] == "DEVICE"
+        ]
+        found = await _lookup_devices(device_ids, tb)
+        devices = [
+            {"id": d, "name": found[d].get("name", "")}
+            for d in device_ids if d in found
+        ]
         if devices:
             return devices
     except Exception:
@@ -896,11 +1607,220 @@ async def _resolve_device_ids(entity_id: str, tb: TBClient) -> list[dict]:
     return []
 
 
+async def _current_shared(
+    device_ids: list[str], key: str, tb: TBClient, with_ts: bool = False
+) -> dict:
+    """Current value of shared attribute *key* per device ({} if unreadable).
+
+    With *with_ts* each value is a ``(value, lastUpdateTs)`` tuple.
+    """
+    try:
+        try:
+            rows = await tb.get_latest_values_bulk(
+                device_ids, [key], "SHARED_ATTRIBUTE", with_ts=with_ts
+            )
+        except httpx.HTTPStatusError as exc:
+            if not _unsupported(exc):
+                raise
+            read = tb.get_attributes_with_ts if with_ts else tb.get_attributes
+            fan = await fan_out(
+                device_ids, lambda d: read("DEVICE", d, "SHARED_SCOPE", [key]),
+            )
+            rows = {d: a for d, a in zip(device_ids, fan.results) if a is not None}
+    except Exception:
+        logger.warning("Could not read current %s — sending to all devices", key, exc_info=True)
+        return {}
+    return {d: attrs[key] for d, attrs in rows.items() if key in attrs}
+
+
+async def _reported_telemetry(device_ids: list[str], key: str, tb: TBClient) -> dict:
+    """Latest reported telemetry *key* per device ({} if unreadable)."""
+    try:
+        try:
+            rows = await tb.get_latest_values_bulk(device_ids, [key], "TIME_SERIES")
+        except httpx.HTTPStatusError as exc:
+            if not _unsupported(exc):
+                raise
+            fan = await fan_out(
+                device_ids, lambda d: tb.get_latest_telemetry("DEVICE", d, [key]),
+            )
+            rows = {d: t for d, t in zip(device_ids, fan.results) if t is not None}
+    except Exception:
+        logger.warning("Could not read reported %s — treating as unconfirmed", key, exc_info=True)
+        return {}
+    return {d: values[key] for d, values in rows.items() if key in values}
+
+
+async def _split_unchanged(
+    devices: list[dict],
+    key: str,
+    matches: Callable[[object], bool],
+    tb: TBClient,
+    force: bool,
+    current: dict | None = None,
+    reported_key: str | None = None,
+) -> tuple[list[dict], list[dict]]:
+    """Split *devices* into (to_send, unchanged) by their current *key* value.
+
+    Skipping unchanged devices saves a LoRaWAN downlink each; *force*
+    sends to every device. *current* values are read from TB unless given.
+    The last write says nothing about a dropped downlink, so with
+    *reported_key* a device is only skipped if the value it reports in that
+    telemetry key matches too.
+    """
+    if force:
+        return devices, []
+    if current is None:
+        current = await _current_shared([d["id"] for d in devices], key, tb)
+    to_send: list[dict] = []
+    unchanged: list[dict] = []
+    for dev in devices:
+        value = current.get(dev["id"])
+        (unchanged if value is not None and matches(value) else to_send).append(dev)
+    if unchanged and reported_key:
+        reported = await _reported_telemetry([d["id"] for d in unchanged], reported_key, tb)
+        confirmed = [d for d in unchanged if matches(reported.get(d["id"]))]
+        to_send += [d for d in unchanged if d not in confirmed]
+        unchanged = confirmed
+    return to_send, unchanged
+
+
+def _dim_matches(dim_value: int) -> Callable[[object], bool]:
+    def matches(value: object) -> bool:
+        try:
+            return float(value) == dim_value
+        except (TypeError, ValueError):
+            return False
+    return matches
+
+
+def _command_matches(command: dict, ignore: tuple[str, ...] = ()) -> Callable[[object], bool]:
+    """Match a stored task_command (JSON string) against *command*."""
+    wanted = {k: v for k, v in command.items() if k not in ignore}
+
+    def matches(value: object) -> bool:
+        try:
+            current = json.loads(value) if isinstance(value, str) else value
+        except json.JSONDecodeError:
+            return False
+        if not isinstance(current, dict):
+            return False
+        return {k: v for k, v in current.items() if k not in ignore} == wanted
+    return matches
+
+
+def _stored_profile_id(value: object) -> object:
+    """``profile_id`` of a stored task_command value, if any."""
+    try:
+        stored = json.loads(value) if isinstance(value, str) else value
+    except json.JSONDecodeError:
+        return None
+    return stored.get("profile_id") if isinstance(stored, dict) else None
+
+
+def _skip_preview(unchanged: list[dict], state: str, reported: bool = False) -> dict:
+    """Preview fields and note for devices that will be skipped.
+
+    *reported* says the skip was confirmed by the devices' own telemetry;
+    otherwise it reflects only the last command written to them.
+    """
+    if not unchanged:
+        return {"skipped": 0, "note": ""}
+    basis = (
+        "by the last command written and the state they report" if reported
+        else "by the last command written to them, not acknowledged by the devices"
+    )
+    return {
+        "skipped": len(unchanged),
+        "note": (
+            f"\n{len(unchanged)} device(s) already {state} ({basis}) will be "
+            f"skipped (force=true to resend): {', '.join(d['name'] for d in unchanged)}"
+        ),
+    }
+
+
+def _pacing_site(entity_id: str, devices: list[dict], ctx: EntityContext | None) -> str:
+    """Site whose gateway carries the downlinks — the pacing budget key.
+
+    A site command is keyed by the site; a single device by its site from
+    the cached hierarchy (or the context's cached branch), or by itself if
+    neither is loaded.
+    """
+    if not (len(devices) == 1 and devices[0]["id"] == entity_id):
+        return entity_id
+    hierarchy = None
+    if ctx and ctx.customer_id:
+        hierarchy = get_cached_hierarchy(ctx.customer_id) or (
+            get_cached_scope(ctx.customer_id, ctx.entity_id) if ctx.entity_id else None
+        )
+
+    def find(node: dict) -> str | None:
+        if any(d.get("id") == entity_id for d in node.get("devices", [])):
+            return node.get("id")
+        for key in ("estates", "regions", "sites"):
+            for child in node.get(key, []):
+                found = find(child)
+                if found:
+                    return found
+        return None
+
+    return (find(hierarchy) if hierarchy else None) or entity_id
+
+
+def _pacing_preview(site: str, command: str, count: int) -> dict:
+    """Preview ETA for *count* paced writes of *command* at *site*."""
+    if not config.PACING_ENABLED or not count:
+        return {"eta_s": 0, "note": ""}
+    eta = pacer.estimate(site, command, count)
+    note = ""
+    if eta >= 30:
+        note = (
+            "\nDelivery is paced to the gateway duty cycle: "
+            f"done in {format_eta(eta)}."
+        )
+    return {"eta_s": round(eta), "note": note}
+
+
+async def _multicast_plan(
+    entity_id: str, devices: list[dict], site: str, tb: TBClient, force: bool,
+    confirmed: bool,
+) -> tuple[MulticastGroup | None, dict | None]:
+    """The site's multicast group (site commands only) and current dim levels.
+
+    A multicast leaves the members' ``dimLevel`` attributes behind, so after
+    one the levels are read with timestamps and corrected; None means read
+    them the usual way. Group membership is only stored once *confirmed*.
+    """
+    if not multicast_groups.enabled:
+        return None, None
+    is_site = not (len(devices) == 1 and devices[0]["id"] == entity_id)
+    group = last = None
+    try:
+        if is_site and len(devices) >= config.MULTICAST_MIN_DEVICES:
+            group = await multicast_groups.sync(entity_id, devices, tb, persist=confirmed)
+        # A single device outside the cached hierarchy has no known site
+        if not force and site != devices[0]["id"]:
+            last = await multicast_groups.last_command(site, tb)
+    except Exception:
+        logger.warning("Multicast check for site %s failed — using unicast", site, exc_info=True)
+        return None, None
+    if last is None:
+        return group, None
+    current = await _current_shared([d["id"] for d in devices], "dimLevel", tb, with_ts=True)
+    return group, effective_values(current, *last)
+
+
 async def _send_dim_command(inp: dict, tb: TBClient, ctx: EntityContext | None = None) -> dict:
-    """Set dim level via shared attributes for a device or all devices at a site."""
+    """Set dim level via shared attributes for a device or all devices at a site.
+
+    A site-wide dim goes out as one Class C multicast downlink when the
+    site's group covers every device and at least ``MULTICAST_MIN_DEVICES``
+    would otherwise get a unicast one.
+    """
     device_id = inp["device_id"]
     dim_value = inp["dim_value"]
     confirmed = inp.get("confirmed", False)
+    force = inp.get("force", False)
 
     # Server-side range validation
     if not (0 <= dim_value <= 100):
@@ -910,43 +1830,81 @@ async def _send_dim_command(inp: dict, tb: TBClient, ctx: EntityContext | None =
     if not devices:
         return {"error": f"No devices found for ID {device_id}"}
 
+    site = _pacing_site(device_id, devices, ctx)
+    group, current = await _multicast_plan(device_id, devices, site, tb, force, confirmed)
+
+    to_send, unchanged = await _split_unchanged(
+        devices, "dimLevel", _dim_matches(dim_value), tb, force, current,
+        reported_key="dim_value",
+    )
+    multicast = (
+        group is not None and group.ready
+        and len(to_send) >= config.MULTICAST_MIN_DEVICES
+    )
+    # The multicast reaches every member, unchanged ones included
+    targets, skipped = (devices, []) if multicast else (to_send, unchanged)
+
     # Two-step confirmation flow
     if not confirmed:
-        device_names = [d["name"] for d in devices]
-        return {
+        skip = _skip_preview(skipped, f"at {dim_value}%", reported=True)
+        eta = _pacing_preview(site, "DIM_COMMAND", 1 if multicast else len(targets))
+        route = (
+            f"\nSent as one Class C multicast downlink (group {group.group_id})."
+            if multicast else ""
+        )
+        preview = {
             "requires_confirmation": True,
             "message": (
-                f"Please confirm: set {len(devices)} device(s) to {dim_value}% — "
-                f"{', '.join(device_names)}"
+                f"Please confirm: set {len(targets)} device(s) to {dim_value}% — "
+                f"{', '.join(d['name'] for d in targets)}{skip['note']}{route}{eta['note']}"
             ),
             "devices": devices,
             "dim_value": dim_value,
+            "to_send": len(targets),
+            "skipped": skip["skipped"],
+            "eta_s": eta["eta_s"],
         }
+        if multicast:
+            preview["multicast_group"] = group.group_id
+        return preview
 
     # Execute the command
     customer_id = ctx.customer_id if ctx else "unknown"
-    results = []
-    for dev in devices:
+
+    outcome = None
+    if multicast:
         logger.warning(
-            "DIM_COMMAND customer=%s device=%s value=%d",
-            customer_id, dev["id"], dim_value,
+            "DIM_COMMAND customer=%s site=%s group=%s value=%d",
+            customer_id, site, group.group_id, dim_value,
         )
-        await tb.update_shared_attributes(dev["id"], {"dimLevel": dim_value})
-        results.append({
-            "device_name": dev["name"],
-            "device_id": dev["id"],
-            "dim_value": dim_value,
-            "status": "sent",
-        })
+        outcome = await dispatch_multicast(
+            "DIM_COMMAND", targets,
+            lambda: multicast_groups.send_dim(group, dim_value, tb),
+            customer_id, group.group_id, site=site,
+        )
+    elif group is not None and len(to_send) >= config.MULTICAST_MIN_DEVICES:
+        logger.info("Site %s dim sent unicast: %s", site, group.reason)
+
+    if outcome is None:
+        if group is not None and len(to_send) >= config.MULTICAST_MIN_DEVICES:
+            MULTICAST_TOTAL.inc(outcome="unicast_fallback")
+
+        async def send(dev: dict) -> None:
+            logger.warning(
+                "DIM_COMMAND customer=%s device=%s value=%d",
+                customer_id, dev["id"], dim_value,
+            )
+            await tb.update_shared_attributes(dev["id"], {"dimLevel": dim_value})
 
+        outcome = await dispatch(
+            "DIM_COMMAND", to_send, send, customer_id, skipped=unchanged, site=site,
+        )
     return {
-        "devices_commanded": len(results),
+        "devices_commanded": outcome.sent,
         "dim_value": dim_value,
-        "results": results,
-        "message": (
-            f"Dim {dim_value}% sent to {len(results)} device(s): "
-            f"{', '.join(d['name'] for d in devices)}"
-        ),
+        "dispatch": outcome.summary(),
+        "results": outcome.results,
+        "message": outcome.describe(f"Dim {dim_value}%"),
     }
 
 
@@ -1082,25 +2040,6 @@ async def _send_task_schedule(inp: dict, tb: TBClient, ctx: EntityContext | None
         except ValueError:
             return {"error": f"Invalid end_date format: '{end_str}'. Use YYYY-MM-DD or 'forever'."}
 
-    # Preview
-    if not confirmed:
-        slot_previews = [_format_time_slot_preview(s) for s in time_slots]
-        end_label = "forever" if end_forever else end_str
-        return {
-            "requires_confirmation": True,
-            "message": (
-                f"Schedule {operation} on {len(devices)} device(s): "
-                f"{', '.join(d['name'] for d in devices)}\n"
-                f"Profile ID: {profile_id}\n"
-                f"Period: {start_str} -> {end_label}\n"
-                f"Priority: {priority}, Channel: {channel}\n"
-                f"Time slots:\n" + "\n".join(f"  {i+1}. {s}" for i, s in enumerate(slot_previews))
-            ),
-            "devices": devices,
-            "profile_id": profile_id,
-            "operation": operation,
-        }
-
     # Build bridge command JSON
     parsed_slots = [_parse_time_slot(s) for s in time_slots]
 
@@ -1124,30 +2063,77 @@ async def _send_task_schedule(inp: dict, tb: TBClient, ctx: EntityContext | None
         command["end_month"] = end_dt.month
         command["end_day"] = end_dt.day
 
+    # An auto-generated profile ID is new on every call — compare the rest
+    force = inp.get("force", False)
+    current = {} if force else await _current_shared(
+        [d["id"] for d in devices], "task_command", tb,
+    )
+    to_send, unchanged = await _split_unchanged(
+        devices, "task_command",
+        _command_matches(command, () if "profile_id" in inp else ("profile_id",)),
+        tb, force, current,
+    )
+    # Skipped devices keep the schedule under its old profile ID
+    kept_profiles = {
+        d["name"]: pid for d in unchanged
+        if (pid := _stored_profile_id(current.get(d["id"]))) != profile_id
+    }
+    kept_note = (
+        "\nSkipped devices keep their existing profile ID: "
+        + ", ".join(f"{name} ({pid})" for name, pid in kept_profiles.items())
+        if kept_profiles else ""
+    )
+
+    site = _pacing_site(device_id, devices, ctx)
+
+    # Preview
+    if not confirmed:
+        slot_previews = [_format_time_slot_preview(s) for s in time_slots]
+        end_label = "forever" if end_forever else end_str
+        skip = _skip_preview(unchanged, "on this schedule")
+        eta = _pacing_preview(site, "TASK_SCHEDULE", len(to_send))
+        return {
+            "requires_confirmation": True,
+            "message": (
+                f"Schedule {operation} on {len(to_send)} device(s): "
+                f"{', '.join(d['name'] for d in to_send)}\n"
+                f"Profile ID: {profile_id}\n"
+                f"Period: {start_str} -> {end_label}\n"
+                f"Priority: {priority}, Channel: {channel}\n"
+                f"Time slots:\n" + "\n".join(f"  {i+1}. {s}" for i, s in enumerate(slot_previews))
+                + skip["note"] + kept_note + eta["note"]
+            ),
+            "devices": devices,
+            "profile_id": profile_id,
+            "operation": operation,
+            "to_send": len(to_send),
+            "skipped": skip["skipped"],
+            "eta_s": eta["eta_s"],
+            **({"existing_profile_ids": kept_profiles} if kept_profiles else {}),
+        }
+
     # Execute
     customer_id = ctx.customer_id if ctx else "unknown"
-    results = []
-    for dev in devices:
+
+    async def send(dev: dict) -> None:
         logger.warning(
             "TASK_SCHEDULE customer=%s device=%s op=%s profile=%s",
             customer_id, dev["id"], operation, profile_id,
         )
         await _write_task_command(tb, dev["id"], command)
-        results.append({
-            "device_name": dev["name"],
-            "device_id": dev["id"],
-            "status": "sent",
-        })
+        schedule_snapshots.invalidate(dev["id"])
 
+    outcome = await dispatch(
+        "TASK_SCHEDULE", to_send, send, customer_id, skipped=unchanged, site=site,
+    )
     return {
-        "devices_commanded": len(results),
+        "devices_commanded": outcome.sent,
         "operation": operation,
         "profile_id": profile_id,
-        "results": results,
-        "message": (
-            f"Schedule {operation} (profile {profile_id}) sent to "
-            f"{len(results)} device(s): {', '.join(d['name'] for d in devices)}"
-        ),
+        "dispatch": outcome.summary(),
+        "results": outcome.results,
+        "message": outcome.describe(f"Schedule {operation} (profile {profile_id})") + kept_note,
+        **({"existing_profile_ids": kept_profiles} if kept_profiles else {}),
     }
 
 
@@ -1163,68 +2149,100 @@ async def _query_task_schedule(inp: dict, tb: TBClient, ctx: EntityContext | Non
     if not (0 <= task_index <= 19):
         return {"error": "task_index must be 0-19."}
 
-    # Send query command
-    command = {"command": "task_request", "task_index": task_index}
-    await _write_task_command(tb, device_id, command)
-
-    # Brief wait for device response
-    await asyncio.sleep(2)
-
-    # Read back client attribute
-    attrs = await tb.get_attributes(
-        "DEVICE", device_id, "CLIENT_SCOPE", keys=["task_query_response"]
-    )
-
-    response_raw = attrs.get("task_query_response")
-    if not response_raw:
+    # Answers to a full-schedule read in progress would be taken for ours
+    snap = schedule_snapshots.get(device_id)
+    if snap is not None and snap.collecting:
+        known = snap.slots.get(task_index)
         return {
-            "query_sent": True,
+            "query_sent": False,
             "task_index": task_index,
-            "response": None,
+            "response": known["response"] if known else None,
+            "pending": known is None,
             "message": (
-                f"Query sent for schedule slot {task_index}. "
-                "The device needs to send an uplink first (LoRaWAN Class A). "
-                "The response will be available shortly — ask again in a few minutes."
+                f"Schedule at slot {task_index} retrieved from the full-schedule read."
+                if known else
+                "A full-schedule read is collecting this device's slots — use "
+                "get_full_schedule to see them as they arrive."
             ),
         }
 
-    # Parse the response
-    try:
-        if isinstance(response_raw, str):
-            response_data = json.loads(response_raw)
-        else:
-            response_data = response_raw
-    except (json.JSONDecodeError, TypeError):
-        response_data = {"raw": response_raw}
-
-    # Check staleness via received_at timestamp
-    stale = False
-    received_at = response_data.get("received_at")
-    if received_at:
-        try:
-            if isinstance(received_at, (int, float)):
-                age = time.time() - received_at
-            else:
-                age = time.time() - datetime.fromisoformat(str(received_at)).timestamp()
-            stale = age > 30
-        except (ValueError, TypeError):
-            stale = True
+    # Sent once per slot; a repeat call waits on the pending query
+    pending, sent = await task_queries.query(tb, device_id, task_index)
+    if pending.task_index != task_index:
+        return {
+            "query_sent": False,
+            "task_index": task_index,
+            "pending": True,
+            "message": (
+                f"Slot {pending.task_index} is still being queried on this device. "
+                "The controller may not say which slot an answer is for, so only "
+                f"one query runs at a time — ask for slot {task_index} once slot "
+                f"{pending.task_index} has answered."
+            ),
+        }
+    await pending.wait(config.TASK_QUERY_WAIT_S)
 
     result = {
-        "query_sent": True,
+        "query_sent": sent,
         "task_index": task_index,
-        "response": response_data,
+        "response": pending.response,
     }
-
-    if stale:
+    if pending.answered:
+        task_queries.consume(pending)
+        schedule_snapshots.record(device_id, task_index, pending.response, pending.response_ts)
+        result["message"] = f"Schedule at slot {task_index} retrieved successfully."
+    elif pending.expired:
+        task_queries.consume(pending)
         result["message"] = (
-            f"Query sent for slot {task_index}. The current response may be "
-            "from a previous query (stale). The fresh response hasn't arrived yet — "
-            "try again in a few minutes after the device sends an uplink."
+            f"No response for slot {task_index} within "
+            f"{config.TASK_QUERY_DEADLINE_S / 60:.0f} minutes. The controller may "
+            "be offline; query again to resend the request."
         )
     else:
-        result["message"] = f"Schedule at slot {task_index} retrieved successfully."
+        waited = time.time() - pending.sent_at
+        result["pending"] = True
+        result["message"] = (
+            f"Query for slot {task_index} is pending ({waited / 60:.0f} min since it "
+            "was sent). The device answers on its next uplink (LoRaWAN Class A). "
+            "Ask again later — the query will not be re-sent, and the response "
+            "is returned as soon as it arrives."
+        )
+    return result
+
 
+async def _get_full_schedule(inp: dict, tb: TBClient, ctx: EntityContext | None = None) -> dict:
+    """Snapshot of all schedule slots on a DALI controller."""
+    device_id = inp["device_id"]
+    # Its answer would be filed as a snapshot slot, or the reverse
+    busy = task_queries.busy(device_id)
+    if busy is not None:
+        return {
+            "device_id": device_id,
+            "requests_sent": 0,
+            "pending": True,
+            "message": (
+                f"A query for slot {busy.task_index} is still pending on this device. "
+                "Read the full schedule once it has answered."
+            ),
+        }
+
+    snap, sent = await schedule_snapshots.request(tb, device_id, inp.get("refresh", False))
+    result = snap.table()
+    result["requests_sent"] = sent
+    if snap.complete:
+        result["message"] = "All 20 schedule slots retrieved."
+    else:
+        result["message"] = (
+            f"{len(snap.slots)} of 20 slots known. The other {len(snap.outstanding)} "
+            "arrive one per device uplink (LoRaWAN Class A), so the full table "
+            "can take a while — call again to see progress."
+        )
+        if snap.unattributed:
+            result["message"] += (
+                f" {snap.unattributed} response(s) did not say which slot they "
+                "answer and were ignored; slots still missing after the deadline "
+                "are requested again on the next call."
+            )
     return result
 
 
@@ -1252,49 +2270,58 @@ async def _send_location_setup(inp: dict, tb: TBClient, ctx: EntityContext | Non
     if not devices:
         return {"error": f"No devices found for ID {device_id}"}
 
+    command = {
+        "command": "location_setup",
+        "latitude": latitude,
+        "longitude": longitude,
+        "timezone": timezone_offset,
+    }
+    to_send, unchanged = await _split_unchanged(
+        devices, "task_command", _command_matches(command), tb, inp.get("force", False),
+    )
+
+    site = _pacing_site(device_id, devices, ctx)
+
     if not confirmed:
+        skip = _skip_preview(unchanged, "at this location")
+        eta = _pacing_preview(site, "LOCATION_SETUP", len(to_send))
         return {
             "requires_confirmation": True,
             "message": (
-                f"Set location on {len(devices)} device(s): "
-                f"{', '.join(d['name'] for d in devices)}\n"
+                f"Set location on {len(to_send)} device(s): "
+                f"{', '.join(d['name'] for d in to_send)}\n"
                 f"Latitude: {latitude}, Longitude: {longitude}\n"
-                f"Timezone: UTC{timezone_offset:+.1f}"
+                f"Timezone: UTC{timezone_offset:+.1f}{skip['note']}{eta['note']}"
             ),
             "devices": devices,
             "latitude": latitude,
             "longitude": longitude,
             "timezone": timezone_offset,
+            "to_send": len(to_send),
+            "skipped": skip["skipped"],
+            "eta_s": eta["eta_s"],
         }
 
     # Execute
-    command = {
-        "command": "location_setup",
-        "latitude": latitude,
-        "longitude": longitude,
-        "timezone": timezone_offset,
-    }
 
     customer_id = ctx.customer_id if ctx else "unknown"
-    results = []
-    for dev in devices:
+
+    async def send(dev: dict) -> None:
         logger.warning(
             "LOCATION_SETUP customer=%s device=%s lat=%s lon=%s tz=%s",
             customer_id, dev["id"], latitude, longitude, timezone_offset,
         )
         await _write_task_command(tb, dev["id"], command)
-        results.append({
-            "device_name": dev["name"],
-            "device_id": dev["id"],
-            "status": "sent",
-        })
 
+    outcome = await dispatch(
+        "LOCATION_SETUP", to_send, send, customer_id, skipped=unchanged, site=site,
+    )
     return {
-        "devices_commanded": len(results),
-        "results": results,
-        "message": (
-            f"Location (lat={latitude}, lon={longitude}, tz=UTC{timezone_offset:+.1f}) "
-            f"sent to {len(results)} device(s): {', '.join(d['name'] for d in devices)}"
+        "devices_commanded": outcome.sent,
+        "dispatch": outcome.summary(),
+        "results": outcome.results,
+        "message": outcome.describe(
+            f"Location (lat={latitude}, lon={longitude}, tz=UTC{timezone_offset:+.1f})"
         ),
     }
 
@@ -1316,17 +2343,6 @@ async def _delete_task_schedule(inp: dict, tb: TBClient, ctx: EntityContext | No
     if not devices:
         return {"error": f"No devices found for ID {device_id}"}
 
-    if not confirmed:
-        return {
-            "requires_confirmation": True,
-            "message": (
-                f"Delete schedule (profile {profile_id}) from {len(devices)} device(s): "
-                f"{', '.join(d['name'] for d in devices)}"
-            ),
-            "devices": devices,
-            "profile_id": profile_id,
-        }
-
     # Build delete command — operation_type 3, today's date, empty time_slots
     today = date.today()
     command = {
@@ -1345,51 +2361,489 @@ async def _delete_task_schedule(inp: dict, tb: TBClient, ctx: EntityContext | No
         "time_slots": [],
     }
 
+    to_send, unchanged = await _split_unchanged(
+        devices, "task_command", _command_matches(command), tb, inp.get("force", False),
+    )
+
+    site = _pacing_site(device_id, devices, ctx)
+
+    if not confirmed:
+        skip = _skip_preview(unchanged, "sent this delete today")
+        eta = _pacing_preview(site, "DELETE_SCHEDULE", len(to_send))
+        return {
+            "requires_confirmation": True,
+            "message": (
+                f"Delete schedule (profile {profile_id}) from {len(to_send)} device(s): "
+                f"{', '.join(d['name'] for d in to_send)}{skip['note']}{eta['note']}"
+            ),
+            "devices": devices,
+            "profile_id": profile_id,
+            "to_send": len(to_send),
+            "skipped": skip["skipped"],
+            "eta_s": eta["eta_s"],
+        }
+
     customer_id = ctx.customer_id if ctx else "unknown"
-    results = []
-    for dev in devices:
+
+    async def send(dev: dict) -> None:
         logger.warning(
             "DELETE_SCHEDULE customer=%s device=%s profile=%s",
             customer_id, dev["id"], profile_id,
         )
         await _write_task_command(tb, dev["id"], command)
-        results.append({
-            "device_name": dev["name"],
-            "device_id": dev["id"],
-            "status": "sent",
-        })
+        schedule_snapshots.invalidate(dev["id"])
 
+    outcome = await dispatch(
+        "DELETE_SCHEDULE", to_send, send, customer_id, skipped=unchanged, site=site,
+    )
     return {
-        "devices_deleted": len(results),
+        "devices_deleted": outcome.sent,
         "profile_id": profile_id,
-        "results": results,
-        "message": (
-            f"Delete schedule (profile {profile_id}) sent to "
-            f"{len(results)} device(s): {', '.join(d['name'] for d in devices)}"
-        ),
+        "dispatch": outcome.summary(),
+        "results": outcome.results,
+        "message": outcome.describe(f"Delete schedule (profile {profile_id})"),
     }
 
 
+# compare_sites metric name → site summary field
+_COMPARE_METRICS = {
+    "energy": "total_energy_kwh",
+    "cost": "total_cost",
+    "co2": "total_co2_kg",
+    "power": "total_power_watts",
+    "online": "online_count",
+    "offline": "offline_count",
+}
+
+
 async def _compare_sites(inp: dict, tb: TBClient, ctx: EntityContext | None = None) -> dict:
-    """Fetch summaries for multiple sites in parallel for comparison."""
-    site_ids = inp["site_ids"]
+    """Site-level totals for several sites, sharing per-device work.
+
+    Site device lists and then the union of their devices are fetched
+    through the bounded fan-out, so a device related to several sites is
+    read once. Each site's totals are emitted as a ``partial`` progress
+    event as soon as its last device is in.
+    """
+    site_ids = list(dict.fromkeys(inp["site_ids"]))
     time_range = inp.get("time_range", "today")
+    metrics = inp.get("metrics") or list(_COMPARE_METRICS)
+    sort_by = inp.get("sort_by")
+    top_k = inp.get("top_k")
+    include_devices = inp.get("include_devices", False)
+    start_ts, end_ts = resolve_time_range(time_range)
 
-    tasks = [
-        _get_site_summary({"site_id": sid, "time_range": time_range}, tb)
-        for sid in site_ids
-    ]
-    summaries = await asyncio.gather(*tasks, return_exceptions=True)
+    async def resolve(sid: str) -> tuple[dict, list[str]]:
+        return tuple(await asyncio.gather(_cached_get_asset(sid, tb), _site_device_ids(sid, tb)))
 
+    resolved = await fan_out(site_ids, resolve)
+    site_errors = {site_ids[i]: str(exc) for i, exc in resolved.errors.items()}
+    members = {
+        sid: r for sid, r in zip(site_ids, resolved.results) if r is not None
+    }
+
+    sites_of: dict[str, list[str]] = {}
+    for sid, (_, device_ids) in members.items():
+        for dev_id in set(device_ids):
+            sites_of.setdefault(dev_id, []).append(sid)
+    remaining = {sid: len(set(ids)) for sid, (_, ids) in members.items()}
+    outcomes: dict[str, tuple | Exception] = {}
+    summaries: dict[str, dict] = {}
+
+    def finish(sid: str) -> None:
+        site, device_ids = members[sid]
+        summary = _site_totals(site, sid, time_range, device_ids, outcomes)
+        summaries[sid] = summary
+        # Per-site partial result for job-mode subscribers
+        emit({
+            "type": "partial",
+            "tool": "compare_sites",
+            "site_id": sid,
+            "summary": {k: v for k, v in summary.items() if k != "devices"},
+        })
+
+    for sid, count in remaining.items():
+        if not count:
+            finish(sid)
+
+    async def fetch(dev_id: str) -> None:
+        try:
+            outcomes[dev_id] = await _device_summary(dev_id, start_ts, end_ts, tb)
+        except Exception as exc:
+            outcomes[dev_id] = exc
+            raise
+        finally:
+            for sid in sites_of[dev_id]:
+                remaining[sid] -= 1
+                if remaining[sid] == 0:
+                    finish(sid)
+
+    await fan_out(list(sites_of), fetch)
+
+    fields = [_COMPARE_METRICS[m] for m in metrics if m in _COMPARE_METRICS]
     results = []
-    for sid, summary in zip(site_ids, summaries):
-        if isinstance(summary, Exception):
-            results.append({"site_id": sid, "error": str(summary)})
-        else:
-            results.append(summary)
+    for sid in site_ids:
+        if sid in site_errors:
+            results.append({"site_id": sid, "error": site_errors[sid]})
+            continue
+        summary = summaries[sid]
+        row = {
+            "site_id": sid,
+            "site_name": summary["site_name"],
+            "device_count": summary["device_count"],
+            **{f: summary[f] for f in fields},
+        }
+        if "failed_count" in summary:
+            row["failed_count"] = summary["failed_count"]
+        if include_devices:
+            row["devices"] = summary["devices"]
+        results.append(row)
 
-    return {
+    result = {
         "time_range": time_range,
         "site_count": len(results),
-        "sites": results,
+        "shared_devices": sum(1 for sids in sites_of.values() if len(sids) > 1),
+    }
+    if sort_by in _COMPARE_METRICS:
+        key = _COMPARE_METRICS[sort_by]
+        results.sort(key=lambda r: r.get(key, float("-inf")), reverse=True)
+        result["ranked_by"] = sort_by
+    if top_k:
+        results = results[:top_k]
+    result["sites"] = results
+    return result
+
+
+_FLEET_SUM_KEYS = [
+    "energy_wh", "cost_currency", "co2_grams",
+    "energy_saving_wh", "cost_saving", "co2_saving_grams",
+]
+
+# Site table columns; the ranking key for each sort_by option
+_FLEET_COLUMNS = [
+    "site", "region", "devices", "online", "offline", "faults",
+    "energy_kwh", "cost", "co2_kg", "saving_kwh", "saving_pct",
+]
+_FLEET_SORT = {
+    "energy": ("energy_kwh", True),
+    "cost": ("cost", True),
+    "saving_pct": ("saving_pct", False),
+    "faults": ("faults", True),
+    "offline": ("offline", True),
+}
+
+
+def _fleet_sites(hierarchy: dict) -> list[tuple[dict, str]]:
+    """(site node, region name) for every site, whatever the top level is."""
+    sites: list[tuple[dict, str]] = []
+    for top in hierarchy.get("estates", []):
+        if "devices" in top:  # bare sites at the top level
+            sites.append((top, ""))
+            continue
+        for region in top.get("regions", []):
+            sites.extend((s, region.get("name", "")) for s in region.get("sites", []))
+        # Regions at the top level, or sites directly under an estate
+        region_name = top.get("name", "") if "regions" not in top else ""
+        sites.extend((s, region_name) for s in top.get("sites", []))
+    return sites
+
+
+def _fleet_totals(rows: list[dict]) -> dict:
+    """Roll site rows up into one total (energy in kWh, CO₂ in kg)."""
+    totals = {
+        k: sum(r[k] for r in rows)
+        for k in ("devices", "online", "offline", "faults")
+    }
+    for k in ("energy_kwh", "cost", "co2_kg", "saving_kwh"):
+        totals[k] = round(sum(r[k] for r in rows), 2)
+    baseline = totals["energy_kwh"] + totals["saving_kwh"]
+    totals["saving_pct"] = round(100 * totals["saving_kwh"] / baseline, 1) if baseline else 0
+    return totals
+
+
+async def _get_fleet_overview(inp: dict, tb: TBClient, ctx: EntityContext | None = None) -> dict:
+    """Per-site and per-region rollups across the whole customer.
+
+    Online flags come from bulk entity data queries and faults from one
+    alarm listing; only the energy/savings sums need a call per device,
+    run through the bounded fan-out.
+    """
+    # Never from the tool input: the rollup is cached under this customer
+    customer_id = ctx.customer_id if ctx else None
+    if not customer_id:
+        return {"error": "No customer in context."}
+    time_range = inp.get("time_range", "today")
+    sort_key, descending = _FLEET_SORT.get(inp.get("sort_by", "energy"), _FLEET_SORT["energy"])
+    limit = inp.get("limit") or 20
+    start_ts, end_ts = resolve_time_range(time_range)
+
+    hierarchy = get_cached_hierarchy(customer_id)
+    if hierarchy is None:
+        hierarchy = await _get_hierarchy({"customer_id": customer_id}, tb, ctx)
+        set_cached_hierarchy(customer_id, hierarchy)
+    sites = _fleet_sites(hierarchy)
+    device_site = {d["id"]: site["id"] for site, _ in sites for d in site.get("devices", [])}
+    device_ids = list(device_site)
+
+    async def online_flags() -> dict[str, dict]:
+        if not device_ids:
+            return {}
+        try:
+            return await tb.get_latest_values_bulk(device_ids, ["active"], "SERVER_ATTRIBUTE")
+        except httpx.HTTPStatusError as exc:
+            if not _unsupported(exc):
+                raise
+            fan = await fan_out(
+                device_ids,
+                lambda d: tb.get_attributes("DEVICE", d, "SERVER_SCOPE", ["active"]),
+            )
+            return {d: a for d, a in zip(device_ids, fan.results) if a is not None}
+
+    async def device_sums(dev_id: str) -> dict[str, float]:
+        hist = await tb.get_historical_telemetry(
+            "DEVICE", dev_id, _FLEET_SUM_KEYS, start_ts, end_ts, agg="SUM"
+        )
+        return {k: sum(b["value"] for b in hist.get(k, [])) for k in _FLEET_SUM_KEYS}
+
+    online, alarms, fan = await asyncio.gather(
+        online_flags(),
+        tb.get_alarms(status="ACTIVE"),
+        fan_out(device_ids, device_sums),
+    )
+
+    faults: dict[str, int] = {}
+    for alarm in alarms:
+        site_id = device_site.get(alarm.get("originator", {}).get("id"))
+        if site_id:
+            faults[site_id] = faults.get(site_id, 0) + 1
+
+    index = {dev_id: i for i, dev_id in enumerate(device_ids)}
+    rows: list[dict] = []
+    for site, region in sites:
+        devices = [d["id"] for d in site.get("devices", [])]
+        sums = dict.fromkeys(_FLEET_SUM_KEYS, 0.0)
+        for dev_id in devices:
+            for k, v in (fan.results[index[dev_id]] or {}).items():
+                sums[k] += v
+        up = sum(
+            1 for d in devices
+            if str(online.get(d, {}).get("active", "")).lower() == "true"
+        )
+        baseline = sums["energy_wh"] + sums["energy_saving_wh"]
+        row = {
+            "site": site.get("name", ""),
+            "region": region,
+            "devices": len(devices),
+            "online": up,
+            "offline": len(devices) - up,
+            "faults": faults.get(site["id"], 0),
+            "energy_kwh": wh_to_kwh(sums["energy_wh"]),
+            "cost": round(sums["cost_currency"], 2),
+            "co2_kg": grams_to_kg(sums["co2_grams"]),
+            "saving_kwh": wh_to_kwh(sums["energy_saving_wh"]),
+            "saving_pct": round(100 * sums["energy_saving_wh"] / baseline, 1) if baseline else 0,
+            "site_id": site["id"],
+        }
+        rows.append(row)
+
+    regions: dict[str, list[dict]] = {}
+    for row in rows:
+        regions.setdefault(row["region"], []).append(row)
+
+    ranked = sorted(rows, key=lambda r: r[sort_key], reverse=descending)[:limit]
+    result = {
+        "customer": hierarchy.get("customer", ""),
+        "time_range": time_range,
+        "site_count": len(rows),
+        "totals": _fleet_totals(rows),
+        "regions": [
+            {"region": name, "sites": len(members), **_fleet_totals(members)}
+            for name, members in regions.items() if name
+        ],
+        "ranked_by": inp.get("sort_by", "energy"),
+        # Compact table: one list per site in column order, IDs last
+        "columns": _FLEET_COLUMNS + ["site_id"],
+        "sites": [[r[c] for c in _FLEET_COLUMNS + ["site_id"]] for r in ranked],
+    }
+    if fan.failed_count:
+        # Totals cover only the devices that answered
+        result["failed_count"] = fan.failed_count
+    return result
+
+
+def _hierarchy_node(node: dict, entity_id: str) -> dict | None:
+    """The estate / region / site node with *entity_id*, or None."""
+    for key in ("estates", "regions", "sites"):
+        for child in node.get(key, []):
+            if child.get("id") == entity_id:
+                return child
+            found = _hierarchy_node(child, entity_id)
+            if found is not None:
+                return found
+    return None
+
+
+async def _scope_devices(
+    inp: dict, tb: TBClient, ctx: EntityContext | None
+) -> tuple[list[tuple[dict, dict]], str] | dict:
+    """(device, site node) pairs under the requested scope, and its name.
+
+    The scope is ``entity_id``, else the dashboard asset, else the whole
+    customer. Returns an error dict when it cannot be resolved.
+    """
+    customer_id = ctx.customer_id if ctx else None
+    if not customer_id:
+        return {"error": "No customer in context."}
+    hierarchy = get_cached_hierarchy(customer_id)
+    if hierarchy is None:
+        hierarchy = await _get_hierarchy({"customer_id": customer_id}, tb, ctx)
+        set_cached_hierarchy(customer_id, hierarchy)
+
+    entity_id = inp.get("entity_id")
+    if not entity_id and ctx and ctx.entity_type == "ASSET":
+        entity_id = ctx.entity_id
+    scope, name = hierarchy, hierarchy.get("customer", "")
+    if entity_id and entity_id != customer_id:
+        node = _hierarchy_node(hierarchy, entity_id)
+        if node is None:
+            return {"error": f"Asset {entity_id} not found in the customer hierarchy."}
+        name = node.get("name", "")
+        # Walk the node as if it were the top level (sites included)
+        scope = {"estates": [node]}
+    sites = _fleet_sites(scope)
+    return [(d, site) for site, _ in sites for d in site.get("devices", [])], name
+
+
+async def _rank_devices(inp: dict, tb: TBClient, ctx: EntityContext | None = None) -> dict:
+    """Top-K devices by one key within a scope."""
+    scoped = await _scope_devices(inp, tb, ctx)
+    if isinstance(scoped, dict):
+        return scoped
+    members, scope_name = scoped
+    key = inp["key"]
+    time_range = inp.get("time_range", "latest")
+    agg = inp.get("aggregation", "SUM")
+    largest = inp.get("order", "top") != "bottom"
+    k = min(inp.get("k") or 10, 50)
+
+    values, errors = await _telemetry_values(
+        [d["id"] for d, _ in members], [key], time_range, agg, tb
+    )
+    known = [
+        (dev, site, v) for dev, site in members
+        if isinstance(v := values.get(dev["id"], {}).get(key), (int, float))
+    ]
+    if not known:
+        return {"error": f"No {key} data for the devices in {scope_name}."}
+    arr = np.array([v for _, _, v in known], dtype=np.float64)
+    picked = top_k(arr, k, largest)
+
+    span = "latest" if time_range == "latest" else f"{agg}, {time_range}"
+    result = {
+        "scope": scope_name,
+        "key": key,
+        "time_range": time_range,
+        "explanation": (
+            f"{'Top' if largest else 'Bottom'} {len(picked)} of {len(known)} devices "
+            f"by {key} ({span}); scope median {np.median(arr):.4g}."
+        ),
+        "ranked": [
+            {
+                "rank": rank,
+                "device": known[i][0].get("name", ""),
+                "device_id": known[i][0]["id"],
+                "site": known[i][1].get("name", ""),
+                "value": round(float(arr[i]), 3),
+            }
+            for rank, i in enumerate(picked, 1)
+        ],
+    }
+    if errors:
+        result["failed_count"] = len(errors)
+    return result
+
+
+_ANOMALY_KEYS = ["power_watts", "driver_temperature", "saving_pct"]
+
+
+async def _find_anomalies(inp: dict, tb: TBClient, ctx: EntityContext | None = None) -> dict:
+    """Devices that deviate from their site peers, ranked by |score|."""
+    scoped = await _scope_devices(inp, tb, ctx)
+    if isinstance(scoped, dict):
+        return scoped
+    members, scope_name = scoped
+    keys = inp.get("keys") or _ANOMALY_KEYS
+    method = inp.get("method", "mad")
+    threshold = inp.get("threshold", 3.5)
+    time_range = inp.get("time_range", "latest")
+    k = min(inp.get("k") or 10, 50)
+
+    values, errors = await _telemetry_values(
+        [d["id"] for d, _ in members], keys, time_range, "AVG", tb
+    )
+    site_codes: dict[str, int] = {}
+    flagged: list[dict] = []
+    checked: dict[str, int] = {}
+    for key in keys:
+        known = [
+            (dev, site, v) for dev, site in members
+            if isinstance(v := values.get(dev["id"], {}).get(key), (int, float))
+        ]
+        checked[key] = len(known)
+        if len(known) < 3:
+            continue
+        arr = np.array([v for _, _, v in known], dtype=np.float64)
+        groups = np.array(
+            [site_codes.setdefault(site["id"], len(site_codes)) for _, site, _ in known],
+            dtype=np.int64,
+        )
+        scores, centres = peer_scores(arr, groups, method)
+        for i in np.flatnonzero(np.abs(scores) >= threshold):
+            dev, site, value = known[i]
+            flagged.append({
+                "device": dev.get("name", ""),
+                "device_id": dev["id"],
+                "site": site.get("name", ""),
+                "key": key,
+                "value": round(float(value), 3),
+                "peer_centre": round(float(centres[i]), 3),
+                "score": round(float(scores[i]), 1),
+                "explanation": (
+                    f"{key} {value:.4g} vs peer {'median' if method == 'mad' else 'mean'} "
+                    f"{centres[i]:.4g} ({'robust ' if method == 'mad' else ''}"
+                    f"z {scores[i]:+.1f})"
+                ),
+            })
+
+    flagged.sort(key=lambda f: abs(f["score"]), reverse=True)
+    result = {
+        "scope": scope_name,
+        "method": method,
+        "threshold": threshold,
+        "time_range": time_range,
+        "devices_checked": checked,
+        "anomaly_count": len(flagged),
+        "anomalies": flagged[:k],
+    }
+    if errors:
+        result["failed_count"] = len(errors)
+    return result
+
+
+async def _get_command_progress(inp: dict, tb: TBClient, ctx: EntityContext | None = None) -> dict:
+    """Progress of the customer's paced command batches."""
+    customer_id = ctx.customer_id if ctx else "unknown"
+    batch_id = inp.get("batch_id")
+    if batch_id:
+        batch = pacer.get(batch_id)
+        if batch is None or batch.customer_id != customer_id:
+            return {"error": f"No command batch {batch_id} found."}
+        progress = batch.progress()
+        progress["problems"] = [
+            r for r in batch.results if r["status"] in ("failed", "timed_out")
+        ]
+        return progress
+    batches = pacer.batches(customer_id)[:10]
+    return {
+        "batch_count": len(batches),
+        "batches": [b.progress() for b in batches],
     }
@@ -1,6 +1,9 @@
 /* ===================================================================
    SignConnect Chat Widget — controller.js
    Floating chat panel that talks to the AI backend via POST /api/chat.
+   Opening the panel calls POST /api/chat/warmup so the backend loads
+   the hierarchy and prefetches the context entity before the first
+   message.
    Follows the same lifecycle & HTTP patterns as nav-tree and
    site-energy-summary widgets.
    =================================================================== */
@@ -9,6 +12,9 @@ var API_URL_DEFAULT = '/svc/chat';
 var HISTORY_LIMIT = 20;
 var STORAGE_LIMIT = 50;
 var STORAGE_EXPIRY_MS = 86400000; // 24 hours
+var JOB_POLL_WAIT_S = 20;          // long-poll window for background jobs
+var JOB_POLL_RETRY_MS = 1000;
+var JOB_POLL_MIN_INTERVAL_MS = 6000; // stays under the 10/minute per-IP limit
 
 // ── SVG icons ──────────────────────────────────────────────────────
 var ICON_CHAT = '<svg viewBox="0 0 24 24"><path d="M20 2H4c-1.1 0-2 .9-2 2v18l4-4h14c1.1 0 2-.9 2-2V4c0-1.1-.9-2-2-2zm0 14H5.2L4 17.2V4h16v12z"/></svg>';
@@ -38,6 +44,7 @@ self.onInit = function () {
     var hasOpened = false;      // track first open for welcome message
     var lastUserMessage = '';
     var consecutiveErrors = 0;
+    var destroyed = false;
 
     // Build static DOM
     container.innerHTML = buildShell();
@@ -68,6 +75,7 @@ self.onInit = function () {
         isOpen = !isOpen;
         if (isOpen) {
             panel.classList.add('sc-chat-open');
+            warmUp();
             if (!hasOpened) {
                 hasOpened = true;
                 // Only show welcome if no restored history
@@ -85,6 +93,14 @@ self.onInit = function () {
         }
     }
 
+    // ── Warm backend caches (fire and forget) ───────────────────
+    function warmUp() {
+        toPromise(self.ctx.http.post(API_URL + '/api/chat/warmup', getEntityContext()))
+            .catch(function (err) {
+                console.warn('[SC-CHAT] Warmup failed:', err);
+            });
+    }
+
     // ── Auto-grow textarea ──────────────────────────────────────
     function autoGrow() {
         input.style.height = 'auto';
@@ -140,22 +156,15 @@ self.onInit = function () {
             context: getEntityContext()
         };
 
-        // POST to backend (RxJS observable → promise, matching existing pattern)
-        var obs = self.ctx.http.post(API_URL + '/api/chat', body);
-        var promise;
-        if (obs && typeof obs.toPromise === 'function') {
-            promise = obs.toPromise();
-        } else {
-            promise = new Promise(function (resolve, reject) {
-                obs.subscribe(
-                    function (data) { resolve(data); },
-                    function (err) { reject(err); }
-                );
-            });
-        }
-
-        promise.then(function (resp) {
+        // POST to backend; high fan-out requests come back as a background job
+        toPromise(self.ctx.http.post(API_URL + '/api/chat', body)).then(function (resp) {
             var data = resp.data || resp;
+            var jobId = data.metadata && data.metadata.job_id;
+            if (!jobId) return data;
+            appendBubble('assistant', renderMarkdown(data.response || ''), Date.now());
+            scrollToBottom();
+            return pollJob(jobId, typingEl);
+        }).then(function (data) {
             var respText = data.response || 'No response received.';
             var chips = (data.metadata && data.metadata.suggestions) || [];
 
@@ -179,8 +188,75 @@ self.onInit = function () {
         });
     }
 
+    // ── Background jobs ─────────────────────────────────────────
+
+    // Long-poll /api/chat/jobs/{id} until the final response is ready,
+    // showing per-site progress in the typing indicator meanwhile.
+    function pollJob(jobId, typingEl) {
+        var since = 0;
+        var sitesDone = 0;
+        return new Promise(function (resolve, reject) {
+            var lastPoll = 0;
+
+            // Polls are spaced out so a job's burst of events doesn't hit
+            // the rate limit; a 429 just waits for the next slot
+            function schedule(delay) {
+                var wait = Math.max(delay, lastPoll + JOB_POLL_MIN_INTERVAL_MS - Date.now());
+                setTimeout(poll, Math.max(0, wait));
+            }
+
+            function poll() {
+                if (destroyed) return;
+                lastPoll = Date.now();
+                var url = API_URL + '/api/chat/jobs/' + encodeURIComponent(jobId) +
+                    '?since=' + since + '&wait=' + JOB_POLL_WAIT_S;
+                toPromise(self.ctx.http.get(url)).then(function (resp) {
+                    var job = resp.data || resp;
+                    since = job.next || since;
+                    (job.events || []).forEach(function (ev) {
+                        if (ev.type === 'partial') sitesDone++;
+                    });
+                    if (sitesDone) setTypingLabel(typingEl, sitesDone + ' sites done');
+                    if (job.result) {
+                        resolve(job.result);
+                    } else {
+                        schedule(job.status === 'queued' ? JOB_POLL_RETRY_MS : 0);
+                    }
+                }).catch(function (err) {
+                    if (err && err.status === 429) schedule(JOB_POLL_MIN_INTERVAL_MS);
+                    else reject(err);
+                });
+            }
+            poll();
+        });
+    }
+
+    function setTypingLabel(typingEl, text) {
+        if (!typingEl) return;
+        var label = typingEl.querySelector('.sc-chat-typing-label');
+        if (!label) {
+            label = document.createElement('span');
+            label.className = 'sc-chat-typing-label';
+            typingEl.appendChild(label);
+        }
+        label.textContent = text;
+    }
+
     // ── Helpers ─────────────────────────────────────────────────
 
+    // RxJS observable → promise, matching the other widgets' pattern
+    function toPromise(obs) {
+        if (obs && typeof obs.toPromise === 'function') {
+            return obs.toPromise();
+        }
+        return new Promise(function (resolve, reject) {
+            obs.subscribe(
+                function (data) { resolve(data); },
+                function (err) { reject(err); }
+            );
+        });
+    }
+
     function addAssistantMessage(text, chips, timestamp) {
         appendBubble('assistant', renderMarkdown(text), timestamp);
         if (chips && chips.length) {
@@ -489,6 +565,7 @@ self.onInit = function () {
 
     // ── Store references for cleanup ────────────────────────────
     self._chatCleanup = function () {
+        destroyed = true;
         fab.removeEventListener('click', togglePanel);
         closeBtn.removeEventListener('click', togglePanel);
     };
@@ -84,13 +84,19 @@ async def process_single_device(device: DeviceRegistration, client: httpx.AsyncC
         error = tts_result["error"]
 
     # Register in TB (regardless of TTS result)
-    tb_result = await register_device_tb(device.device_name, device.dev_eui, device.join_eui, client, tb_token)
+    tb_result = await register_device_tb(
+        device.device_name, device.dev_eui, device.join_eui, client, tb_token,
+        supports_class_c=device.supports_class_c,
+    )
     if tb_result.get("reauth"):
         # Re-authenticate and retry once
         try:
             tb_token = await get_tb_token(client)
             app.state.tb_token = tb_token
-            tb_result = await register_device_tb(device.device_name, device.dev_eui, device.join_eui, client, tb_token)
+            tb_result = await register_device_tb(
+                device.device_name, device.dev_eui, device.join_eui, client, tb_token,
+                supports_class_c=device.supports_class_c,
+            )
         except Exception as e:
             tb_result = {"success": False, "error": f"TB reauth failed: {e}"}
 
@@ -21,9 +21,18 @@ async def get_tb_token(client: httpx.AsyncClient) -> str:
 
 
 async def register_device_tb(
-    device_name: str, dev_eui: str, join_eui: str, client: httpx.AsyncClient, token: str
+    device_name: str,
+    dev_eui: str,
+    join_eui: str,
+    client: httpx.AsyncClient,
+    token: str,
+    supports_class_c: bool = True,
 ) -> dict:
-    """Create a device in ThingsBoard and save attributes."""
+    """Create a device in ThingsBoard and save attributes.
+
+    ``supports_class_c`` is saved as a server attribute; ai-tools only adds
+    Class C devices to a site's multicast group.
+    """
     headers = {"X-Authorization": f"Bearer {token}"}
 
     # Step 1: Create device (no customer = pool)
@@ -56,7 +65,7 @@ async def register_device_tb(
     except Exception as e:
         return {"success": False, "error": f"TB credentials error: {e}"}
 
-    # Step 3: Save server attributes (dev_eui + registered_at)
+    # Step 3: Save server attributes (dev_eui, class C support, registered_at)
     try:
         resp = await client.post(
             f"{config.TB_URL}/api/plugins/telemetry/DEVICE/{device_id}/attributes/SERVER_SCOPE",
@@ -64,6 +73,7 @@ async def register_device_tb(
             json={
                 "dev_eui": dev_eui,
                 "join_eui": join_eui,
+                "supports_class_c": supports_class_c,
                 "registered_at": datetime.utcnow().isoformat(),
             },
         )